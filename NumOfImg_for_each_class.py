@@ -1,4 +1,5 @@
 import os
+import sys
 import matplotlib.pyplot as plt
 from collections import Counter
 
@@ -10,8 +11,25 @@ IMAGE_DIR = os.path.join(SCRIPT_DIR, 'images')
 LABEL_DIR = os.path.join(SCRIPT_DIR, 'labels')
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
 
+# Global class names, in data.yaml order (shared with the API in recycling_api/class_metadata.py)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, 'recycling_api'))
+from class_metadata import AVERAGE_WEIGHTS_G, load_data_yaml_names  # noqa: E402
 
-CLASS_NAMES = ['cardboard_bags', 'cardboard_boxes', 'cardboard_cups', 'cardboard_holders']
+# -------------------------------
+# Class names for the scanned folder
+# -------------------------------
+def load_class_names(folder):
+    """
+    Names in the ids the folder's labels use: its own classes.txt in a raw material
+    folder (local ids), else the global data.yaml names (a merged split from split.py).
+    """
+    classes_path = os.path.join(folder, 'classes.txt')
+    if os.path.exists(classes_path):
+        with open(classes_path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    return load_data_yaml_names() or list(AVERAGE_WEIGHTS_G)
+
+CLASS_NAMES = load_class_names(SCRIPT_DIR)
 
 # -------------------------------
 # Count class occurrences per bounding box
@@ -3,99 +3,13 @@ import numpy as np
 from ultralytics.utils.plotting import Annotator  # Import the new tool
 import cv2  # Import OpenCV
 import math
+import os
+import sys
 
-# --- Step 1: Define your "Weight Lookup Table" ---
-# (This is your dictionary, exactly as you provided it)
-AVERAGE_WEIGHTS_G = {
-    # Cardboard
-    'cardboard_bags': 50,
-    'cardboard_boxes': 400,
-    'cardboard_cups': 10,
-    'cardboard_holders': 50,
-    
-    # Glass
-    'glass_bottle_medium': 300,
-    'glass_bottle_small': 200,
-    'glass_cup': 250,
-    'glass_jar': 350,
-    'glass_jug': 1200,
-    
-    # Metal (HIGHLY VARIABLE)
-    'AL_foil': 10,
-    'chair_iron': 7000,
-    'door_handle_iron': 350,
-    'fan_iron': 5000,
-    'kettle_AL': 800,
-    'large_can_AL': 18,
-    'large_cooking_pan_AL': 1500,
-    'large_fork_AL': 80,
-    'large_knife_AL': 80,
-    'large_spoon_AL': 80,
-    'medium_fork_AL': 50,
-    'medium_spoon_AL': 50,
-    'refrigerator_iron': 85000,
-    'small_can_AL': 15,
-    'small_cooking_pan_AL': 700,
-    'small_fork_AL': 30,
-    'small_knife_AL': 30,
-    'small_spoon_AL': 30,
-    'stove_iron': 70000,
-    'table_iron': 15000,
-    'tap_iron': 2000,
-    'washer_machine_iron': 75000,
-    
-    # Paper
-    'Cartoon_paper': 60,
-    'Tissue_Paper': 1,
-    'newspapers': 350,
-    'paper': 5,
-    
-    # Plastic
-    'plastic_bags': 8,
-    'plastic_bottles_large': 25,
-    'plastic_bottles_medium': 22,
-    'plastic_bottles_small': 10,
-    'plastic_boxes': 1000,
-    'plastic_chairs': 3500,
-    'plastic_cups': 12,
-    'plastic_utensils': 3,
-    
-    # Textile (HIGHLY VARIABLE)
-    'child_chemise': 100,
-    'child_dress': 150,
-    'child_jacket': 400,
-    'child_pullover': 250,
-    'child_short': 100,
-    'child_skirt': 100,
-    'child_t_shirt': 100,
-    'child_trouser': 200,
-    'men_chemise': 150,
-    'men_jacket': 1100,
-    'men_pullover': 350,
-    'men_short': 250,
-    'men_t_shirt': 170,
-    'men_trouser': 400,
-    'women_blouse': 130,
-    'women_chemise': 130,
-    'women_gloves': 50,
-    'women_jacket': 900,
-    'women_pullover': 300,
-    'women_scarves': 100,
-    'women_skirt': 300,
-    'women_socks': 40,
-    'women_summer_dress': 250,
-    'women_trousers': 350,
-    'women_winter_dress': 500,
-    
-    # Wood (EXTREMELY VARIABLE)
-    'King&Queen bed': 100000,
-    'Tall chair': 7000,
-    'closet': 80000,
-    'dining table': 60000,
-    'full bed': 55000,
-    'seat': 6000,
-    'side table': 10000,
-}
+# --- Step 1: Weight lookup table ---
+# Shared with the API so the two never drift apart (see recycling_api/class_metadata.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recycling_api'))
+from class_metadata import AVERAGE_WEIGHTS_G  # noqa: E402
 
 # --- Step 2: Load your ALREADY-TRAINED model ---
 # *** USE 'r' FOR YOUR WINDOWS PATHS ***
@@ -0,0 +1,159 @@
+import os
+import json
+import math
+import shutil
+import argparse
+import numpy as np
+import yaml
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+# -------------------------------
+# Configuration
+# -------------------------------
+SOURCE_DATASET_PATH = 'splitted'         # Output of split.py (contains data.yaml)
+IMG_SIZE = 640                           # Must match the imgsz used for training
+NUM_THREADS = os.cpu_count() or 4        # cv2 releases the GIL while decoding/resizing
+JPEG_QUALITY = 95
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+SPLITS = ('train', 'val', 'test')
+# -------------------------------
+
+
+def resized_shape(h0, w0, imgsz):
+    """Same long-side resize that ultralytics' BaseDataset.load_image applies."""
+    r = imgsz / max(h0, w0)
+    if r == 1:
+        return h0, w0
+    return min(math.ceil(h0 * r), imgsz), min(math.ceil(w0 * r), imgsz)
+
+
+def is_up_to_date(source_path, npy_path):
+    return os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(source_path)
+
+
+def cache_one_image(source_path, dest_image_path, imgsz):
+    """
+    Decodes and resizes one image, then writes a small JPEG (what ultralytics lists and
+    verifies) and a raw uint8 .npy next to it (what ultralytics actually loads).
+
+    Returns:
+        (file name, original (h, w), cached (h, w)) or None on failure.
+    """
+    npy_path = os.path.splitext(dest_image_path)[0] + '.npy'
+    name = os.path.basename(dest_image_path)
+    if is_up_to_date(source_path, npy_path) and os.path.exists(dest_image_path):
+        im = np.load(npy_path, mmap_mode='r')  # Header only
+        return name, None, tuple(im.shape[:2])
+
+    im = cv2.imread(source_path)
+    if im is None:
+        print(f"  - Warning: Could not read image {source_path}")
+        return None
+    h0, w0 = im.shape[:2]
+    h, w = resized_shape(h0, w0, imgsz)
+    if (h, w) != (h0, w0):
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+
+    # Write the image first so the .npy is never older than it (ultralytics checks mtimes)
+    cv2.imwrite(dest_image_path, im, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    np.save(npy_path, np.ascontiguousarray(im), allow_pickle=False)
+    return name, (h0, w0), (h, w)
+
+
+def cache_split(source_dir, dest_dir, split, imgsz, executor, previous_entries):
+    """Pre-resizes one split's images and copies its (normalized, size-independent) labels."""
+    source_images = os.path.join(source_dir, split, 'images')
+    source_labels = os.path.join(source_dir, split, 'labels')
+    dest_images = os.path.join(dest_dir, split, 'images')
+    dest_labels = os.path.join(dest_dir, split, 'labels')
+    if not os.path.exists(source_images):
+        print(f"  - Skipping '{split}' (no images folder).")
+        return None
+    os.makedirs(dest_images, exist_ok=True)
+    os.makedirs(dest_labels, exist_ok=True)
+
+    jobs = []
+    for f in sorted(os.listdir(source_images)):
+        stem, ext = os.path.splitext(f)
+        if ext.lower() not in IMG_EXTENSIONS:
+            continue
+        # Always store as .jpg so the .npy sits next to a file ultralytics recognizes
+        jobs.append((os.path.join(source_images, f), os.path.join(dest_images, stem + '.jpg')))
+
+    entries = {}
+    for result in executor.map(lambda job: cache_one_image(job[0], job[1], imgsz), jobs):
+        if result is not None:
+            name, hw0, hw = result
+            if hw0 is None:  # Up to date; keep the original size recorded last time
+                hw0 = previous_entries.get(name, {}).get('orig_hw')
+            entries[name] = {'orig_hw': hw0, 'hw': hw}
+
+    labels_copied = 0
+    if os.path.exists(source_labels):
+        for f in os.listdir(source_labels):
+            if f.endswith('.txt'):
+                src, dst = os.path.join(source_labels, f), os.path.join(dest_labels, f)
+                if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src):
+                    shutil.copy2(src, dst)
+                labels_copied += 1
+
+    print(f"  - {split}: {len(entries)} images cached, {labels_copied} labels")
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-decode and resize the split dataset for training.')
+    parser.add_argument('--source', default=SOURCE_DATASET_PATH, help="Split dataset dir (with data.yaml).")
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE)
+    parser.add_argument('--output', help="Cache dir (default: '<source>_<imgsz>').")
+    parser.add_argument('--threads', type=int, default=NUM_THREADS)
+    args = parser.parse_args()
+
+    source_dir = os.path.abspath(args.source)
+    dest_dir = os.path.abspath(args.output or f"{source_dir.rstrip(os.sep)}_{args.imgsz}")
+    with open(os.path.join(source_dir, 'data.yaml'), 'r', encoding='utf-8') as f:
+        source_config = yaml.safe_load(f)
+
+    print(f"Building {args.imgsz}px image cache")
+    print(f"Source: {source_dir}")
+    print(f"Destination: {dest_dir}\n")
+
+    index_path = os.path.join(dest_dir, 'cache_index.json')
+    previous = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('imgsz') != args.imgsz:
+            print(f"Error: {dest_dir} was built for imgsz={previous.get('imgsz')}. Use another --output.")
+            return
+
+    index = {'imgsz': args.imgsz, 'source': source_dir, 'splits': {}}
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for split in SPLITS:
+            entries = cache_split(source_dir, dest_dir, split, args.imgsz, executor,
+                                  previous.get('splits', {}).get(split, {}))
+            if entries is not None:
+                index['splits'][split] = entries
+
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+    # data.yaml for the cache; split paths use forward slashes so it works on any OS
+    yaml_content = {'path': dest_dir}
+    for split in SPLITS:
+        if split in index['splits']:
+            yaml_content[split] = f'{split}/images'
+    yaml_content['nc'] = source_config['nc']
+    yaml_content['names'] = source_config['names']
+    yaml_path = os.path.join(dest_dir, 'data.yaml')
+    with open(yaml_path, 'w', encoding='utf-8') as f:
+        yaml.dump(yaml_content, f, sort_keys=False, default_flow_style=False)
+
+    total = sum(len(entries) for entries in index['splits'].values())
+    print(f"\nCached {total} images. Train with data={yaml_path} and cache='disk'")
+    print("so ultralytics loads the .npy arrays instead of decoding JPEGs every epoch.")
+
+
+if __name__ == '__main__':
+    main()
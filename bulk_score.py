@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import cv2
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+
+# -------------------------------
+# Configuration
+# -------------------------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(SCRIPT_DIR, 'recycling_api')
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+SHARD_SIZE = 2000            # Images per shard (the unit of checkpointing)
+BATCH_SIZE = 16              # Images per model.predict call
+PREFETCH_THREADS = 4         # Decoder threads per worker process
+PREFETCH_BATCHES = 2         # Batches decoded ahead of the model
+MANIFEST_NAME = 'manifest.json'
+PATHS_NAME = 'manifest_paths.txt'     # One path per line; too large for JSON at archive scale
+# -------------------------------
+
+sys.path.insert(0, API_DIR)
+import model as model_logic  # noqa: E402
+
+
+def list_source_images(source_dir=None, file_list=None):
+    """Walks a directory tree or reads a file list; sorted so shards are reproducible."""
+    if file_list:
+        with open(file_list, 'r', encoding='utf-8') as f:
+            return sorted(line.strip() for line in f if line.strip())
+    paths = []
+    for root, _, files in os.walk(source_dir):
+        for f in files:
+            if f.lower().endswith(IMG_EXTENSIONS):
+                paths.append(os.path.join(root, f))
+    return sorted(paths)
+
+
+def load_or_create_manifest(output_dir, args):
+    """
+    The manifest freezes the image list and shard size on the first run, so a resumed
+    run shards exactly the same way even if new files appeared in the source since.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    paths_path = os.path.join(output_dir, PATHS_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        with open(paths_path, 'r', encoding='utf-8') as f:
+            paths = f.read().splitlines()
+        print(f"Resuming: {len(paths)} images in {manifest['num_shards']} shards.")
+        return manifest, paths
+
+    paths = list_source_images(args.source, args.file_list)
+    manifest = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'model': os.path.abspath(args.model),
+        'num_images': len(paths),
+        'shard_size': args.shard_size,
+        'num_shards': (len(paths) + args.shard_size - 1) // args.shard_size,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    # Paths first, manifest last: the manifest only exists once both are complete
+    with open(paths_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(paths))
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    print(f"Found {len(paths)} images -> {manifest['num_shards']} shards of {args.shard_size}.")
+    return manifest, paths
+
+
+def shard_path(output_dir, shard_id):
+    return os.path.join(output_dir, f'shard_{shard_id:06d}.jsonl')
+
+
+# -------------------------------
+# Worker process
+# -------------------------------
+_worker = {}
+
+
+def init_worker(model_path, thresholds_path, torch_threads):
+    """Loads the model once per worker process."""
+    import torch
+    torch.set_num_threads(torch_threads)
+    cv2.setNumThreads(1)  # Decoding is parallelized by the prefetch threads instead
+    model = model_logic.load_model(model_path)
+    thresholds = model_logic.load_class_thresholds(thresholds_path) if thresholds_path else None
+    _worker['model'] = model
+    _worker['thresholds'] = thresholds
+    _worker['class_filter'] = model_logic.build_class_filter(model, thresholds)
+    _worker['metadata'] = model_logic.class_metadata_for(model)
+
+
+def decode(path):
+    return path, cv2.imread(path)
+
+
+def prefetched_batches(paths, executor, batch_size):
+    """Yields decoded batches while the next PREFETCH_BATCHES batches decode in background threads."""
+    pending = deque()
+    index = 0
+    max_pending = batch_size * (PREFETCH_BATCHES + 1)
+    while index < len(paths) or pending:
+        while index < len(paths) and len(pending) < max_pending:
+            pending.append(executor.submit(decode, paths[index]))
+            index += 1
+        batch = [pending.popleft().result() for _ in range(min(batch_size, len(pending)))]
+        yield batch
+
+
+def score_batch(model, batch, thresholds, class_filter):
+    """Runs one batched prediction and converts each result into a JSON-serializable record."""
+    class_ids, conf_by_id = class_filter
+    readable = [(path, img) for path, img in batch if img is not None]
+    records = [{'path': path, 'error': 'decode_failed'} for path, img in batch if img is None]
+    if not readable:
+        return records
+
+    results = model.predict(
+        [img for _, img in readable],
+        conf=float(conf_by_id.min()),
+        iou=thresholds['iou'] if thresholds else model_logic.DEFAULT_IOU,
+        max_det=thresholds['max_det'] if thresholds else model_logic.DEFAULT_MAX_DET,
+        classes=class_ids,
+        verbose=False,
+    )
+    metadata = _worker['metadata']
+    for (path, img), result in zip(readable, results):
+        boxes = result.boxes
+        cls = boxes.cls.cpu().numpy().astype(int)
+        conf = boxes.conf.cpu().numpy()
+        xyxy = boxes.xyxy.cpu().numpy().round().astype(int)
+        keep = conf >= conf_by_id[cls]
+        cls, conf, xyxy = cls[keep], conf[keep], xyxy[keep]
+        weights = metadata.weight_g[cls]
+        total_weight = int(np.nansum(weights))
+
+        detections = []
+        for c, s, box, weight in zip(cls.tolist(), conf.tolist(), xyxy.tolist(), weights.tolist()):
+            detections.append({
+                'class_id': c,
+                'material': metadata.names[c],
+                'conf': round(s, 4),
+                'box_xyxy': box,
+                'weight_g': None if math.isnan(weight) else int(weight),
+            })
+        records.append({
+            'path': path,
+            'width': img.shape[1],
+            'height': img.shape[0],
+            'total_weight_g': total_weight,
+            'detections': detections,
+        })
+    return records
+
+
+def score_shard(task):
+    """Scores one shard and publishes it with an atomic rename, which is the checkpoint."""
+    shard_id, paths, output_dir, batch_size = task
+    final_path = shard_path(output_dir, shard_id)
+    tmp_path = final_path + '.tmp'
+    model, thresholds = _worker['model'], _worker['thresholds']
+
+    start = time.perf_counter()
+    count = 0
+    with ThreadPoolExecutor(max_workers=PREFETCH_THREADS) as executor, \
+            open(tmp_path, 'w', encoding='utf-8') as out:
+        for batch in prefetched_batches(paths, executor, batch_size):
+            for record in score_batch(model, batch, thresholds, _worker['class_filter']):
+                out.write(json.dumps(record) + '\n')
+                count += 1
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, final_path)
+    return shard_id, count, time.perf_counter() - start
+
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-score images with the recycling detector.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--source', help='Directory to walk for images.')
+    source.add_argument('--file-list', help='Text file with one image path per line.')
+    parser.add_argument('--model', required=True, help="Path to 'best.pt'.")
+    parser.add_argument('--output', required=True, help='Output dir for shard_*.jsonl files and the manifest.')
+    parser.add_argument('--thresholds', help='Optional class_thresholds.json from sweep_thresholds.py.')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    args = parser.parse_args()
+
+    manifest, paths = load_or_create_manifest(args.output, args)
+    size = manifest['shard_size']
+
+    # Completed shards are exactly the published (renamed) shard files
+    tasks = []
+    for shard_id in range(manifest['num_shards']):
+        if not os.path.exists(shard_path(args.output, shard_id)):
+            tasks.append((shard_id, paths[shard_id * size:(shard_id + 1) * size], args.output, args.batch_size))
+    done = manifest['num_shards'] - len(tasks)
+    if not tasks:
+        print("All shards are already complete.")
+        return
+    print(f"{done} shards already complete, {len(tasks)} to go with {args.workers} workers.")
+
+    torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    start = time.perf_counter()
+    scored = 0
+    # 'spawn' keeps CUDA/torch state from being forked into the workers
+    with get_context('spawn').Pool(
+        processes=args.workers, initializer=init_worker,
+        initargs=(args.model, args.thresholds, torch_threads),
+    ) as pool:
+        for shard_id, count, seconds in pool.imap_unordered(score_shard, tasks):
+            done += 1
+            scored += count
+            rate = scored / (time.perf_counter() - start)
+            print(f"  - shard {shard_id}: {count} images in {seconds:.1f}s "
+                  f"({done}/{manifest['num_shards']} shards, {rate:.1f} img/s overall)")
+
+    print(f"\nScored {scored} images. Results in: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
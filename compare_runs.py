@@ -0,0 +1,465 @@
+import os
+import csv
+import json
+import argparse
+import hashlib
+import numpy as np
+import yaml
+from collections import defaultdict
+from PIL import Image
+
+# -------------------------------
+# Configuration
+# -------------------------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_YAML_PATH = os.path.join(SCRIPT_DIR, 'data.yaml')
+CACHE_DIR = os.path.join(SCRIPT_DIR, '.run_cache')
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+SUMMARY_VERSION = 1          # Bump when the cached summary layout changes
+CONF_THRESHOLD = 0.25        # Score above which a prediction counts as a "detection" per image
+AP_IOU_THRESHOLD = 0.5       # IoU used for the per-class AP50 comparison
+METRIC_TOLERANCE = 0.005     # Drop in a final metric that is flagged as a regression
+AP_TOLERANCE = 0.02          # Drop in a per-class AP that is flagged as a regression
+CURVE_METRIC = 'metrics/mAP50-95(B)'
+FINAL_METRICS = ['metrics/precision(B)', 'metrics/recall(B)', 'metrics/mAP50(B)', 'metrics/mAP50-95(B)']
+# -------------------------------
+
+
+def file_signature(path):
+    """(size, mtime) of a file, or None if it does not exist. Used to invalidate caches."""
+    try:
+        st = os.stat(path)
+        return [st.st_size, int(st.st_mtime)]
+    except FileNotFoundError:
+        return None
+
+
+def cache_file(cache_dir, prefix, path):
+    """Stable cache file name for a directory path."""
+    digest = hashlib.md5(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{prefix}_{digest}.json')
+
+
+def read_json_cache(cache_path, signature):
+    """Returns the cached payload if it was written for the same signature, else None."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('signature') == signature:
+            return cached['payload']
+    except (ValueError, KeyError, OSError):
+        pass
+    return None
+
+
+def write_json_cache(cache_path, signature, payload):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump({'signature': signature, 'payload': payload}, f)
+
+
+# -------------------------------
+# Parsing a single run directory
+# -------------------------------
+def load_args(run_dir):
+    args_path = os.path.join(run_dir, 'args.yaml')
+    if not os.path.exists(args_path):
+        return {}
+    with open(args_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def load_results_csv(run_dir):
+    """Reads results.csv into {column: [values per epoch]}. Column names are stripped."""
+    results_path = os.path.join(run_dir, 'results.csv')
+    if not os.path.exists(results_path):
+        return {}
+    columns = defaultdict(list)
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            for key, value in row.items():
+                try:
+                    columns[key.strip()].append(float(value))
+                except (TypeError, ValueError):
+                    columns[key.strip()].append(None)
+    return dict(columns)
+
+
+def load_predictions(run_dir):
+    """
+    Loads predictions.json into flat NumPy arrays.
+
+    Returns:
+        (image_ids, category_ids, boxes_xyxy, scores) or None if the file is missing.
+    """
+    predictions_path = os.path.join(run_dir, 'predictions.json')
+    if not os.path.exists(predictions_path):
+        return None
+    with open(predictions_path, 'r', encoding='utf-8') as f:
+        predictions = json.load(f)
+
+    image_ids = np.array([p['image_id'] for p in predictions], dtype=object)
+    # ultralytics writes 1-based category ids for custom (non-COCO) datasets
+    category_ids = np.array([p['category_id'] for p in predictions], dtype=np.int32) - 1
+    boxes = np.array([p['bbox'] for p in predictions], dtype=np.float32).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]  # COCO xywh -> xyxy
+    scores = np.array([p['score'] for p in predictions], dtype=np.float32)
+    return image_ids, category_ids, boxes, scores
+
+
+def summarize_detections(image_ids, category_ids, scores, conf_threshold):
+    """Per-image {class_id: count} of predictions above the confidence threshold."""
+    # Images with only low-score predictions still appear, with no detections
+    per_image = {image_id: {} for image_id in set(image_ids)}
+    keep = scores >= conf_threshold
+    for image_id, category_id in zip(image_ids[keep], category_ids[keep]):
+        counts = per_image[image_id]
+        counts[str(category_id)] = counts.get(str(category_id), 0) + 1
+    return per_image
+
+
+# -------------------------------
+# Ground truth and per-class AP
+# -------------------------------
+def load_ground_truth(labels_dir, images_dir, cache_dir):
+    """
+    Loads YOLO labels as absolute xyxy boxes, keyed by image stem.
+    Image sizes are needed to de-normalize the labels, so the result is cached.
+    """
+    label_files = sorted(f for f in os.listdir(labels_dir) if f.endswith('.txt'))
+    signature = [os.path.abspath(labels_dir), len(label_files),
+                 file_signature(labels_dir), file_signature(images_dir)]
+    cache_path = cache_file(cache_dir, 'gt', labels_dir)
+    cached = read_json_cache(cache_path, signature)
+    if cached is not None:
+        return {k: (np.array(v['cls'], dtype=np.int32), np.array(v['boxes'], dtype=np.float32).reshape(-1, 4))
+                for k, v in cached.items()}
+
+    image_paths = {}
+    for f in os.listdir(images_dir):
+        stem, ext = os.path.splitext(f)
+        if ext.lower() in IMG_EXTENSIONS:
+            image_paths[stem] = os.path.join(images_dir, f)
+
+    ground_truth = {}
+    for label_file in label_files:
+        stem = os.path.splitext(label_file)[0]
+        if stem not in image_paths:
+            continue
+        with Image.open(image_paths[stem]) as img:  # Reads the header only
+            width, height = img.size
+        rows = []
+        with open(os.path.join(labels_dir, label_file), 'r') as f:
+            for line in f:
+                values = line.strip().split()
+                if len(values) >= 5:
+                    rows.append([float(v) for v in values[:5]])
+        rows = np.array(rows, dtype=np.float32).reshape(-1, 5)
+        xc, yc, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+        boxes = np.stack([xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2], axis=1)
+        ground_truth[stem] = (rows[:, 0].astype(np.int32), boxes)
+
+    write_json_cache(cache_path, signature,
+                     {k: {'cls': c.tolist(), 'boxes': b.tolist()} for k, (c, b) in ground_truth.items()})
+    return ground_truth
+
+
+def box_iou(boxes_a, boxes_b):
+    """IoU matrix between two sets of xyxy boxes."""
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def average_precision(recall, precision):
+    """COCO-style 101-point interpolated AP."""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    return float(np.interp(np.linspace(0, 1, 101), mrec, mpre).mean())
+
+
+def per_class_ap(image_ids, category_ids, boxes, scores, ground_truth, iou_threshold):
+    """AP per class id, matching predictions to ground truth greedily by score."""
+    order = np.argsort(-scores, kind='stable')
+    image_ids, category_ids, boxes, scores = image_ids[order], category_ids[order], boxes[order], scores[order]
+
+    true_positive = np.zeros(len(scores), dtype=bool)
+    by_image = defaultdict(list)
+    for index, image_id in enumerate(image_ids):
+        by_image[image_id].append(index)
+
+    for image_id, indices in by_image.items():
+        if image_id not in ground_truth:
+            continue
+        gt_cls, gt_boxes = ground_truth[image_id]
+        if len(gt_cls) == 0:
+            continue
+        indices = np.array(indices)
+        ious = box_iou(boxes[indices], gt_boxes)
+        ious[category_ids[indices][:, None] != gt_cls[None, :]] = 0
+        matched = np.zeros(len(gt_cls), dtype=bool)
+        for row, index in enumerate(indices):
+            candidates = np.where(~matched & (ious[row] >= iou_threshold))[0]
+            if len(candidates):
+                best = candidates[np.argmax(ious[row, candidates])]
+                matched[best] = True
+                true_positive[index] = True
+
+    gt_counts = defaultdict(int)
+    for gt_cls, _ in ground_truth.values():
+        for cls_id in gt_cls:
+            gt_counts[int(cls_id)] += 1
+
+    ap = {}
+    for cls_id in sorted(set(gt_counts) | set(int(c) for c in np.unique(category_ids))):
+        mask = category_ids == cls_id
+        n_gt = gt_counts.get(cls_id, 0)
+        if n_gt == 0:
+            continue
+        tp = np.cumsum(true_positive[mask])
+        fp = np.cumsum(~true_positive[mask])
+        recall = tp / n_gt
+        precision = tp / np.maximum(tp + fp, 1)
+        ap[str(cls_id)] = average_precision(recall, precision) if len(tp) else 0.0
+    return ap
+
+
+# -------------------------------
+# Cached run summary
+# -------------------------------
+def load_run_summary(run_dir, cache_dir, ground_truth=None, gt_key=None):
+    """
+    Parses one run directory into a compact summary (args, epoch curves, per-image
+    detection counts and optional per-class AP). The summary is cached on disk and
+    reused until one of the source files changes.
+    """
+    run_dir = os.path.abspath(run_dir)
+    signature = [SUMMARY_VERSION, CONF_THRESHOLD, AP_IOU_THRESHOLD, gt_key] + [
+        file_signature(os.path.join(run_dir, name)) for name in ('args.yaml', 'results.csv', 'predictions.json')
+    ]
+    cache_path = cache_file(cache_dir, 'run', run_dir)
+    summary = read_json_cache(cache_path, signature)
+    if summary is not None:
+        return summary
+
+    summary = {
+        'name': os.path.basename(run_dir.rstrip(os.sep)),
+        'path': run_dir,
+        'args': load_args(run_dir),
+        'epochs': load_results_csv(run_dir),
+        'detections': None,
+        'class_ap': None,
+    }
+    predictions = load_predictions(run_dir)
+    if predictions is not None:
+        image_ids, category_ids, boxes, scores = predictions
+        summary['detections'] = summarize_detections(image_ids, category_ids, scores, CONF_THRESHOLD)
+        if ground_truth is not None:
+            summary['class_ap'] = per_class_ap(image_ids, category_ids, boxes, scores, ground_truth, AP_IOU_THRESHOLD)
+
+    write_json_cache(cache_path, signature, summary)
+    return summary
+
+
+# -------------------------------
+# Comparisons
+# -------------------------------
+def diff_args(summaries):
+    """Returns {key: {run: value}} for every hyperparameter that differs across the runs that have args.yaml."""
+    with_args = [s for s in summaries if s['args']]
+    keys = sorted(set().union(*(s['args'].keys() for s in with_args)))
+    ignored = {'name', 'save_dir'}
+    diffs = {}
+    for key in keys:
+        if key in ignored:
+            continue
+        values = [s['args'].get(key) for s in with_args]
+        if any(v != values[0] for v in values[1:]):
+            diffs[key] = {s['name']: v for s, v in zip(with_args, values)}
+    return diffs
+
+
+def align_curves(summaries, metric):
+    """Aligns one results.csv column across runs by epoch number."""
+    epochs = sorted({int(e) for s in summaries for e in s['epochs'].get('epoch', [])})
+    table = {}
+    for s in summaries:
+        by_epoch = dict(zip((int(e) for e in s['epochs'].get('epoch', [])), s['epochs'].get(metric, [])))
+        table[s['name']] = [by_epoch.get(e) for e in epochs]
+    return epochs, table
+
+
+def epoch_seconds(summary):
+    """Mean wall time per epoch (results.csv stores cumulative time)."""
+    times = summary['epochs'].get('time')
+    if not times or len(times) < 2:
+        return times[0] if times else None
+    return float(np.mean(np.diff([0.0] + times)))
+
+
+def image_differences(baseline, other):
+    """Per-image L1 distance between the {class: count} detections of two runs."""
+    if baseline['detections'] is None or other['detections'] is None:
+        return []
+    differences = []
+    for image_id in sorted(set(baseline['detections']) | set(other['detections'])):
+        a = baseline['detections'].get(image_id, {})
+        b = other['detections'].get(image_id, {})
+        delta = {cls: b.get(cls, 0) - a.get(cls, 0) for cls in set(a) | set(b) if b.get(cls, 0) != a.get(cls, 0)}
+        if delta:
+            differences.append((image_id, sum(abs(v) for v in delta.values()), delta))
+    differences.sort(key=lambda item: -item[1])
+    return differences
+
+
+def find_regressions(baseline, other, class_names):
+    """Flags final-epoch metrics and per-class APs that dropped beyond the tolerances."""
+    regressions = []
+    for metric in FINAL_METRICS:
+        a = baseline['epochs'].get(metric)
+        b = other['epochs'].get(metric)
+        if a and b and a[-1] is not None and b[-1] is not None and b[-1] < a[-1] - METRIC_TOLERANCE:
+            regressions.append(f"{metric}: {a[-1]:.4f} -> {b[-1]:.4f}")
+    if baseline['class_ap'] and other['class_ap']:
+        for cls_id, ap in baseline['class_ap'].items():
+            other_ap = other['class_ap'].get(cls_id, 0.0)
+            if other_ap < ap - AP_TOLERANCE:
+                regressions.append(f"AP50 {class_label(cls_id, class_names)}: {ap:.3f} -> {other_ap:.3f}")
+    return regressions
+
+
+def class_label(cls_id, class_names):
+    cls_id = int(cls_id)
+    return class_names[cls_id] if cls_id < len(class_names) else f'class_{cls_id}'
+
+
+def format_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.4f}'
+    return str(value)
+
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Compare YOLO training run directories.')
+    parser.add_argument('runs', nargs='+', help='Run directories; the first one is the baseline.')
+    parser.add_argument('--data', default=DATA_YAML_PATH, help='data.yaml with the class names.')
+    parser.add_argument('--labels', help='Ground-truth YOLO label dir of the split used for validation.')
+    parser.add_argument('--images', help='Image dir matching --labels (needed to de-normalize boxes).')
+    parser.add_argument('--metric', default=CURVE_METRIC, help='results.csv column to align across epochs.')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--top-images', type=int, default=10, help='How many differing images to list.')
+    parser.add_argument('--json', help='Optional path to write the full comparison report.')
+    args = parser.parse_args()
+
+    with open(args.data, 'r', encoding='utf-8') as f:
+        class_names = yaml.safe_load(f)['names']
+
+    ground_truth, gt_key = None, None
+    if args.labels:
+        images_dir = args.images or os.path.join(os.path.dirname(os.path.abspath(args.labels)), 'images')
+        ground_truth = load_ground_truth(args.labels, images_dir, args.cache_dir)
+        gt_key = [os.path.abspath(args.labels), len(ground_truth)]
+        print(f"Loaded ground truth for {len(ground_truth)} images.")
+
+    summaries = []
+    for run_dir in args.runs:
+        if not os.path.isdir(run_dir):
+            print(f"Warning: Run directory not found: {run_dir}")
+            continue
+        summaries.append(load_run_summary(run_dir, args.cache_dir, ground_truth, gt_key))
+    if len(summaries) < 2:
+        print("Error: Need at least two run directories to compare.")
+        return
+
+    baseline, others = summaries[0], summaries[1:]
+    names = [s['name'] for s in summaries]
+    report = {'runs': names, 'baseline': baseline['name']}
+
+    # 1. Hyperparameters
+    print("=" * 60)
+    print("HYPERPARAMETER DIFFERENCES")
+    print("=" * 60)
+    for s in summaries:
+        if not s['args']:
+            print(f"{s['name']}: no args.yaml, skipped.")
+    arg_diffs = diff_args(summaries)
+    report['args'] = arg_diffs
+    if not arg_diffs:
+        print("No differences.")
+    for key, values in arg_diffs.items():
+        print(f"{key:<16} " + "  ".join(f"{n}={format_value(v)}" for n, v in values.items()))
+
+    # 2. Epoch curves
+    print("\n" + "=" * 60)
+    print(f"EPOCH CURVES: {args.metric}")
+    print("=" * 60)
+    epochs, table = align_curves(summaries, args.metric)
+    report['curves'] = {'metric': args.metric, 'epochs': epochs, 'values': table}
+    print(f"{'Epoch':<6} " + " ".join(f"{n:>12}" for n in names))
+    for row, epoch in enumerate(epochs):
+        print(f"{epoch:<6} " + " ".join(f"{format_value(table[n][row]):>12}" for n in names))
+    for s in summaries:
+        seconds = epoch_seconds(s)
+        if seconds is not None:
+            print(f"{s['name']}: {seconds:.1f} s/epoch")
+
+    # 3. Per-class AP and per-image differences against the baseline
+    report['comparisons'] = {}
+    for other in others:
+        print("\n" + "=" * 60)
+        print(f"{baseline['name']} -> {other['name']}")
+        print("=" * 60)
+        comparison = {}
+
+        if baseline['class_ap'] and other['class_ap']:
+            deltas = {cls: other['class_ap'].get(cls, 0.0) - ap for cls, ap in baseline['class_ap'].items()}
+            comparison['class_ap_delta'] = deltas
+            print(f"{'Class':<24} {'Base AP50':>10} {'AP50':>10} {'Delta':>10}")
+            for cls_id, delta in sorted(deltas.items(), key=lambda item: item[1]):
+                print(f"{class_label(cls_id, class_names):<24} {baseline['class_ap'][cls_id]:>10.3f} "
+                      f"{other['class_ap'].get(cls_id, 0.0):>10.3f} {delta:>+10.3f}")
+        elif args.labels is None:
+            print("Per-class AP skipped (pass --labels to compare against ground truth).")
+
+        differences = image_differences(baseline, other)
+        comparison['differing_images'] = len(differences)
+        comparison['image_differences'] = [
+            {'image_id': image_id, 'distance': distance,
+             'delta': {class_label(c, class_names): v for c, v in delta.items()}}
+            for image_id, distance, delta in differences
+        ]
+        print(f"\nImages with different detections (conf >= {CONF_THRESHOLD}): {len(differences)}")
+        for image_id, distance, delta in differences[:args.top_images]:
+            changes = ", ".join(f"{class_label(c, class_names)} {v:+d}" for c, v in sorted(delta.items()))
+            print(f"  {image_id}: {changes}")
+
+        regressions = find_regressions(baseline, other, class_names)
+        comparison['regressions'] = regressions
+        if regressions:
+            print(f"\n**REGRESSIONS in {other['name']}:**")
+            for regression in regressions:
+                print(f"  - {regression}")
+        else:
+            print(f"\nNo regressions in {other['name']}.")
+        report['comparisons'][other['name']] = comparison
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved comparison report to: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
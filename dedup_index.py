@@ -0,0 +1,237 @@
+import os
+import json
+import argparse
+import numpy as np
+import cv2
+from multiprocessing import Pool
+
+# -------------------------------
+# Configuration
+# -------------------------------
+SOURCE_DIR = r"G:\split\all_data"            # Same base folder split.py reads (one folder per material)
+INDEX_PATH = 'dedup_index.npz'               # Perceptual hashes, reused for unchanged files
+CLUSTERS_PATH = 'dedup_clusters.json'        # Read by split.py
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+MAX_HAMMING = 6              # Max differing bits (of 64) for two images to count as near-duplicates
+NUM_PERMUTATIONS = 2         # Bit shuffles of the hash; each is cut into 4 x 16-bit lookup keys
+MAX_BUCKET = 5000            # Buckets of distinct hashes larger than this are compared in slices (logged)
+RANDOM_SEED = 42
+# -------------------------------
+
+
+def list_images(source_dir):
+    """All images below source_dir, as sorted paths relative to it (forward slashes)."""
+    paths = []
+    for root, _, files in os.walk(source_dir):
+        for f in files:
+            if f.lower().endswith(IMG_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, f), source_dir).replace(os.sep, '/'))
+    return sorted(paths)
+
+
+def phash(path):
+    """
+    64-bit perceptual hash: signs of the lowest 8x8 DCT frequencies of a 32x32 grayscale
+    thumbnail. Robust to resizing, recompression and small color changes.
+    Returns (hash or None, mtime, size).
+    """
+    st = os.stat(path)
+    # JPEG decoders can skip most of the work when asked for a reduced size
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None or min(image.shape[:2]) < 8:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None, st.st_mtime, st.st_size
+    thumb = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(thumb)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # The DC term only reflects brightness
+    return int(np.packbits(bits).view('>u8')[0]), st.st_mtime, st.st_size
+
+
+def hash_worker(args):
+    source_dir, rel_path = args
+    try:
+        return (rel_path,) + phash(os.path.join(source_dir, rel_path))
+    except OSError:
+        return rel_path, None, 0.0, 0
+
+
+def build_index(source_dir, index_path, workers):
+    """Hashes every image in parallel, reusing hashes of files whose mtime and size are unchanged."""
+    paths = list_images(source_dir)
+    previous = {}
+    if os.path.exists(index_path):
+        old = np.load(index_path)
+        if str(old['source']) == os.path.abspath(source_dir):
+            for p, h, m, s in zip(old['paths'], old['hashes'], old['mtimes'], old['sizes']):
+                previous[str(p)] = (int(h), float(m), int(s))
+
+    hashes = np.zeros(len(paths), dtype=np.uint64)
+    mtimes = np.zeros(len(paths), dtype=np.float64)
+    sizes = np.zeros(len(paths), dtype=np.int64)
+    valid = np.ones(len(paths), dtype=bool)
+    todo = []
+    for i, rel_path in enumerate(paths):
+        st = os.stat(os.path.join(source_dir, rel_path))
+        cached = previous.get(rel_path)
+        if cached and cached[1] == st.st_mtime and cached[2] == st.st_size:
+            hashes[i], mtimes[i], sizes[i] = cached
+        else:
+            todo.append(i)
+    print(f"Found {len(paths)} images; {len(paths) - len(todo)} hashes reused, {len(todo)} to compute.")
+
+    if todo:
+        with Pool(processes=workers, initializer=cv2.setNumThreads, initargs=(1,)) as pool:
+            results = pool.imap(hash_worker, ((source_dir, paths[i]) for i in todo), chunksize=256)
+            for done, (i, (_, h, m, s)) in enumerate(zip(todo, results), 1):
+                if h is None:
+                    print(f"  - Warning: Could not read image {paths[i]}")
+                    valid[i] = False
+                else:
+                    hashes[i], mtimes[i], sizes[i] = h, m, s
+                if done % 10000 == 0:
+                    print(f"  - hashed {done}/{len(todo)}")
+
+    paths, hashes, mtimes, sizes = np.array(paths)[valid], hashes[valid], mtimes[valid], sizes[valid]
+    np.savez(index_path, source=os.path.abspath(source_dir), paths=paths, hashes=hashes, mtimes=mtimes, sizes=sizes)
+    print(f"Saved hash index to: {index_path}")
+    return [str(p) for p in paths], hashes
+
+
+def popcount(x):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def lookup_keys(hashes):
+    """
+    Multi-index hashing: every permutation of the 64 hash bits is cut into four 16-bit keys.
+    Two hashes within 3 bits always share a key (pigeonhole); within MAX_HAMMING they
+    usually do, which is what makes the search approximate but near-linear.
+    """
+    bits = np.unpackbits(hashes.astype('>u8').view(np.uint8).reshape(-1, 8), axis=1)
+    rng = np.random.default_rng(RANDOM_SEED)
+    orders = [np.arange(64)] + [rng.permutation(64) for _ in range(NUM_PERMUTATIONS - 1)]
+    for order in orders:
+        shuffled = np.ascontiguousarray(np.packbits(bits[:, order], axis=1)).view('>u2').astype(np.uint16)
+        for block in range(4):
+            yield shuffled[:, block]
+
+
+def candidate_pairs(keys):
+    """
+    Index pairs that share a bucket (equal key), as two arrays with i < j, and the number
+    of buckets that had to be sliced.
+    """
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    firsts, seconds = [], []
+    sliced = 0
+    for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+        members = np.sort(order[start:end])
+        # Huge buckets are compared in slices to bound memory; pairs across slices are missed
+        if len(members) > MAX_BUCKET:
+            sliced += 1
+            print(f"Warning: A bucket of {len(members)} distinct hashes is compared in slices of {MAX_BUCKET}; "
+                  f"near-duplicates across slices are missed.")
+        for s in range(0, len(members), MAX_BUCKET):
+            block = members[s:s + MAX_BUCKET]
+            i, j = np.triu_indices(len(block), k=1)
+            firsts.append(block[i])
+            seconds.append(block[j])
+    if not firsts:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), sliced
+    return np.concatenate(firsts), np.concatenate(seconds), sliced
+
+
+def connected_components(n, first, second):
+    """
+    Component label (its smallest index) of each of n nodes, given the edges first[k]-second[k].
+    Vectorized: labels are lowered along the edges, then pointer-jumped, until nothing changes.
+    """
+    labels = np.arange(n)
+    while True:
+        previous = labels.copy()
+        low = np.minimum(labels[first], labels[second])
+        np.minimum.at(labels, first, low)
+        np.minimum.at(labels, second, low)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def find_clusters(hashes, max_hamming):
+    """Connected components of the near-duplicate graph, as lists of indices."""
+    # Exact duplicates (scraped copies, blank images) would put m copies in every bucket
+    # as m^2 pairs; they are one node here, and only distinct hashes are compared
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    pairs_checked = 0
+    sliced = 0
+    close_first, close_second = [], []
+    for keys in lookup_keys(unique_hashes):
+        first, second, key_sliced = candidate_pairs(keys)
+        pairs_checked += len(first)
+        sliced += key_sliced
+        close = popcount(unique_hashes[first] ^ unique_hashes[second]) <= max_hamming
+        close_first.append(first[close])
+        close_second.append(second[close])
+    print(f"{len(hashes) - len(unique_hashes)} exact copies; compared {pairs_checked} candidate pairs "
+          f"of {len(unique_hashes)} distinct hashes (of {len(unique_hashes) * (len(unique_hashes) - 1) // 2} possible).")
+    if sliced:
+        print(f"Warning: {sliced} buckets were sliced; raise MAX_BUCKET for full recall.")
+
+    labels = connected_components(len(unique_hashes), np.concatenate(close_first), np.concatenate(close_second))
+    labels = labels[inverse]
+    order = np.argsort(labels, kind='stable')
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    return [members.tolist() for members in np.split(order, starts[1:]) if len(members) > 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find duplicate and near-duplicate images for split.py.')
+    parser.add_argument('--source', default=SOURCE_DIR, help='Folder to index (walked recursively).')
+    parser.add_argument('--index', default=INDEX_PATH)
+    parser.add_argument('--output', default=CLUSTERS_PATH)
+    parser.add_argument('--max-hamming', type=int, default=MAX_HAMMING)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print(f"Error: Source directory not found: {args.source}")
+        return
+
+    paths, hashes = build_index(args.source, args.index, args.workers)
+    clusters = find_clusters(hashes, args.max_hamming)
+    clusters = sorted(sorted(paths[i] for i in members) for members in clusters)
+
+    # Clusters whose members sit in different top-level folders (materials, or train/val/test
+    # when run on an existing split, where every such cluster is a leak)
+    spanning = [c for c in clusters if len({p.split('/')[0] for p in c}) > 1]
+    duplicates = sum(len(c) - 1 for c in clusters)
+    print(f"\n{len(clusters)} near-duplicate clusters covering {sum(len(c) for c in clusters)} images "
+          f"({duplicates} redundant copies, {duplicates / max(len(paths), 1):.1%} of the dataset).")
+    print(f"{len(spanning)} clusters span more than one top-level folder.")
+    for cluster in spanning[:10]:
+        print(f"  - {', '.join(cluster[:4])}{' ...' if len(cluster) > 4 else ''}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'source': os.path.abspath(args.source),
+            'max_hamming': args.max_hamming,
+            'clusters': clusters,
+        }, f, indent=1)
+    print(f"\nSaved clusters to: {args.output} (split.py keeps each cluster in one split)")
+
+
+if __name__ == '__main__':
+    main()
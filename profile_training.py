@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import threading
+import yaml
+import psutil
+import torch
+
+# -------------------------------
+# Configuration
+# -------------------------------
+YAML_PATH = 'splitted/data.yaml'
+MODEL_SIZE = 'yolov8n.pt'
+TRAIN_CONFIG_PATH = 'train_config.yaml'    # Read by train_yolo_v8s.py
+RESULTS_PATH = 'profile_results.json'
+
+TRIAL_FRACTION = 0.1          # Share of the train split each trial indexes (keeps setup short)
+WARMUP_BATCHES = 5            # Not measured (cudnn autotune, worker startup, first allocations)
+MEASURED_BATCHES = 30         # Batches timed per trial
+TRIAL_TIMEOUT_S = 1800
+MEMORY_SAMPLE_S = 0.2
+MAX_MEMORY_FRACTION = 0.9     # A configuration "fits" if its peak RSS stays under this share of RAM
+
+if torch.cuda.is_available():
+    DEVICE = 0
+    GRID = {'batch': [8, 16, 32], 'workers': [4, 8], 'imgsz': [640], 'cache': ['none', 'disk'], 'amp': [True, False]}
+else:
+    DEVICE = 'cpu'
+    # AMP only matters on GPU, so CPU trials leave it off. Pass --imgsz to also trade resolution for speed.
+    GRID = {'batch': [2, 4, 8], 'workers': [0, 2, 4, 8], 'imgsz': [416], 'cache': ['none', 'disk', 'ram'],
+            'amp': [False]}
+# -------------------------------
+
+
+class TrialComplete(Exception):
+    """Raised from a callback to end a trial once enough batches have been timed."""
+
+
+def trial_data(cache, imgsz, data_yaml):
+    """
+    The dataset a trial trains on: 'disk' trials use the pre-resized cache (None if it was
+    not built), 'none' and 'ram' the --data dataset. train_yolo_v8s.py trains on the one
+    recorded in train_config.yaml.
+    """
+    return cached_yaml_for(imgsz) if cache == 'disk' else data_yaml
+
+
+def cached_yaml_for(imgsz):
+    """data.yaml of the pre-resized cache from build_image_cache.py, if it was built for imgsz."""
+    path = os.path.join(os.path.dirname(os.path.abspath(YAML_PATH)) + f'_{imgsz}', 'data.yaml')
+    return path if os.path.exists(path) else None
+
+
+# -------------------------------
+# Child process: one trial
+# -------------------------------
+def sample_peak_rss(stop_event, peak):
+    """Tracks the peak RSS of this process plus its dataloader worker processes."""
+    process = psutil.Process()
+    while not stop_event.is_set():
+        try:
+            rss = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            peak[0] = max(peak[0], rss)
+        except psutil.Error:
+            pass
+        time.sleep(MEMORY_SAMPLE_S)
+
+
+def run_trial(config, data_yaml):
+    """Trains for WARMUP_BATCHES + MEASURED_BATCHES batches and returns throughput stats."""
+    from ultralytics import YOLO
+
+    timings = {'batch_start': [], 'batch_end': [], 'batch_size': None}
+
+    def on_pretrain_routine_start(trainer):
+        # ultralytics forces workers=0 on CPU; restore the value under test before dataloaders are built
+        trainer.args.workers = config['workers']
+
+    def on_train_batch_start(trainer):
+        timings['batch_start'].append(time.perf_counter())
+
+    def on_train_batch_end(trainer):
+        timings['batch_end'].append(time.perf_counter())
+        timings['batch_size'] = trainer.batch_size
+        if len(timings['batch_end']) >= WARMUP_BATCHES + MEASURED_BATCHES:
+            raise TrialComplete()
+
+    model = YOLO(MODEL_SIZE)
+    model.add_callback('on_pretrain_routine_start', on_pretrain_routine_start)
+    model.add_callback('on_train_batch_start', on_train_batch_start)
+    model.add_callback('on_train_batch_end', on_train_batch_end)
+
+    stop_event, peak = threading.Event(), [0]
+    sampler = threading.Thread(target=sample_peak_rss, args=(stop_event, peak), daemon=True)
+    sampler.start()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+    try:
+        model.train(
+            data=data_yaml,
+            epochs=1,
+            imgsz=config['imgsz'],
+            batch=config['batch'],
+            workers=config['workers'],
+            cache=False if config['cache'] == 'none' else config['cache'],
+            amp=config['amp'],
+            device=DEVICE,
+            fraction=TRIAL_FRACTION,
+            val=False,
+            plots=False,
+            save=False,
+            project='profile_runs',
+            name='trial',
+            exist_ok=True,
+            verbose=False,
+        )
+    except TrialComplete:
+        pass
+    finally:
+        stop_event.set()
+        sampler.join()
+
+    starts, ends = timings['batch_start'], timings['batch_end']
+    if len(ends) < WARMUP_BATCHES + 2:
+        raise RuntimeError(f"Only {len(ends)} batches ran; increase TRIAL_FRACTION.")
+
+    # The gap between one batch ending and the next starting is time spent waiting on the dataloader
+    first, last = WARMUP_BATCHES, len(ends) - 1
+    stall = sum(starts[i] - ends[i - 1] for i in range(first + 1, last + 1))
+    elapsed = ends[last] - ends[first]
+    images = (last - first) * timings['batch_size']
+    return {
+        'images_per_s': images / elapsed,
+        'stall_fraction': stall / elapsed,
+        'stall_ms_per_batch': 1000 * stall / (last - first),
+        'peak_rss_gb': peak[0] / 1e9,
+        'peak_gpu_gb': torch.cuda.max_memory_allocated() / 1e9 if torch.cuda.is_available() else 0.0,
+        'effective_batch': timings['batch_size'],
+    }
+
+
+# -------------------------------
+# Parent process: grid search
+# -------------------------------
+def launch_trial(config, data_yaml):
+    """Runs one trial in a fresh process so memory peaks and worker pools don't leak between trials."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--trial', json.dumps(config), '--data', data_yaml]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=TRIAL_TIMEOUT_S)
+    except subprocess.TimeoutExpired:
+        return {'error': 'timeout'}
+    for line in proc.stdout.splitlines():
+        if line.startswith('TRIAL_RESULT '):
+            return json.loads(line[len('TRIAL_RESULT '):])
+    tail = (proc.stderr or proc.stdout).strip().splitlines()[-1:] or ['unknown error']
+    return {'error': tail[0]}
+
+
+def build_grid(args):
+    grid = dict(GRID)
+    for key in grid:
+        value = getattr(args, key)
+        if value:
+            grid[key] = value
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile training throughput and pick the fastest settings.')
+    parser.add_argument('--data', default=YAML_PATH)
+    parser.add_argument('--trial', help=argparse.SUPPRESS)
+    parser.add_argument('--batch', type=int, nargs='+')
+    parser.add_argument('--workers', type=int, nargs='+')
+    parser.add_argument('--imgsz', type=int, nargs='+')
+    parser.add_argument('--cache', nargs='+', choices=['none', 'ram', 'disk'])
+    parser.add_argument('--amp', type=lambda v: v.lower() in ('1', 'true', 'on'), nargs='+')
+    parser.add_argument('--max-memory-gb', type=float,
+                        default=psutil.virtual_memory().total * MAX_MEMORY_FRACTION / 1e9)
+    args = parser.parse_args()
+
+    if args.trial:
+        try:
+            print('TRIAL_RESULT ' + json.dumps(run_trial(json.loads(args.trial), args.data)))
+        except Exception as e:
+            print('TRIAL_RESULT ' + json.dumps({'error': f'{type(e).__name__}: {e}'}))
+        return
+
+    if not os.path.exists(args.data):
+        raise FileNotFoundError(f"YAML missing: {os.path.abspath(args.data)}")
+
+    configs = build_grid(args)
+    print(f"Profiling {len(configs)} configurations on {DEVICE} "
+          f"({WARMUP_BATCHES} warm-up + {MEASURED_BATCHES} measured batches each)\n")
+    print(f"{'batch':>5} {'workers':>7} {'imgsz':>5} {'cache':>5} {'amp':>5} "
+          f"{'img/s':>8} {'stall':>6} {'RSS GB':>7} {'GPU GB':>7}")
+
+    results = []
+    for config in configs:
+        # Disk caching is only profiled against the pre-resized cache, never the raw dataset
+        data_yaml = trial_data(config['cache'], config['imgsz'], args.data)
+        if data_yaml is None:
+            print(f"{config['batch']:>5} {config['workers']:>7} {config['imgsz']:>5} {'disk':>5} "
+                  f"{str(config['amp']):>5}  skipped (run build_image_cache.py --imgsz {config['imgsz']})")
+            continue
+        stats = launch_trial(config, data_yaml)
+        results.append({**config, 'data': data_yaml, **stats})
+        prefix = (f"{config['batch']:>5} {config['workers']:>7} {config['imgsz']:>5} {config['cache']:>5} "
+                  f"{str(config['amp']):>5}")
+        if 'error' in stats:
+            print(f"{prefix}  failed: {stats['error']}")
+        else:
+            print(f"{prefix} {stats['images_per_s']:>8.1f} {stats['stall_fraction']:>6.0%} "
+                  f"{stats['peak_rss_gb']:>7.2f} {stats['peak_gpu_gb']:>7.2f}")
+
+    with open(RESULTS_PATH, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved all trial results to: {RESULTS_PATH}")
+
+    gpu_limit = torch.cuda.get_device_properties(0).total_memory / 1e9 if torch.cuda.is_available() else None
+    fitting = [
+        r for r in results
+        if 'error' not in r and r['peak_rss_gb'] <= args.max_memory_gb
+        and (gpu_limit is None or r['peak_gpu_gb'] <= gpu_limit)
+        and r['effective_batch'] == r['batch']  # ultralytics shrank the batch after an OOM
+    ]
+    if not fitting:
+        print("Error: No configuration completed within the memory limits.")
+        return
+
+    best = max(fitting, key=lambda r: r['images_per_s'])
+    train_config = {
+        'batch': best['batch'],
+        'workers': best['workers'],
+        'imgsz': best['imgsz'],
+        'cache': best['cache'],
+        'data': best['data'],
+        'amp': best['amp'],
+        'device': str(DEVICE),
+        'measured_images_per_s': round(best['images_per_s'], 2),
+        'measured_stall_fraction': round(best['stall_fraction'], 3),
+        'measured_peak_rss_gb': round(best['peak_rss_gb'], 2),
+    }
+    with open(TRAIN_CONFIG_PATH, 'w', encoding='utf-8') as f:
+        yaml.dump(train_config, f, sort_keys=False, default_flow_style=False)
+
+    print("\n--- Fastest configuration ---")
+    for key, value in train_config.items():
+        print(f"{key}: {value}")
+    print(f"\nSaved to {TRAIN_CONFIG_PATH}; train_yolo_v8s.py will use it on this machine.")
+
+
+if __name__ == '__main__':
+    main()
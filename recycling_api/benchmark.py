@@ -0,0 +1,400 @@
+"""
+Load generator and latency benchmark for the /detect/ endpoint.
+
+Replays a corpus of images either in-process (ASGI, no network) or against a running
+server over HTTP, at fixed request rates (open loop) or fixed concurrency (closed loop).
+Results are written as JSON tagged with the git commit so runs can be compared:
+
+    python benchmark.py --corpus ./bench_images --rates 1 2 5 --concurrency 1 4
+    python benchmark.py --corpus ./bench_images --url http://127.0.0.1:8000 --server-pid 1234
+    python benchmark.py --compare bench_results/old.json bench_results/new.json
+    python benchmark.py --serialization
+    python benchmark.py --corpus ./bench_images --tta    # then --compare against a run without
+
+--accept selects the /detect/ response format; --serialization times only the response
+encoders on synthetic detections (no model or server needed).
+
+Needs httpx and psutil on top of the API requirements.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+import threading
+import numpy as np
+import httpx
+import psutil
+
+CORPUS_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+RESULTS_DIR = "bench_results"
+DEFAULT_DURATION_S = 30
+WARMUP_REQUESTS = 3
+SERIALIZATION_SIZES = (0, 10, 100, 300)   # Detections per response
+SERIALIZATION_REPEATS = 200
+REQUEST_TIMEOUT_S = 60
+RESOURCE_SAMPLE_S = 0.25
+
+
+def load_corpus(corpus_dir: str) -> list:
+    """Reads every image in the corpus into memory once, so disk I/O is not measured."""
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.lower().endswith(CORPUS_EXTENSIONS):
+            with open(os.path.join(corpus_dir, name), "rb") as f:
+                corpus.append((name, f.read()))
+    if not corpus:
+        raise ValueError(f"No images found in {corpus_dir}")
+    return corpus
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class ResourceSampler:
+    """Samples CPU% and RSS of the server process in a background thread."""
+
+    def __init__(self, pid: int):
+        self.process = psutil.Process(pid) if pid else None
+        self.cpu_samples, self.rss_samples = [], []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.process is not None:
+            self.process.cpu_percent(None)  # Prime the counter
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(RESOURCE_SAMPLE_S):
+            try:
+                self.cpu_samples.append(self.process.cpu_percent(None))
+                self.rss_samples.append(self.process.memory_info().rss)
+            except psutil.Error:
+                break
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self) -> dict:
+        if not self.cpu_samples:
+            return {"cpu_percent_mean": None, "cpu_percent_max": None, "rss_mb_peak": None}
+        return {
+            "cpu_percent_mean": float(np.mean(self.cpu_samples)),
+            "cpu_percent_max": float(np.max(self.cpu_samples)),
+            "rss_mb_peak": max(self.rss_samples) / 1e6,
+        }
+
+
+def server_inference_ms(response: httpx.Response):
+    """Model time from the Server-Timing header ("inference;dur=123.4;..."), if present."""
+    for metric in response.headers.get("server-timing", "").split(","):
+        fields = [f.strip() for f in metric.split(";")]
+        if fields[0] == "inference":
+            for field in fields[1:]:
+                if field.startswith("dur="):
+                    return float(field[4:])
+    return None
+
+
+async def send_one(client: httpx.AsyncClient, item: tuple, form: dict, server_ms: list = None) -> tuple:
+    """Posts one image; returns (status code or error name, seconds). Appends the server's model time to server_ms."""
+    name, data = item
+    start = time.perf_counter()
+    try:
+        response = await client.post("/detect/", files={"image": (name, data, "image/jpeg")}, data=form)
+        status = response.status_code
+        if server_ms is not None and status == 200:
+            inference_ms = server_inference_ms(response)
+            if inference_ms is not None:
+                server_ms.append(inference_ms)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start
+
+
+def summarize(mode: str, level: float, latencies: list, statuses: list, elapsed: float, resources: dict,
+              server_ms: list) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    ok = sum(1 for s in statuses if s == 200)
+    errors = {}
+    for s in statuses:
+        if s != 200:
+            errors[str(s)] = errors.get(str(s), 0) + 1
+    return {
+        "mode": mode,
+        "level": level,
+        "requests": len(statuses),
+        "ok": ok,
+        "error_rate": (len(statuses) - ok) / max(len(statuses), 1),
+        "errors": errors,
+        "throughput_rps": ok / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else None,
+            "p95": float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else None,
+            "p99": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else None,
+            "mean": float(latencies_ms.mean()) if len(latencies_ms) else None,
+            "max": float(latencies_ms.max()) if len(latencies_ms) else None,
+        },
+        # Model time alone as reported by the server, e.g. to compare single-pass with --tta
+        "server_inference_ms": {
+            "p50": float(np.percentile(server_ms, 50)) if server_ms else None,
+            "p99": float(np.percentile(server_ms, 99)) if server_ms else None,
+        },
+        **resources,
+    }
+
+
+async def run_fixed_rate(client, corpus, rate, duration, form, pid) -> dict:
+    """
+    Open loop: requests are started on a fixed schedule regardless of how slow the server is.
+    Latency is measured from the scheduled start, so queueing delay is not hidden.
+    """
+    interval = 1.0 / rate
+    total = max(int(rate * duration), 1)
+    latencies, statuses, server_ms = [], [], []
+
+    async def scheduled(i, start_at):
+        await asyncio.sleep(max(0.0, start_at - time.perf_counter()))
+        status, _ = await send_one(client, corpus[i % len(corpus)], form, server_ms)
+        statuses.append(status)
+        latencies.append(time.perf_counter() - start_at)
+
+    with ResourceSampler(pid) as sampler:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(scheduled(i, t0 + i * interval) for i in range(total)))
+        elapsed = time.perf_counter() - t0
+    return summarize("rate", rate, latencies, statuses, elapsed, sampler.summary(), server_ms)
+
+
+async def run_fixed_concurrency(client, corpus, concurrency, duration, form, pid) -> dict:
+    """Closed loop: `concurrency` clients each send their next request as soon as the last one returns."""
+    latencies, statuses, server_ms = [], [], []
+    counter = [0]
+
+    async def worker(deadline):
+        while time.perf_counter() < deadline:
+            i = counter[0]
+            counter[0] += 1
+            status, seconds = await send_one(client, corpus[i % len(corpus)], form, server_ms)
+            statuses.append(status)
+            latencies.append(seconds)
+
+    with ResourceSampler(pid) as sampler:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(t0 + duration) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return summarize("concurrency", concurrency, latencies, statuses, elapsed, sampler.summary(), server_ms)
+
+
+async def run_suite(client, corpus, args, pid) -> list:
+    form = {"families": args.families} if args.families else {}
+    if getattr(args, "tta", False):
+        form["tta"] = "true"
+    for i in range(WARMUP_REQUESTS):
+        await send_one(client, corpus[i % len(corpus)], form)
+
+    runs = []
+    for rate in args.rates or []:
+        print(f"Fixed rate {rate} req/s for {args.duration}s...")
+        runs.append(await run_fixed_rate(client, corpus, rate, args.duration, form, pid))
+        print_run(runs[-1])
+    for concurrency in args.concurrency or []:
+        print(f"Fixed concurrency {concurrency} for {args.duration}s...")
+        runs.append(await run_fixed_concurrency(client, corpus, concurrency, args.duration, form, pid))
+        print_run(runs[-1])
+    return runs
+
+
+def request_headers(args) -> dict:
+    return {"accept": args.accept} if args.accept else {}
+
+
+async def run_in_process(corpus, args) -> list:
+    """Drives the FastAPI app through ASGI directly, including its lifespan (model loading)."""
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=REQUEST_TIMEOUT_S,
+                                     headers=request_headers(args)) as client:
+            return await run_suite(client, corpus, args, os.getpid())
+
+
+async def run_over_http(corpus, args) -> list:
+    limits = httpx.Limits(max_connections=max(args.concurrency or [1]) + int(max(args.rates or [1])) + 8)
+    async with httpx.AsyncClient(base_url=args.url, timeout=REQUEST_TIMEOUT_S, limits=limits,
+                                 headers=request_headers(args)) as client:
+        return await run_suite(client, corpus, args, args.server_pid)
+
+
+def format_ms(value) -> str:
+    return f"{value:8.1f}" if value is not None else "       -"
+
+
+def print_run(run: dict):
+    latency = run["latency_ms"]
+    cpu = f"{run['cpu_percent_mean']:.0f}%" if run["cpu_percent_mean"] is not None else "-"
+    rss = f"{run['rss_mb_peak']:.0f} MB" if run["rss_mb_peak"] is not None else "-"
+    print(f"  {run['requests']} requests, {run['throughput_rps']:.2f} req/s, errors {run['error_rate']:.1%} | "
+          f"p50 {format_ms(latency['p50'])} p95 {format_ms(latency['p95'])} p99 {format_ms(latency['p99'])} ms | CPU {cpu}, RSS {rss}")
+    if run["server_inference_ms"]["p50"] is not None:
+        print(f"  model time p50 {format_ms(run['server_inference_ms']['p50'])} "
+              f"p99 {format_ms(run['server_inference_ms']['p99'])} ms")
+
+
+def synthetic_arrays(metadata, count: int, rng) -> dict:
+    """predict_arrays-shaped output with `count` random detections."""
+    class_ids = rng.integers(0, len(metadata), count).astype(np.intp)
+    xy = rng.integers(0, 600, (count, 2))
+    boxes = np.concatenate([xy, xy + rng.integers(10, 300, (count, 2))], axis=1).astype(np.int32)
+    weights = metadata.weight_g[class_ids]
+    return {"class_ids": class_ids, "boxes_xyxy": boxes, "weights_g": weights,
+            "total_weight_g": int(np.nansum(weights))}
+
+
+def benchmark_serialization():
+    """
+    Times each /detect/ response encoder, including building the per-detection dicts
+    where the format needs them. "stdlib json" is what FastAPI does for a returned dict.
+    """
+    from fastapi.encoders import jsonable_encoder
+    import model as model_logic
+    import response_formats
+    from class_metadata import load_class_metadata
+
+    metadata = load_class_metadata()
+    rng = np.random.default_rng(0)
+
+    def as_dict(arrays):
+        return {
+            "total_weight_g": arrays["total_weight_g"],
+            "total_weight_kg": arrays["total_weight_g"] / 1000,
+            "detections": model_logic.detection_dicts(arrays, metadata),
+        }
+
+    encoders = {
+        "stdlib json": lambda a: json.dumps(jsonable_encoder(as_dict(a)), separators=(",", ":")).encode(),
+        "orjson": lambda a: response_formats.encode(response_formats.JSON, as_dict(a), metadata),
+        "columnar json": lambda a: response_formats.encode(response_formats.COLUMNAR_JSON, a, metadata),
+        "msgpack": lambda a: response_formats.encode(response_formats.MSGPACK, a, metadata),
+    }
+    print(f"{'detections':>10} {'encoder':<14} {'median us':>10} {'p99 us':>10} {'bytes':>8}")
+    results = []
+    for count in SERIALIZATION_SIZES:
+        arrays = synthetic_arrays(metadata, count, rng)
+        for name, encoder in encoders.items():
+            timings = []
+            for _ in range(SERIALIZATION_REPEATS):
+                start = time.perf_counter()
+                payload = encoder(arrays)
+                timings.append(time.perf_counter() - start)
+            timings_us = np.array(timings) * 1e6
+            results.append({"detections": count, "encoder": name, "median_us": float(np.median(timings_us)),
+                            "p99_us": float(np.percentile(timings_us, 99)), "bytes": len(payload)})
+            r = results[-1]
+            print(f"{count:>10} {name:<14} {r['median_us']:>10.1f} {r['p99_us']:>10.1f} {r['bytes']:>8}")
+    return results
+
+
+def compare(old_path: str, new_path: str):
+    """Prints the change in throughput and tail latency between two result files."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['commit']} ({old['target']}) -> {new['commit']} ({new['target']})")
+    print(f"{'mode':<12} {'level':>6} {'req/s':>16} {'p50 ms':>18} {'p99 ms':>18} {'model p50 ms':>18}")
+    old_runs = {(r["mode"], r["level"]): r for r in old["runs"]}
+    for run in new["runs"]:
+        before = old_runs.get((run["mode"], run["level"]))
+        if before is None:
+            continue
+        cells = []
+        for a, b in ((before["throughput_rps"], run["throughput_rps"]),
+                     (before["latency_ms"]["p50"], run["latency_ms"]["p50"]),
+                     (before["latency_ms"]["p99"], run["latency_ms"]["p99"]),
+                     (before.get("server_inference_ms", {}).get("p50"), run.get("server_inference_ms", {}).get("p50"))):
+            change = f"{(b - a) / a:+.0%}" if a and b is not None else "n/a"
+            cells.append(f"{b:.1f} ({change})" if b is not None else "-")
+        print(f"{run['mode']:<12} {run['level']:>6} {cells[0]:>16} {cells[1]:>18} {cells[2]:>18} {cells[3]:>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /detect/ endpoint.")
+    parser.add_argument("--corpus", help="Directory of request images.")
+    parser.add_argument("--url", help="Base URL of a running server; omit to benchmark in-process via ASGI.")
+    parser.add_argument("--server-pid", type=int, help="PID of the server, for CPU/RSS sampling over HTTP.")
+    parser.add_argument("--rates", type=float, nargs="*", help="Fixed request rates (req/s) to test.")
+    parser.add_argument("--concurrency", type=int, nargs="*", help="Fixed concurrency levels to test.")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_S, help="Seconds per level.")
+    parser.add_argument("--families", help="Optional families form field sent with every request.")
+    parser.add_argument("--accept", help="Accept header sent with every request (response format).")
+    parser.add_argument("--tta", action="store_true", help="Request test-time augmentation (audit mode).")
+    parser.add_argument("--serialization", action="store_true", help="Only time the response encoders.")
+    parser.add_argument("--output", help="Result file (default: bench_results/<commit>_<target>.json).")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.serialization:
+        result = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "serialization": benchmark_serialization()}
+        output = args.output or os.path.join(RESULTS_DIR, f"{result['commit']}_serialization.json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved serialization results to: {output}")
+        return
+    if not args.corpus:
+        parser.error("--corpus is required unless --compare is given")
+    if not args.rates and not args.concurrency:
+        args.concurrency = [1]
+
+    corpus = load_corpus(args.corpus)
+    target = args.url or "asgi"
+    print(f"Loaded {len(corpus)} images. Target: {target}")
+
+    runs = asyncio.run(run_over_http(corpus, args) if args.url else run_in_process(corpus, args))
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": target,
+        "accept": args.accept,
+        "tta": args.tta,
+        "corpus": {"path": os.path.abspath(args.corpus), "images": len(corpus)},
+        "machine": {
+            "platform": platform.platform(),
+            "python": sys.version.split()[0],
+            "cpu_count": os.cpu_count(),
+            "memory_gb": psutil.virtual_memory().total / 1e9,
+        },
+        "runs": runs,
+    }
+    suffix = "_tta" if args.tta else ""
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}_{'asgi' if target == 'asgi' else 'http'}{suffix}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved benchmark results to: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Single source of truth for class metadata: names, average weights, material families
+and drawing colors.
+
+Class ids come from data.yaml (or the loaded model's names, which must agree with it).
+ClassMetadata precomputes id-indexed NumPy arrays so hot paths index by class id
+instead of hashing class-name strings for every detection.
+"""
+import os
+import numpy as np
+import yaml
+
+# data.yaml lives at the repo root; override with DATA_YAML_PATH (e.g. inside Docker)
+DATA_YAML_PATH = os.environ.get(
+    "DATA_YAML_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data.yaml")
+)
+
+# --- Weight Lookup Table (grams per item) ---
+AVERAGE_WEIGHTS_G = {
+    # Cardboard
+    'cardboard_bags': 50,
+    'cardboard_boxes': 400,
+    'cardboard_cups': 10,
+    'cardboard_holders': 50,
+    
+    # Glass
+    'glass_bottle_medium': 300,
+    'glass_bottle_small': 200,
+    'glass_cup': 250,
+    'glass_jar': 350,
+    'glass_jug': 1200,
+    
+    # Metal (HIGHLY VARIABLE)
+    'AL_foil': 10,
+    'chair_iron': 7000,
+    'door_handle_iron': 350,
+    'fan_iron': 5000,
+    'kettle_AL': 800,
+    'large_can_AL': 18,
+    'large_cooking_pan_AL': 1500,
+    'large_fork_AL': 80,
+    'large_knife_AL': 80,
+    'large_spoon_AL': 80,
+    'medium_fork_AL': 50,
+    'medium_spoon_AL': 50,
+    'refrigerator_iron': 85000,
+    'small_can_AL': 15,
+    'small_cooking_pan_AL': 700,
+    'small_fork_AL': 30,
+    'small_knife_AL': 30,
+    'small_spoon_AL': 30,
+    'stove_iron': 70000,
+    'table_iron': 15000,
+    'tap_iron': 2000,
+    'washer_machine_iron': 75000,
+    
+    # Paper
+    'Cartoon_paper': 60,
+    'Tissue_Paper': 1,
+    'newspapers': 350,
+    'paper': 5,
+    
+    # Plastic
+    'plastic_bags': 8,
+    'plastic_bottles_large': 25,
+    'plastic_bottles_medium': 22,
+    'plastic_bottles_small': 10,
+    'plastic_boxes': 1000,
+    'plastic_chairs': 3500,
+    'plastic_cups': 12,
+    'plastic_utensils': 3,
+    
+    # Textile (HIGHLY VARIABLE)
+    'child_chemise': 100,
+    'child_dress': 150,
+    'child_jacket': 400,
+    'child_pullover': 250,
+    'child_short': 100,
+    'child_skirt': 100,
+    'child_t_shirt': 100,
+    'child_trouser': 200,
+    'men_chemise': 150,
+    'men_jacket': 1100,
+    'men_pullover': 350,
+    'men_short': 250,
+    'men_t_shirt': 170,
+    'men_trouser': 400,
+    'women_blouse': 130,
+    'women_chemise': 130,
+    'women_gloves': 50,
+    'women_jacket': 900,
+    'women_pullover': 300,
+    'women_scarves': 100,
+    'women_skirt': 300,
+    'women_socks': 40,
+    'women_summer_dress': 250,
+    'women_trousers': 350,
+    'women_winter_dress': 500,
+    
+    # Wood (EXTREMELY VARIABLE)
+    'King&Queen bed': 100000,
+    'Tall chair': 7000,
+    'closet': 80000,
+    'dining table': 60000,
+    'full bed': 55000,
+    'seat': 6000,
+    'side table': 10000,
+}
+
+# --- Material families ---
+MATERIAL_FAMILIES = {
+    'cardboard': ['cardboard_bags', 'cardboard_boxes', 'cardboard_cups', 'cardboard_holders'],
+    'glass': ['glass_bottle_medium', 'glass_bottle_small', 'glass_cup', 'glass_jar', 'glass_jug'],
+    'metal': [
+        'AL_foil', 'chair_iron', 'door_handle_iron', 'fan_iron', 'kettle_AL',
+        'large_can_AL', 'large_cooking_pan_AL', 'large_fork_AL', 'large_knife_AL',
+        'large_spoon_AL', 'medium_fork_AL', 'medium_spoon_AL', 'refrigerator_iron',
+        'small_can_AL', 'small_cooking_pan_AL', 'small_fork_AL', 'small_knife_AL',
+        'small_spoon_AL', 'stove_iron', 'table_iron', 'tap_iron', 'washer_machine_iron',
+    ],
+    'paper': ['Cartoon_paper', 'Tissue_Paper', 'newspapers', 'paper'],
+    'plastic': [
+        'plastic_bags', 'plastic_bottles_large', 'plastic_bottles_medium', 'plastic_bottles_small',
+        'plastic_boxes', 'plastic_chairs', 'plastic_cups', 'plastic_utensils',
+    ],
+    'textile': [
+        'child_chemise', 'child_dress', 'child_jacket', 'child_pullover',
+        'child_short', 'child_skirt', 'child_t_shirt', 'child_trouser',
+        'men_chemise', 'men_jacket', 'men_pullover', 'men_short',
+        'men_t_shirt', 'men_trouser', 'women_blouse', 'women_chemise',
+        'women_gloves', 'women_jacket', 'women_pullover', 'women_scarves',
+        'women_skirt', 'women_socks', 'women_summer_dress',
+        'women_trousers', 'women_winter_dress',
+    ],
+    'wood': ['King&Queen bed', 'Tall chair', 'closet', 'dining table', 'full bed', 'seat', 'side table'],
+}
+
+# --- Drawing colors per material family (BGR, for OpenCV) ---
+FAMILY_COLORS = {
+    'cardboard': (60, 120, 180),
+    'glass': (200, 160, 0),
+    'metal': (160, 160, 160),
+    'paper': (230, 230, 230),
+    'plastic': (0, 200, 0),
+    'textile': (180, 60, 180),
+    'wood': (20, 70, 140),
+}
+UNKNOWN_COLOR = (0, 0, 255)
+
+FAMILY_NAMES = list(MATERIAL_FAMILIES)
+
+
+def load_data_yaml_names(data_yaml_path: str = DATA_YAML_PATH):
+    """Returns the class names from data.yaml, or None if the file is not available."""
+    if not data_yaml_path or not os.path.exists(data_yaml_path):
+        return None
+    with open(data_yaml_path, "r", encoding="utf-8") as f:
+        return list(yaml.safe_load(f)["names"])
+
+
+class ClassMetadata:
+    """
+    Id-indexed lookup arrays for one class list.
+
+    Attributes:
+        names: Class names, indexed by class id.
+        index: {class_name: class_id}, for the rare lookups that start from a name.
+        weight_g: float32 average weight per class id (NaN if unknown).
+        family_id: int8 index into FAMILY_NAMES per class id (-1 if unknown).
+        color: uint8 (n, 3) BGR drawing color per class id.
+    """
+
+    def __init__(self, names):
+        self.names = [str(name) for name in names]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        if len(self.index) != len(self.names):
+            raise ValueError("Duplicate class names in class list.")
+
+        family_of = {name: f for f, members in enumerate(MATERIAL_FAMILIES.values()) for name in members}
+        self.weight_g = np.array(
+            [AVERAGE_WEIGHTS_G.get(name, np.nan) for name in self.names], dtype=np.float32
+        )
+        self.family_id = np.array([family_of.get(name, -1) for name in self.names], dtype=np.int8)
+        family_colors = np.array([FAMILY_COLORS[f] for f in FAMILY_NAMES] + [UNKNOWN_COLOR], dtype=np.uint8)
+        self.color = family_colors[self.family_id]  # -1 picks UNKNOWN_COLOR
+
+    def __len__(self):
+        return len(self.names)
+
+    def validate(self, strict: bool = False) -> list:
+        """
+        Checks that every class has a weight and a family, and that the tables do not
+        mention classes the class list lacks. Problems are printed; strict=True raises.
+        """
+        problems = []
+        missing_weight = [n for n, w in zip(self.names, self.weight_g) if np.isnan(w)]
+        missing_family = [n for n, f in zip(self.names, self.family_id) if f < 0]
+        unused_weight = [n for n in AVERAGE_WEIGHTS_G if n not in self.index]
+        unused_family = [n for members in MATERIAL_FAMILIES.values() for n in members if n not in self.index]
+        if missing_weight:
+            problems.append(f"No weight defined for: {', '.join(missing_weight)}")
+        if missing_family:
+            problems.append(f"No material family for: {', '.join(missing_family)}")
+        if unused_weight:
+            problems.append(f"Weights defined for unknown classes: {', '.join(unused_weight)}")
+        if unused_family:
+            problems.append(f"Families list unknown classes: {', '.join(unused_family)}")
+        if problems and strict:
+            raise ValueError("Class metadata is inconsistent: " + "; ".join(problems))
+        for problem in problems:
+            print(f"**Warning: {problem}**")
+        return problems
+
+    def family_ids(self, families) -> np.ndarray:
+        """Maps family names to ids; raises ValueError on unknown families."""
+        unknown = [f for f in families if f not in MATERIAL_FAMILIES]
+        if unknown:
+            raise ValueError(f"Unknown material family: {', '.join(unknown)}")
+        return np.array([FAMILY_NAMES.index(f) for f in families], dtype=np.int8)
+
+    def class_ids_for_families(self, families) -> np.ndarray:
+        """All class ids that belong to any of the given families."""
+        return np.flatnonzero(np.isin(self.family_id, self.family_ids(families)))
+
+    def weights_for(self, class_ids: np.ndarray) -> np.ndarray:
+        return self.weight_g[class_ids]
+
+    def family_totals(self, counts: np.ndarray, weight_g: np.ndarray) -> dict:
+        """
+        {family: {"count", "weight_g"}} from id-indexed class totals. Classes without a
+        family are reported as "unknown", only when there are any.
+        """
+        family_slot = np.where(self.family_id < 0, len(FAMILY_NAMES), self.family_id)
+        family_counts = np.bincount(family_slot, weights=counts, minlength=len(FAMILY_NAMES) + 1)
+        family_weight = np.bincount(family_slot, weights=weight_g, minlength=len(FAMILY_NAMES) + 1)
+        by_family = {
+            name: {"count": int(family_counts[i]), "weight_g": float(family_weight[i])}
+            for i, name in enumerate(FAMILY_NAMES)
+        }
+        if family_counts[-1]:
+            by_family["unknown"] = {"count": int(family_counts[-1]), "weight_g": float(family_weight[-1])}
+        return by_family
+
+
+def load_class_metadata(names=None, data_yaml_path: str = DATA_YAML_PATH, strict: bool = False) -> ClassMetadata:
+    """
+    Builds the class metadata for a class list.
+
+    Args:
+        names: Class names by id (a list, or a model's {id: name} dict). Defaults to data.yaml.
+        data_yaml_path: data.yaml to read, and to cross-check `names` against when both exist.
+        strict: Raise instead of warn when the tables are inconsistent.
+    """
+    yaml_names = load_data_yaml_names(data_yaml_path)
+    if isinstance(names, dict):
+        names = [names[i] for i in range(len(names))]
+    if names is None:
+        if yaml_names is None:
+            raise FileNotFoundError(f"data.yaml not found: {os.path.abspath(data_yaml_path)}")
+        names = yaml_names
+    elif yaml_names is not None and list(names) != yaml_names:
+        message = f"Class names differ from {os.path.abspath(data_yaml_path)}; ids would not line up."
+        if strict:
+            raise ValueError(message)
+        print(f"**Warning: {message}**")
+
+    metadata = ClassMetadata(names)
+    metadata.validate(strict=strict)
+    return metadata
@@ -0,0 +1,188 @@
+"""
+Request deadlines and graceful degradation under overload.
+
+Every detection request has a latency budget. A client's X-Deadline-Ms header bounds the
+whole request. Without the header, DEFAULT_DEADLINE_MS bounds only the waiting: the
+expected cost of the mode the client asked for (e.g. TTA) is always allowed on top, so an
+idle server never degrades a request. Inference runs off the event loop, at most
+INFERENCE_CONCURRENCY at a time per worker; requests wait for a slot in arrival order,
+and the wait is measured. Once a request gets a slot, the scheduler picks the least
+degradation whose expected service time still fits in the rest of the budget:
+
+    none             full size, annotated image drawn (TTA if requested)
+    no_tta           single pass instead of TTA (TTA requests only)
+    skip_annotation  full size, no annotated image
+    reduced_size     REDUCED_IMGSZ inference, no annotated image
+    minimal          MINIMAL_IMGSZ inference, at most MINIMAL_MAX_DET detections
+
+Expected times are running averages of this worker's own measurements per level.
+Levels not measured yet are scaled from a measured level by pixel count. When not even
+`minimal` fits, the request is shed with 503, Retry-After and "X-Degradation: shed".
+A request is also shed before it queues when the queue ahead of it would already use up
+its budget.
+"""
+import os
+import math
+import time
+import asyncio
+from fastapi import HTTPException
+
+import uploads
+
+DEFAULT_DEADLINE_MS = float(os.environ.get("DEFAULT_DEADLINE_MS", "2000"))  # 0 = no deadline
+INFERENCE_CONCURRENCY = int(os.environ.get("INFERENCE_CONCURRENCY", "1"))  # Per worker process
+FULL_IMGSZ = 640             # The training size
+REDUCED_IMGSZ = 480
+MINIMAL_IMGSZ = 320
+MINIMAL_MAX_DET = 50
+EWMA_ALPHA = 0.2             # Weight of the newest measurement in the running averages
+SAFETY_FACTOR = 1.2          # Expected times are padded by this much before comparing to the budget
+
+# Cheapest last; "imgsz": None keeps the model's own size
+LEVELS = (
+    {"name": "none", "imgsz": None, "annotate": True, "max_det": None, "tta": True},
+    {"name": "no_tta", "imgsz": None, "annotate": True, "max_det": None, "tta": False},
+    {"name": "skip_annotation", "imgsz": None, "annotate": False, "max_det": None, "tta": False},
+    {"name": "reduced_size", "imgsz": REDUCED_IMGSZ, "annotate": False, "max_det": None, "tta": False},
+    {"name": "minimal", "imgsz": MINIMAL_IMGSZ, "annotate": False, "max_det": MINIMAL_MAX_DET, "tta": False},
+)
+
+
+def parse_deadline(header_value):
+    """
+    Budget in ms from the X-Deadline-Ms header (400 if malformed); 0 means no deadline,
+    None (no header) the default budget.
+    """
+    if header_value is None:
+        return None
+    try:
+        budget_ms = float(header_value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Deadline-Ms must be a number of milliseconds.")
+    if not math.isfinite(budget_ms):
+        raise HTTPException(status_code=400, detail="X-Deadline-Ms must be a finite number of milliseconds.")
+    if budget_ms < 0:
+        raise HTTPException(status_code=400, detail="X-Deadline-Ms must not be negative.")
+    return budget_ms
+
+
+class InferenceScheduler:
+    """Queues inferences for this worker and decides how much each one is degraded."""
+
+    def __init__(self, concurrency: int = INFERENCE_CONCURRENCY):
+        self.concurrency = concurrency
+        self.waiting = 0
+        self.running = 0
+        self.expected_ms = {}  # Level name (plus ":tta") -> running average service time
+        self._slots = None     # Created on first use, inside the server's event loop
+
+    def _key(self, level: dict, tta: bool) -> str:
+        return level["name"] + (":tta" if tta and level["tta"] else "")
+
+    def observe(self, level: dict, tta: bool, service_ms: float):
+        key = self._key(level, tta)
+        previous = self.expected_ms.get(key)
+        self.expected_ms[key] = service_ms if previous is None else (
+            (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * service_ms
+        )
+
+    def estimate_ms(self, level: dict, tta: bool):
+        """Expected service time of a level, or None while nothing comparable was measured."""
+        key = self._key(level, tta)
+        if key in self.expected_ms:
+            return self.expected_ms[key]
+        if tta and level["tta"]:
+            return None  # TTA costs do not scale from single-pass ones
+        # Scale a measured single-pass level by the number of pixels
+        pixels = (level["imgsz"] or FULL_IMGSZ) ** 2
+        for other in LEVELS:
+            measured = self.expected_ms.get(self._key(other, False))
+            if measured is not None:
+                return measured * pixels / (other["imgsz"] or FULL_IMGSZ) ** 2
+        return None
+
+    def levels_for(self, tta: bool) -> list:
+        return [level for level in LEVELS if tta or level["name"] != "no_tta"]
+
+    def choose(self, remaining_ms: float, tta: bool):
+        """The least degraded level expected to finish within remaining_ms, or None."""
+        for level in self.levels_for(tta):
+            estimate = self.estimate_ms(level, tta)
+            # Unmeasured levels are tried optimistically, so the averages get seeded
+            if estimate is None or estimate * SAFETY_FACTOR <= remaining_ms:
+                return level
+        return None
+
+    def expected_wait_ms(self) -> float:
+        """Rough queueing delay for a new request: the work ahead of it, spread over the slots."""
+        typical = self.estimate_ms(LEVELS[2], False) or 0.0
+        return (self.waiting + self.running) * typical / self.concurrency
+
+    def default_budget_ms(self, tta: bool) -> float:
+        """DEFAULT_DEADLINE_MS of waiting plus the expected cost of the undegraded request."""
+        if not DEFAULT_DEADLINE_MS:
+            return 0.0
+        requested = self.estimate_ms(self.levels_for(tta)[0], tta) or 0.0
+        return DEFAULT_DEADLINE_MS + requested * SAFETY_FACTOR
+
+    async def run(self, budget_ms, arrival: float, tta: bool, infer):
+        """
+        Waits for an inference slot within the budget, picks a level and runs
+        `infer(level)` in a worker thread. budget_ms is from parse_deadline (None for
+        the default budget).
+
+        Returns:
+            (result, {"level", "budget_ms", "queue_ms", "service_ms"})
+
+        Raises:
+            HTTPException: 503 with Retry-After when the request cannot finish in time.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        if budget_ms is None:
+            budget_ms = self.default_budget_ms(tta)
+        deadline = arrival + budget_ms / 1000 if budget_ms else None
+        levels = self.levels_for(tta)
+
+        if deadline is not None:
+            cheapest = self.estimate_ms(levels[-1], tta) or 0.0
+            if (time.perf_counter() - arrival) * 1000 + self.expected_wait_ms() + cheapest > budget_ms:
+                raise self._shed("Server is overloaded; the request could not finish within its deadline.")
+
+        self.waiting += 1
+        try:
+            if deadline is None:
+                await self._slots.acquire()
+            else:
+                await asyncio.wait_for(self._slots.acquire(), timeout=max(0.0, deadline - time.perf_counter()))
+        except asyncio.TimeoutError:
+            raise self._shed("Deadline expired while queued for inference.")
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            started = time.perf_counter()
+            queue_ms = (started - arrival) * 1000
+            level = LEVELS[0] if deadline is None else self.choose(budget_ms - queue_ms, tta)
+            if level is None:
+                raise self._shed("Not enough time left in the deadline for even the cheapest inference.")
+            # Waits for the thread even if the request is cancelled: it reads the upload buffer
+            result = await uploads.run_to_completion(infer, level)
+            service_ms = (time.perf_counter() - started) * 1000
+            self.observe(level, tta, service_ms)
+        finally:
+            self.running -= 1
+            self._slots.release()
+        return result, {
+            "level": level["name"],
+            "budget_ms": round(budget_ms, 1) if budget_ms else None,
+            "queue_ms": round(queue_ms, 1),
+            "service_ms": round(service_ms, 1),
+        }
+
+    def _shed(self, detail: str) -> HTTPException:
+        retry_after = max(1, round(self.expected_wait_ms() / 1000))
+        return HTTPException(
+            status_code=503, detail=detail, headers={"Retry-After": str(retry_after), "X-Degradation": "shed"}
+        )
@@ -0,0 +1,294 @@
+"""
+Optional write-behind store of every detection, so totals and trends can be computed
+after the fact. Enabled by setting DETECTIONS_DB to a SQLite file path.
+
+Requests only append their detections to an in-memory batch. A background thread
+writes the batches to SQLite (WAL mode, so readers never block the writer) every
+FLUSH_INTERVAL_S seconds, one transaction per batch. Each flush also adds the batch
+to per-minute and per-hour rollup tables keyed by (time bucket, station, class).
+Totals queries read only the rollups: the hour table for whole hours and the minute
+table for the partial hours at either end of the range. A query therefore reads a
+few rows per hour, station and class, whether the raw table holds thousands of rows
+or hundreds of millions. Raw rows are indexed by time for listing.
+"""
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+import numpy as np
+
+from class_metadata import ClassMetadata
+
+DETECTIONS_DB = os.environ.get("DETECTIONS_DB", "")
+FLUSH_INTERVAL_S = float(os.environ.get("DETECTIONS_FLUSH_S", "1"))
+# Detections held in memory while the database is unavailable; newer ones are dropped beyond this
+MAX_PENDING_ROWS = int(os.environ.get("DETECTIONS_MAX_PENDING", "200000"))
+BUSY_TIMEOUT_MS = 10000  # Other uvicorn workers may hold the write lock for a flush
+MAX_LIST_ROWS = 10000
+SERIES_BUCKETS = {"hour": 60, "day": 1440}  # Series bucket sizes in minutes (days are UTC)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS stations (station_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS detections (
+    ts REAL NOT NULL,
+    station_id INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    x1 INTEGER NOT NULL, y1 INTEGER NOT NULL, x2 INTEGER NOT NULL, y2 INTEGER NOT NULL,
+    weight_g REAL
+);
+CREATE INDEX IF NOT EXISTS detections_ts ON detections (ts);
+CREATE TABLE IF NOT EXISTS totals_minute (
+    bucket INTEGER NOT NULL, station_id INTEGER NOT NULL, class_id INTEGER NOT NULL,
+    count INTEGER NOT NULL, weight_g REAL NOT NULL,
+    PRIMARY KEY (bucket, station_id, class_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS totals_hour (
+    bucket INTEGER NOT NULL, station_id INTEGER NOT NULL, class_id INTEGER NOT NULL,
+    count INTEGER NOT NULL, weight_g REAL NOT NULL,
+    PRIMARY KEY (bucket, station_id, class_id)
+) WITHOUT ROWID;
+"""
+
+UPSERT_TOTALS = """
+INSERT INTO {table} (bucket, station_id, class_id, count, weight_g) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (bucket, station_id, class_id)
+DO UPDATE SET count = count + excluded.count, weight_g = weight_g + excluded.weight_g
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; a crash loses at most the last flushes
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+class DetectionStore:
+    """
+    Batches detection records in memory and writes them from a background thread.
+
+    Args:
+        path: SQLite database file (created if missing).
+        metadata: Class metadata of the loaded model. A database written with a
+            different class list is refused, since its class ids would mean other classes.
+    """
+
+    def __init__(self, path: str, metadata: ClassMetadata):
+        self.path = path
+        self.metadata = metadata
+        self.dropped = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._station_ids = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('names', ?)", (json.dumps(metadata.names),))
+        stored = json.loads(self._conn.execute("SELECT value FROM meta WHERE key = 'names'").fetchone()[0])
+        if stored != metadata.names:
+            self._conn.close()
+            raise ValueError(f"{path} was written with a different class list.")
+        self._reader = threading.local()
+        self._thread = threading.Thread(target=self._run, name="detection-store", daemon=True)
+        self._thread.start()
+
+    # --- Writing ---
+
+    def record(self, station: str, class_ids: np.ndarray, boxes_xyxy: np.ndarray, weights_g: np.ndarray,
+               ts: float = None) -> bool:
+        """
+        Queues one frame's detections; O(1) on the request path. Returns False if the
+        frame was dropped because too many detections are already waiting to be written.
+        """
+        n = len(class_ids)
+        if not n:
+            return True
+        with self._lock:
+            if self._pending_rows + n > MAX_PENDING_ROWS:
+                self.dropped += n
+                return False
+            self._pending.append((ts or time.time(), station or "", class_ids, boxes_xyxy, weights_g))
+            self._pending_rows += n
+        return True
+
+    def _station_id(self, name: str) -> int:
+        if name not in self._station_ids:
+            self._conn.execute("INSERT OR IGNORE INTO stations (name) VALUES (?)", (name,))
+            row = self._conn.execute("SELECT station_id FROM stations WHERE name = ?", (name,)).fetchone()
+            self._station_ids[name] = row[0]
+        return self._station_ids[name]
+
+    def flush(self) -> int:
+        """Writes everything queued in one transaction; returns the number of detections written."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._pending_rows = 0
+        if not batch:
+            return 0
+
+        try:
+            with self._conn:
+                rows = []
+                minute_totals = {}
+                for ts, station, class_ids, boxes, weights in batch:
+                    station_id = self._station_id(station)
+                    weights = [None if math.isnan(w) else w for w in weights.tolist()]
+                    for class_id, (x1, y1, x2, y2), weight in zip(class_ids.tolist(), boxes.tolist(), weights):
+                        rows.append((ts, station_id, class_id, x1, y1, x2, y2, weight))
+                        key = (int(ts // 60), station_id, class_id)
+                        totals = minute_totals.setdefault(key, [0, 0.0])
+                        totals[0] += 1
+                        totals[1] += weight or 0.0
+                hour_totals = {}
+                for (minute, station_id, class_id), (count, weight) in minute_totals.items():
+                    totals = hour_totals.setdefault((minute // 60, station_id, class_id), [0, 0.0])
+                    totals[0] += count
+                    totals[1] += weight
+
+                self._conn.executemany("INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.executemany(UPSERT_TOTALS.format(table="totals_minute"),
+                                       [key + tuple(v) for key, v in minute_totals.items()])
+                self._conn.executemany(UPSERT_TOTALS.format(table="totals_hour"),
+                                       [key + tuple(v) for key, v in hour_totals.items()])
+        except sqlite3.Error:
+            # Keep the batch for the next flush, within the pending limit
+            self._station_ids.clear()  # Ids inserted in the rolled-back transaction do not exist
+            with self._lock:
+                self._pending = batch + self._pending
+                self._pending_rows = sum(len(frame[2]) for frame in self._pending)
+                while self._pending_rows > MAX_PENDING_ROWS:
+                    dropped = self._pending.pop()
+                    self._pending_rows -= len(dropped[2])
+                    self.dropped += len(dropped[2])
+            raise
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.wait(FLUSH_INTERVAL_S):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Writing detections failed (will retry): {e}")
+
+    def close(self):
+        """Stops the writer and writes what is still queued."""
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+
+    # --- Queries ---
+
+    def _read_conn(self) -> sqlite3.Connection:
+        """One read connection per request thread; WAL readers see the last committed flush."""
+        conn = getattr(self._reader, "conn", None)
+        if conn is None:
+            conn = self._reader.conn = connect(self.path)
+        return conn
+
+    def _lookup_station(self, conn, station: str):
+        row = conn.execute("SELECT station_id FROM stations WHERE name = ?", (station,)).fetchone()
+        return row[0] if row else None
+
+    def totals(self, start: float, end: float, station: str = None, class_ids=None, bucket: str = None) -> dict:
+        """
+        Counts and grams by class, family and station for detections in [start, end)
+        (epoch seconds, at minute resolution), optionally as a time series by hour or day.
+        """
+        conn = self._read_conn()
+        start_min, end_min = int(start // 60), int(math.ceil(end / 60))
+        # Whole hours come from the hour table, the partial hours at either end from the minute table
+        first_hour, last_hour = -(-start_min // 60), end_min // 60
+        if first_hour < last_hour:
+            parts = [("totals_minute", start_min, first_hour * 60, 1),
+                     ("totals_hour", first_hour, last_hour, 60),
+                     ("totals_minute", last_hour * 60, end_min, 1)]
+        else:
+            parts = [("totals_minute", start_min, end_min, 1)]
+
+        filters, params = "", []
+        if station is not None:
+            station_id = self._lookup_station(conn, station)
+            if station_id is None:
+                parts = []  # Nothing was ever recorded for this station
+            filters += " AND station_id = ?"
+            params.append(station_id)
+        if class_ids is not None:
+            filters += f" AND class_id IN ({','.join(str(int(c)) for c in class_ids) or 'NULL'})"
+
+        step = SERIES_BUCKETS[bucket] if bucket else None
+        rows = []
+        for table, lo, hi, minutes in parts:
+            if lo >= hi:
+                continue
+            # Series bucket of each row, in minutes since the epoch (0 when no series was asked for)
+            series = f"(bucket * {minutes} / {step}) * {step}" if step else "0"
+            rows += conn.execute(
+                f"SELECT {series} AS t, station_id, class_id, SUM(count), SUM(weight_g) FROM {table} "
+                f"WHERE bucket >= ? AND bucket < ?{filters} GROUP BY t, station_id, class_id",
+                [lo, hi] + params,
+            ).fetchall()
+
+        names = dict(conn.execute("SELECT station_id, name FROM stations").fetchall())
+        counts = np.zeros(len(self.metadata), dtype=np.int64)
+        weight_g = np.zeros(len(self.metadata), dtype=np.float64)
+        by_station, by_time = {}, {}
+        for t, station_id, class_id, count, weight in rows:
+            counts[class_id] += count
+            weight_g[class_id] += weight
+            for totals in (by_station.setdefault(names.get(station_id, ""), [0, 0.0]),
+                           by_time.setdefault(t, [0, 0.0])):
+                totals[0] += count
+                totals[1] += weight
+
+        result = {
+            "start": start_min * 60,
+            "end": end_min * 60,
+            "station": station,
+            "total_count": int(counts.sum()),
+            "total_weight_g": float(weight_g.sum()),
+            "total_weight_kg": float(weight_g.sum()) / 1000,
+            "by_family": self.metadata.family_totals(counts, weight_g),
+            "by_class": {
+                self.metadata.names[i]: {"count": int(counts[i]), "weight_g": float(weight_g[i])}
+                for i in np.flatnonzero(counts)
+            },
+            "by_station": {name: {"count": c, "weight_g": w} for name, (c, w) in sorted(by_station.items())},
+        }
+        if step:
+            result["series"] = [{"start": t * 60, "count": c, "weight_g": w} for t, (c, w) in sorted(by_time.items())]
+        return result
+
+    def detections(self, start: float, end: float, station: str = None, limit: int = 1000) -> list:
+        """Raw detections in [start, end), oldest first, at most `limit` (MAX_LIST_ROWS)."""
+        conn = self._read_conn()
+        query = ("SELECT d.ts, s.name, d.class_id, d.x1, d.y1, d.x2, d.y2, d.weight_g "
+                 "FROM detections d JOIN stations s USING (station_id) WHERE d.ts >= ? AND d.ts < ?")
+        params = [start, end]
+        if station is not None:
+            query += " AND s.name = ?"
+            params.append(station)
+        query += " ORDER BY d.ts LIMIT ?"
+        params.append(max(1, min(int(limit), MAX_LIST_ROWS)))  # SQLite reads a negative LIMIT as none
+        return [
+            {
+                "ts": ts,
+                "station": name,
+                "class_id": class_id,
+                "material": self.metadata.names[class_id],
+                "box_xyxy": [x1, y1, x2, y2],
+                "weight_g": weight,
+            }
+            for ts, name, class_id, x1, y1, x2, y2, weight in conn.execute(query, params)
+        ]
@@ -1,70 +1,402 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Query, Request, Response
 import uvicorn
+import os
+import math
+import time
+import asyncio
 import numpy as np 
 from contextlib import asynccontextmanager
+from typing import Optional
 
 # Change: Import your module with a clear alias (e.g., model_logic) 
 # and ensure the file is named model.py
 import model as model_logic
+import class_metadata
+import sessions
+import response_formats
+import uploads
+import runtime_config
+import detection_store
+import deadlines
+import reid
 
 # Define the model path here, as it's specific to your environment
-MODEL_PATH = "best.pt"
+MODEL_PATH = os.environ.get("MODEL_PATH", "best.pt")
+# Per-class operating point exported by sweep_thresholds.py (optional)
+CLASS_THRESHOLDS_PATH = os.environ.get("CLASS_THRESHOLDS_PATH", "class_thresholds.json")
+# Where session totals are snapshotted, and how often
+SESSIONS_DIR = os.environ.get("SESSIONS_DIR", "sessions")
+SESSION_SNAPSHOT_S = float(os.environ.get("SESSION_SNAPSHOT_S", "30"))
+# Every detection is also written to this SQLite file when set (see detection_store.py)
+DETECTIONS_DB = detection_store.DETECTIONS_DB
 
 # Change: Global variable name changed to avoid conflict
 loaded_model = None 
+class_thresholds = None
+session_store = None
+detections_db = None
+upload_buffers = uploads.BufferPool()
+inference_scheduler = deadlines.InferenceScheduler()
+repeat_filter = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global loaded_model # Change: Reference the new global variable
+    global loaded_model, class_thresholds, session_store, detections_db, repeat_filter # Change: Reference the new global variable
+    # Size torch/OpenCV thread pools to this worker's share of the cores before any inference
+    settings = runtime_config.apply()
+    print(f"Worker threads: torch {settings['torch_threads']} (+{settings['torch_interop_threads']} inter-op), "
+          f"cv2 {settings['cv2_threads']}" + (f", pinned to cores {settings['cores']}" if settings["cores"] else ""))
     print("Starting up: Loading YOLO model...")
     try:
         # Change: Call load_model on the imported module alias
         loaded_model = model_logic.load_model(MODEL_PATH)
-        yield 
+        if reid.REID_WINDOW_S:
+            # Before the first predict, which copies the network along with its hooks
+            layer = reid.install_hook(loaded_model)
+            repeat_filter = reid.RepeatFilter()
+            print(f"Re-identifying repeat items per station over {reid.REID_WINDOW_S:g} s (backbone layer {layer}).")
+        if os.path.exists(CLASS_THRESHOLDS_PATH):
+            class_thresholds = model_logic.load_class_thresholds(CLASS_THRESHOLDS_PATH)
+            print(f"Loaded per-class thresholds for {len(class_thresholds['class_conf'])} classes.")
+        session_store = sessions.SessionStore(model_logic.class_metadata_for(loaded_model), SESSIONS_DIR)
+        restored = session_store.restore()
+        if restored:
+            print(f"Restored {restored} open sessions from {SESSIONS_DIR}.")
+        if DETECTIONS_DB:
+            try:
+                detections_db = detection_store.DetectionStore(DETECTIONS_DB, model_logic.class_metadata_for(loaded_model))
+                print(f"Recording detections to {DETECTIONS_DB}.")
+            except ValueError as e:
+                print(f"**Warning: {e} Detections are not recorded.**")
     except Exception as e:
         print(f"FATAL: Model loading failed: {e}")
         raise
 
+    snapshot_task = asyncio.create_task(sessions.snapshot_periodically(session_store, SESSION_SNAPSHOT_S))
+    yield
+    snapshot_task.cancel()
+    session_store.snapshot()
+    if detections_db is not None:
+        detections_db.close()
     print("Application shutting down.")
 
 # Initialize the FastAPI app using the lifespan context manager
 app = FastAPI(title="Recycling Sorter API", lifespan=lifespan)
 
 
+# Oversized requests get 413 while the body is received, before it is spooled to disk
+app.add_middleware(uploads.RequestSizeLimit, max_bytes=uploads.MAX_REQUEST_BYTES)
+
+
+@app.middleware("http")
+async def mark_arrival(request: Request, call_next):
+    """Deadlines count from here, so upload time and queueing are part of the budget."""
+    request.state.arrival = time.perf_counter()
+    return await call_next(request)
+
+
 @app.get("/")
 def home():
     """A simple endpoint to check if the API is online."""
     # Change: Reference the new global variable
     return {"status": "OK", "message": "Recycling Model API is running!", "model_loaded": loaded_model is not None}
 
-@app.post("/detect/")
-async def detect_materials(image: UploadFile = File(...)):
+def parse_families(families: Optional[str]):
+    """Splits and validates the comma-separated `families` form field."""
+    if not families:
+        return None
+    family_list = [f.strip().lower() for f in families.split(",") if f.strip()]
+    unknown = [f for f in family_list if f not in class_metadata.MATERIAL_FAMILIES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown material family: {', '.join(unknown)}. "
+                   f"Valid families: {', '.join(class_metadata.MATERIAL_FAMILIES)}",
+        )
+    return family_list
+
+def mark_repeats(station: str, result: dict) -> np.ndarray:
     """
-    Main endpoint to detect, classify, and weigh materials from an image file.
+    Matches the detections against the items the station saw recently (see reid.py) and
+    marks them in the result: "repeat" per detection (a flag array in the columnar
+    results) and "new_weight_g", the weight of the items seen for the first time.
+    Returns the repeat mask.
+    """
+    embeddings = result.pop("embeddings")
+    if "class_ids" in result:
+        class_ids, boxes, weights = result["class_ids"], result["boxes_xyxy"], result["weights_g"]
+    else:
+        detections = result["detections"]
+        class_ids = np.array([d["class_id"] for d in detections], dtype=np.intp)
+        boxes = np.array([d["box_xyxy"] for d in detections], dtype=np.int32).reshape(-1, 4)
+        weights = model_logic.class_metadata_for(loaded_model).weight_g[class_ids]
+    repeats = repeat_filter.match(station, class_ids, boxes, embeddings)
+    result["new_weight_g"] = int(np.nansum(weights[~repeats]))
+    if "class_ids" in result:
+        result["repeat"] = repeats
+    else:
+        for detection, repeat in zip(result["detections"], repeats.tolist()):
+            detection["repeat"] = repeat
+    return repeats
+
+def record_detections(station: Optional[str], result: dict, repeats: Optional[np.ndarray] = None):
+    """
+    Queues the detections for the detection store, if enabled (never blocks the request).
+    Repeats of items already recorded are left out, so totals count each item once.
+    """
+    if detections_db is None:
+        return
+    if "class_ids" in result:
+        class_ids, boxes, weights = result["class_ids"], result["boxes_xyxy"], result["weights_g"]
+    else:
+        detections = result["detections"]
+        class_ids = np.array([d["class_id"] for d in detections], dtype=np.intp)
+        boxes = np.array([d["box_xyxy"] for d in detections], dtype=np.int32).reshape(-1, 4)
+        weights = model_logic.class_metadata_for(loaded_model).weight_g[class_ids]
+    if repeats is not None:
+        class_ids, boxes, weights = class_ids[~repeats], boxes[~repeats], weights[~repeats]
+    detections_db.record(station, class_ids, boxes, weights)
+
+async def detect(
+    image: UploadFile, family_list: Optional[list], columnar: bool = False, tta: bool = False,
+    station: Optional[str] = None, budget_ms: Optional[float] = 0, arrival: float = None,
+) -> dict:
+    """
+    Runs inference on one uploaded image and maps errors to HTTP status codes.
+
+    Returns the JSON response dict, or with columnar=True the raw arrays from
+    predict_arrays (no per-detection dicts or drawing) for the compact formats.
+    Both carry "inference_ms", which /detect/ reports in a Server-Timing header,
+    and "degradation": what was given up to finish within budget_ms of `arrival`
+    (None for the default budget, 0 for none; see deadlines.py; 503 if even the
+    cheapest inference would not make it).
+    The detections are recorded under `station` when the detection store is enabled.
+    With re-identification on and a `station`, repeat items are marked (see mark_repeats).
     """
     # Change: CRITICAL: Check if the model is loaded before proceeding
     if loaded_model is None:
         raise HTTPException(status_code=503, detail="Model is not loaded. Check startup logs for errors.")
+
+    # The upload is read into a pooled buffer (413/415 on oversized or non-image uploads)
+    # and decoded straight from it
+    embed = repeat_filter is not None and station is not None
+    with upload_buffers.buffer() as buffer:
+        size = await uploads.read_upload(image, buffer)
+
+        def infer(level: dict) -> dict:
+            """Runs in a worker thread, with the settings of the chosen degradation level."""
+            use_tta = tta and level["tta"]
+            with memoryview(buffer)[:size] as image_bytes:
+                if columnar:
+                    return model_logic.predict_arrays(
+                        loaded_model, image_bytes, class_thresholds, family_list, use_tta,
+                        level["imgsz"], level["max_det"], embed,
+                    )
+                # Change: Call run_inference on the imported module alias 
+                # and pass the loaded model object as the first argument
+                return model_logic.run_inference(
+                    loaded_model, image_bytes, class_thresholds, family_list, use_tta,
+                    level["imgsz"], level["max_det"], level["annotate"], embed,
+                )
+
+        try:
+            results, degradation = await inference_scheduler.run(
+                budget_ms, arrival or time.perf_counter(), tta, infer
+            )
+            repeats = mark_repeats(station, results) if embed else None
+            record_detections(station, results, repeats)
+            if columnar:
+                results["degradation"] = degradation
+                return results
+            
+            return {
+                "total_weight_g": results["total_weight_g"],
+                "total_weight_kg": results["total_weight_g"] / 1000,
+                "detections": results["detections"],
+                **({"new_weight_g": results["new_weight_g"]} if embed else {}),
+                "degradation": degradation,
+                "inference_ms": results["inference_ms"],
+            }
         
+        except HTTPException:
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Image processing error: {e}")
+        except Exception as e:
+            print(f"Inference error: {e}")
+            raise HTTPException(status_code=500, detail="Internal server error during detection.")
+
+@app.post("/detect/")
+async def detect_materials(
+    request: Request,
+    image: UploadFile = File(...),
+    families: Optional[str] = Form(None),
+    tta: bool = Form(False),
+    station: Optional[str] = Form(None),
+    accept: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    """
+    Main endpoint to detect, classify, and weigh materials from an image file.
+
+    `families` is an optional comma-separated list of material families
+    (cardboard, glass, metal, paper, plastic, textile, wood) to detect at this station.
+
+    `tta=true` turns on test-time augmentation (flips and scales fused with WBF) for
+    audit requests: more accurate on small items, several times slower. The model time is
+    returned in the Server-Timing header so the two modes can be compared.
+
+    `station` names the sorting station; with DETECTIONS_DB set, every detection is
+    recorded under it for the /detections/ queries.
+
+    The Accept header selects the response format: application/json (default),
+    application/vnd.recycling.columnar+json or application/x-msgpack (see response_formats.py).
+
+    The X-Deadline-Ms header is the client's latency budget (0 for none). Under load the
+    server degrades the request to fit it: dropping TTA, the annotated image, inference size
+    and max_det, in that order, or rejects it with 503 and Retry-After. Without the header,
+    only queueing longer than DEFAULT_DEADLINE_MS degrades a request. The X-Degradation
+    header (and "degradation" in JSON) says what was applied, "shed" on a 503.
+
+    With REID_WINDOW_S set, detections at a `station` are matched against the items it saw
+    in that window (see reid.py): each detection gets a "repeat" flag, and "new_weight_g"
+    counts only first sightings, as do the detection store and session totals.
+    """
+    media_type = response_formats.negotiate(accept)
+    if media_type is None:
+        raise HTTPException(
+            status_code=406, detail=f"Supported response formats: {', '.join(response_formats.SUPPORTED)}"
+        )
+    budget_ms = deadlines.parse_deadline(x_deadline_ms)
+    result = await detect(
+        image, parse_families(families), columnar=media_type != response_formats.JSON, tta=tta, station=station,
+        budget_ms=budget_ms, arrival=request.state.arrival,
+    )
+    inference_ms = result.pop("inference_ms")
+    degradation = result["degradation"]
+    content = response_formats.encode(media_type, result, model_logic.class_metadata_for(loaded_model))
+    mode = "tta" if tta and degradation["level"] == "none" else "single-pass"
+    timing = f"inference;dur={inference_ms:.1f};desc=\"{mode}\", queue;dur={degradation['queue_ms']:.1f}"
+    return Response(
+        content=content, media_type=media_type,
+        headers={"Server-Timing": timing, "X-Degradation": degradation["level"]},
+    )
+
+# --- Sessions: running totals per material over a shift ---
+
+def get_session(session_id: str):
+    if session_store is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded. Check startup logs for errors.")
     try:
-        image_bytes = await image.read()
-        
-        # Change: Call run_inference on the imported module alias 
-        # and pass the loaded model object as the first argument
-        results = model_logic.run_inference(loaded_model, image_bytes)
-        
-        return {
-            "total_weight_g": results["total_weight_g"],
-            "total_weight_kg": results["total_weight_g"] / 1000,
-            "detections": results["detections"],
-        }
-    
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"Image processing error: {e}")
-    except Exception as e:
-        print(f"Inference error: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error during detection.")
+        return session_store.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown or closed session: {session_id}")
+
+@app.post("/sessions/")
+def open_session(station: Optional[str] = Form(None)):
+    """Opens a session (e.g. one shift at one station); frames posted to it are added to its totals."""
+    if session_store is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded. Check startup logs for errors.")
+    return session_store.summary(session_store.open(station))
+
+@app.post("/sessions/{session_id}/frames/")
+async def add_session_frame(
+    request: Request,
+    session_id: str,
+    image: UploadFile = File(...),
+    families: Optional[str] = Form(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    """
+    Detects materials in one frame and adds them to the session's totals.
+
+    Returns this frame's detections plus the session's running frame count and weight;
+    GET /sessions/{session_id} has the full breakdown by family and class.
+    Honors X-Deadline-Ms like /detect/.
+    """
+    session = get_session(session_id)
+    result = await detect(
+        image, parse_families(families), station=session.station,
+        budget_ms=deadlines.parse_deadline(x_deadline_ms), arrival=request.state.arrival,
+    )
+    result.pop("inference_ms")
+    # Repeats of items this station already counted are shown but not added again
+    class_ids = np.array([d["class_id"] for d in result["detections"] if not d.get("repeat")], dtype=np.intp)
+    try:
+        session = session_store.add_frame(session_id, class_ids)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Session was closed: {session_id}")
+    result["session"] = {
+        "session_id": session_id,
+        "frames": session.frames,
+        "total_weight_g": float(session.weight_g.sum()),
+    }
+    return result
+
+@app.get("/sessions/{session_id}")
+def read_session(session_id: str):
+    """Running totals of an open session, by material family and by class."""
+    return session_store.summary(get_session(session_id))
+
+@app.delete("/sessions/{session_id}")
+def close_session(session_id: str):
+    """Closes a session and returns its final totals (its last snapshot stays on disk)."""
+    get_session(session_id)
+    try:
+        return session_store.close(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown or closed session: {session_id}")
+
+# --- Detection history: totals over any time range (needs DETECTIONS_DB) ---
+
+def get_detection_store():
+    if detections_db is None:
+        raise HTTPException(status_code=503, detail="Detection recording is off. Set DETECTIONS_DB to enable it.")
+    return detections_db
+
+def time_range(start: Optional[float], end: Optional[float]):
+    """Defaults to the last 24 hours; epoch seconds."""
+    if any(t is not None and not math.isfinite(t) for t in (start, end)):
+        raise HTTPException(status_code=400, detail="start and end must be finite epoch seconds.")
+    end = time.time() if end is None else end
+    start = end - 86400 if start is None else start
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end.")
+    return start, end
+
+@app.get("/detections/totals")
+def detection_totals(
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    station: Optional[str] = None,
+    families: Optional[str] = None,
+    bucket: Optional[str] = None,
+):
+    """
+    Item counts and grams by material family, class and station for detections recorded
+    in [start, end) (epoch seconds; default the last 24 hours), optionally only for one
+    station or some families. `bucket=hour` or `bucket=day` (UTC) adds a time series.
+    """
+    store = get_detection_store()
+    if bucket is not None and bucket not in detection_store.SERIES_BUCKETS:
+        raise HTTPException(
+            status_code=400, detail=f"bucket must be one of: {', '.join(detection_store.SERIES_BUCKETS)}"
+        )
+    start, end = time_range(start, end)
+    family_list = parse_families(families)
+    class_ids = store.metadata.class_ids_for_families(family_list).tolist() if family_list else None
+    return store.totals(start, end, station, class_ids, bucket)
+
+@app.get("/detections/")
+def list_detections(
+    start: Optional[float] = None, end: Optional[float] = None, station: Optional[str] = None,
+    limit: int = Query(1000, ge=1),
+):
+    """Recorded detections in [start, end), oldest first (at most 10000 per request)."""
+    store = get_detection_store()
+    start, end = time_range(start, end)
+    return store.detections(start, end, station, limit)
 
 # A way to run the app from the command line (for testing)
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=runtime_config.load_settings()["workers"])
\ No newline at end of file
@@ -3,101 +3,24 @@ import numpy as np
 from ultralytics.utils.plotting import Annotator
 import cv2
 import math
-import io # Needed to handle the image bytes from FastAPI
-
-# --- Step 1: Define your "Weight Lookup Table" ---
-# (This remains a global variable, accessible by the inference function)
-AVERAGE_WEIGHTS_G = {
-    # Cardboard
-    'cardboard_bags': 50,
-    'cardboard_boxes': 400,
-    'cardboard_cups': 10,
-    'cardboard_holders': 50,
-    
-    # Glass
-    'glass_bottle_medium': 300,
-    'glass_bottle_small': 200,
-    'glass_cup': 250,
-    'glass_jar': 350,
-    'glass_jug': 1200,
-    
-    # Metal (HIGHLY VARIABLE)
-    'AL_foil': 10,
-    'chair_iron': 7000,
-    'door_handle_iron': 350,
-    'fan_iron': 5000,
-    'kettle_AL': 800,
-    'large_can_AL': 18,
-    'large_cooking_pan_AL': 1500,
-    'large_fork_AL': 80,
-    'large_knife_AL': 80,
-    'large_spoon_AL': 80,
-    'medium_fork_AL': 50,
-    'medium_spoon_AL': 50,
-    'refrigerator_iron': 85000,
-    'small_can_AL': 15,
-    'small_cooking_pan_AL': 700,
-    'small_fork_AL': 30,
-    'small_knife_AL': 30,
-    'small_spoon_AL': 30,
-    'stove_iron': 70000,
-    'table_iron': 15000,
-    'tap_iron': 2000,
-    'washer_machine_iron': 75000,
-    
-    # Paper
-    'Cartoon_paper': 60,
-    'Tissue_Paper': 1,
-    'newspapers': 350,
-    'paper': 5,
-    
-    # Plastic
-    'plastic_bags': 8,
-    'plastic_bottles_large': 25,
-    'plastic_bottles_medium': 22,
-    'plastic_bottles_small': 10,
-    'plastic_boxes': 1000,
-    'plastic_chairs': 3500,
-    'plastic_cups': 12,
-    'plastic_utensils': 3,
-    
-    # Textile (HIGHLY VARIABLE)
-    'child_chemise': 100,
-    'child_dress': 150,
-    'child_jacket': 400,
-    'child_pullover': 250,
-    'child_short': 100,
-    'child_skirt': 100,
-    'child_t_shirt': 100,
-    'child_trouser': 200,
-    'men_chemise': 150,
-    'men_jacket': 1100,
-    'men_pullover': 350,
-    'men_short': 250,
-    'men_t_shirt': 170,
-    'men_trouser': 400,
-    'women_blouse': 130,
-    'women_chemise': 130,
-    'women_gloves': 50,
-    'women_jacket': 900,
-    'women_pullover': 300,
-    'women_scarves': 100,
-    'women_skirt': 300,
-    'women_socks': 40,
-    'women_summer_dress': 250,
-    'women_trousers': 350,
-    'women_winter_dress': 500,
-    
-    # Wood (EXTREMELY VARIABLE)
-    'King&Queen bed': 100000,
-    'Tall chair': 7000,
-    'closet': 80000,
-    'dining table': 60000,
-    'full bed': 55000,
-    'seat': 6000,
-    'side table': 10000,
-}
+import json
+import time
+from functools import lru_cache
+
+from class_metadata import ClassMetadata, load_class_metadata
+import tta as tta_logic
+import reid
 
+# Used when no per-class thresholds are configured (same as ultralytics' predict default)
+DEFAULT_CONF = 0.25
+DEFAULT_IOU = 0.7
+DEFAULT_MAX_DET = 300
+
+
+@lru_cache(maxsize=4)
+def class_metadata_for(model: YOLO) -> ClassMetadata:
+    """Class metadata (id-indexed weights, families, colors) for a loaded model's classes."""
+    return load_class_metadata(model.names)
 
 
 def load_model(model_path: str) -> YOLO:
@@ -109,6 +32,7 @@ def load_model(model_path: str) -> YOLO:
         # The path should be passed from the main FastAPI file
         model = YOLO(model_path)
         print(f"Model loaded successfully. Detecting {len(model.names)} classes.")
+        class_metadata_for(model)  # Check names/weights/families once, at startup
         return model
     except Exception as e:
         print(f"Error loading model: {e}")
@@ -116,70 +40,192 @@ def load_model(model_path: str) -> YOLO:
         raise # Re-raise the exception to stop FastAPI startup
 
 
-def run_inference(model: YOLO, image_bytes: bytes) -> dict:
+def load_class_thresholds(thresholds_path: str) -> dict:
     """
-    Runs inference on the image bytes, calculates weight, and returns results.
+    Loads the operating point exported by sweep_thresholds.py.
+
+    Returns:
+        A dictionary with 'default_conf', 'iou', 'max_det' and 'class_conf' ({class_name: conf}).
+    """
+    with open(thresholds_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return {
+        "default_conf": float(config.get("default_conf", DEFAULT_CONF)),
+        "iou": float(config.get("iou", DEFAULT_IOU)),
+        "max_det": int(config.get("max_det", DEFAULT_MAX_DET)),
+        "class_conf": {name: float(conf) for name, conf in config.get("class_conf", {}).items()},
+    }
+
+
+def build_class_filter(model: YOLO, thresholds: dict = None, families: list = None):
+    """
+    Resolves per-class thresholds and a material-family filter against the model's classes.
 
     Args:
         model: The loaded YOLO model object.
-        image_bytes: The raw bytes of the image file received from FastAPI.
-        
+        thresholds: Output of load_class_thresholds, or None for one global threshold.
+        families: Material families to keep (e.g. ['metal', 'plastic']), or None for all.
+
     Returns:
-        A dictionary containing detections, total weight, and image URL (or bytes).
+        (class ids to pass to predict or None, per-class conf array indexed by class id)
+    """
+    metadata = class_metadata_for(model)
+    conf_by_id = np.full(len(metadata), thresholds["default_conf"] if thresholds else DEFAULT_CONF, dtype=np.float32)
+    if thresholds:
+        for name, conf in thresholds["class_conf"].items():
+            if name in metadata.index:
+                conf_by_id[metadata.index[name]] = conf
+
+    if not families:
+        return None, conf_by_id
+    return metadata.class_ids_for_families(families).tolist(), conf_by_id
+
+
+def predict_arrays(
+    model: YOLO, image_bytes: bytes, thresholds: dict = None, families: list = None, tta: bool = False,
+    imgsz: int = None, max_det: int = None, embed: bool = False,
+) -> dict:
+    """
+    Runs inference on the image bytes and returns the kept detections as id-indexed arrays.
+
+    Args:
+        model: The loaded YOLO model object.
+        image_bytes: The encoded image file (bytes or any buffer, e.g. a memoryview of an upload buffer).
+        thresholds: Optional per-class thresholds from load_class_thresholds.
+        families: Optional list of material families to detect; other classes are
+            dropped inside predict's NMS, before any postprocessing.
+        tta: Opt-in accuracy mode: flips and several scales in one batched forward pass,
+            merged with weighted box fusion (see tta.py). Several times slower.
+        imgsz: Inference size (long side); smaller is faster and misses small items.
+            Defaults to the model's own (the training size). With tta, the size of the
+            scale-1.0 variant.
+        max_det: Overrides the configured maximum number of detections.
+        embed: Also return an appearance embedding per detection, for re-identifying
+            repeat items (see reid.py; needs reid.install_hook on the model).
+
+    Returns:
+        {"image": decoded BGR image, "class_ids": (n,) intp, "boxes_xyxy": (n, 4) int32,
+         "weights_g": (n,) float32 with NaN where no weight is defined, "total_weight_g": int,
+         "inference_ms": time spent in the model, for comparing modes,
+         "embeddings": (n, reid.REID_DIM) float32, only with embed}
     """
-    # 1. Convert image bytes to an OpenCV image format (numpy array)
-    image_stream = io.BytesIO(image_bytes)
-    image_np = cv2.imdecode(
-        np.frombuffer(image_stream.read(), np.uint8), cv2.IMREAD_COLOR
-    )
+    class_ids, conf_by_id = build_class_filter(model, thresholds, families)
+    # predict gets the lowest threshold that can still matter; stricter classes are cut below
+    min_conf = float(conf_by_id[class_ids].min()) if class_ids else float(conf_by_id.min())
+
+    # 1. Decode straight from the caller's buffer (bytes or a memoryview), without copying it
+    image_np = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
 
     if image_np is None:
         raise ValueError("Could not decode image bytes.")
     
-    # Run prediction directly on the numpy array (OpenCV image)
-    # The 'stream=True' is often useful in FastAPI to prevent blocking
-    results = model.predict(image_np, stream=True)
-
-    total_weight = 0
-    detections = []
-    
-    # NEW: Create an 'Annotator' object to draw on our image
-    annotator = Annotator(image_np.copy(), line_width=2, example=str(model.names))
+    iou = thresholds["iou"] if thresholds else DEFAULT_IOU
+    configured_max_det = thresholds["max_det"] if thresholds else DEFAULT_MAX_DET
+    max_det = min(max_det, configured_max_det) if max_det else configured_max_det
+    if embed:
+        reid.clear()
+    start = time.perf_counter()
+    tta_imgsz = (imgsz or tta_logic.model_imgsz(model)) if tta else None
+    if tta:
+        xyxy_array, conf_array, cls_array = tta_logic.predict_tta(
+            model, image_np, min_conf, iou, max_det, class_ids, tta_imgsz
+        )
+        xyxy_array = xyxy_array.astype(np.int32)
+    else:
+        # Run prediction directly on the numpy array (OpenCV image)
+        # The 'stream=True' is often useful in FastAPI to prevent blocking
+        results = model.predict(
+            image_np,
+            stream=True,
+            conf=min_conf,
+            iou=iou,
+            max_det=max_det,
+            classes=class_ids,
+            **({"imgsz": imgsz} if imgsz else {}),
+        )
 
-    # 2. Process results
-    if results:
+        # 2. Process results
         # The stream=True returns a generator, so we iterate to get the result
-        result = next(results) 
-        boxes = result.boxes
+        boxes = next(results).boxes
+        cls_array = boxes.cls.cpu().numpy().astype(np.intp)
+        conf_array = boxes.conf.cpu().numpy()
+        xyxy_array = boxes.xyxy.cpu().numpy().astype(np.int32)
+    inference_ms = (time.perf_counter() - start) * 1000
+
+    # Apply the per-class thresholds in one vectorized step
+    keep = conf_array >= conf_by_id[cls_array]
+    cls_array, xyxy_array = cls_array[keep], xyxy_array[keep]
+
+    # Look up all weights at once by class id (NaN = no weight defined)
+    weights = class_metadata_for(model).weight_g[cls_array]
+    arrays = {
+        "image": image_np,
+        "class_ids": cls_array,
+        "boxes_xyxy": xyxy_array,
+        "weights_g": weights,
+        "total_weight_g": int(np.nansum(weights)),
+        "inference_ms": inference_ms,
+    }
+    if embed:
+        arrays["embeddings"] = reid.box_embeddings(xyxy_array, image_np.shape[:2], tta_imgsz)
+    return arrays
+
+
+def detection_dicts(arrays: dict, metadata: ClassMetadata) -> list:
+    """One {"class_id", "box_xyxy", "material", "weight_g"} dict per detection in predict_arrays' output."""
+    return [
+        {
+            "class_id": cls_id,
+            "box_xyxy": box,
+            "material": metadata.names[cls_id],
+            "weight_g": None if math.isnan(weight) else int(weight),
+        }
+        for cls_id, box, weight in zip(
+            arrays["class_ids"].tolist(), arrays["boxes_xyxy"].tolist(), arrays["weights_g"].tolist()
+        )
+    ]
+
+
+def run_inference(
+    model: YOLO, image_bytes: bytes, thresholds: dict = None, families: list = None, tta: bool = False,
+    imgsz: int = None, max_det: int = None, annotate: bool = True, embed: bool = False,
+) -> dict:
+    """
+    Runs inference on the image bytes, calculates weight, and returns results.
+
+    Args:
+        model: The loaded YOLO model object.
+        image_bytes: The raw bytes of the image file received from FastAPI.
+        thresholds: Optional per-class thresholds from load_class_thresholds.
+        families: Optional list of material families to detect.
+        tta: Opt-in test-time augmentation (slower, more accurate); see predict_arrays.
+        imgsz, max_det: Optional cheaper settings for overload; see predict_arrays.
+        annotate: Draw the annotated image (skipped when the request is short on time).
+        embed: Also return the detections' embeddings ("embeddings"); see predict_arrays.
         
-        for box in boxes:
-            # Get class ID and name
-            cls_id = int(box.cls[0])
-            class_name = model.names[cls_id]
-            
-            # Get bounding box coordinates (normalized for output, absolute for drawing)
-            x1_abs, y1_abs, x2_abs, y2_abs = [int(x) for x in box.xyxy[0]]
-            
-            # Look up the weight
-            weight_of_item = AVERAGE_WEIGHTS_G.get(class_name)
-            
-            # Structure the detection result
-            detection_data = {
-                "box_xyxy": [x1_abs, y1_abs, x2_abs, y2_abs],
-                "material": class_name,
-                "weight_g": weight_of_item,
-            }
-            detections.append(detection_data)
-
-            # Update total weight and draw label
-            if weight_of_item:
-                total_weight += weight_of_item
-                label = f"{class_name}: {weight_of_item}g"
-            else:
-                label = f"{class_name}: ??g"
-                
-            # Draw the box and our custom label on the image
-            annotator.box_label((x1_abs, y1_abs, x2_abs, y2_abs), label, color=(0, 200, 0)) # Green box
+    Returns:
+        A dictionary containing detections, total weight, and image URL (or bytes).
+    """
+    arrays = predict_arrays(model, image_bytes, thresholds, families, tta, imgsz, max_det, embed)
+    metadata = class_metadata_for(model)
+    detections = detection_dicts(arrays, metadata)
+    embeddings = {"embeddings": arrays["embeddings"]} if embed else {}
+    if not annotate:
+        return {
+            "total_weight_g": arrays["total_weight_g"],
+            "detections": detections,
+            "inference_ms": arrays["inference_ms"],
+            **embeddings,
+        }
+    
+    # NEW: Create an 'Annotator' object to draw on our image
+    annotator = Annotator(arrays["image"].copy(), line_width=2, example=str(model.names))
+    for detection in detections:
+        weight_of_item = detection["weight_g"]
+        label = f"{detection['material']}: {weight_of_item}g" if weight_of_item is not None else f"{detection['material']}: ??g"
+        # Draw the box and our custom label on the image, colored by material family
+        color = tuple(int(c) for c in metadata.color[detection["class_id"]])
+        annotator.box_label(detection["box_xyxy"], label, color=color)
 
     # 3. Prepare the annotated image for response (e.g., as base64 or saved file path)
     # For simplicity, we'll skip returning the image bytes, but the logic is ready.
@@ -188,8 +234,10 @@ def run_inference(model: YOLO, image_bytes: bytes) -> dict:
     
     # 4. Return the structured results
     return {
-        "total_weight_g": total_weight,
+        "total_weight_g": arrays["total_weight_g"],
         "detections": detections,
+        "inference_ms": arrays["inference_ms"],
+        **embeddings,
     }
 
 # We can remove the `if __name__ == "__main__":` block from this file
@@ -0,0 +1,224 @@
+"""
+Re-identification of repeat items across consecutive captures at a station.
+
+The same object often stays in view for several captures, and every capture would count
+its weight again. With REID_WINDOW_S set, each detection gets a compact appearance
+embedding, taken from the forward pass that already ran: a forward hook keeps the last
+backbone feature map, RoIAlign averages it over the box, and a fixed random projection
+reduces it to REID_DIM dimensions (L2-normalized, so a dot product is the cosine). The
+feature map is centered per channel first; raw activations are all non-negative and make
+any two regions look alike.
+
+Each station keeps the items it saw in the last REID_WINDOW_S seconds in an in-memory
+index. A new detection is a repeat of a recent item of the same class when its box
+overlaps the item's last box by at least REID_MIN_IOU and its embedding is at least
+REID_MIN_SIMILARITY to the item's: it is still returned, but its weight is not counted
+again. Set REID_MIN_IOU to 0 where items move further than their own size between
+captures. Matching a frame is one small matrix product against the station's recent items;
+items expire when they have not been seen for the window, and a station's index is
+dropped once all of its items have expired.
+"""
+import os
+import math
+import time
+import threading
+import numpy as np
+import torch
+import torchvision
+from ultralytics import YOLO
+
+import tta as tta_logic
+
+REID_WINDOW_S = float(os.environ.get("REID_WINDOW_S", "0"))  # 0 = off
+# A re-captured item scores 0.99+; a different item in the same place stayed below 0.9
+REID_MIN_SIMILARITY = float(os.environ.get("REID_MIN_SIMILARITY", "0.95"))
+REID_MIN_IOU = float(os.environ.get("REID_MIN_IOU", "0.3"))  # 0 = match anywhere in the frame
+REID_MAX_ITEMS = int(os.environ.get("REID_MAX_ITEMS", "2048"))  # Per station; the least recently seen are evicted first
+REID_DIM = 64
+PROJECTION_SEED = 0           # Fixed, so embeddings stay comparable across restarts and workers
+
+# The last forward pass in this thread: network input size and hooked feature map
+_captured = threading.local()
+_projections = {}
+
+
+def _capture_input(module, args):
+    _captured.input_hw = tuple(args[0].shape[2:])
+
+
+def _capture_features(module, args, output):
+    _captured.features = output
+
+
+def install_hook(model: YOLO, layer: int = None) -> int:
+    """
+    Hooks the model's last backbone layer (or `layer`); returns the hooked layer index.
+
+    The hooks sit on layer modules, which survive every path: TTA calls the network
+    itself, and predict's AutoBackend wraps the network and fuses Conv+BN in place, which
+    changes each module's forward but keeps the module and its hooks. The predictor takes
+    a deep copy of the network (hooks included) on the first predict, so hook before that.
+    Every forward pass in the thread overwrites the capture, wanted or not: run clear()
+    before each predict whose features are read, and again after reading them.
+    """
+    net = model.model
+    if layer is None:
+        layer = len(net.yaml["backbone"]) - 1
+    net.model[0].register_forward_pre_hook(_capture_input)
+    net.model[layer].register_forward_hook(_capture_features)
+    return layer
+
+
+def clear():
+    """Forgets the last capture in this thread, so a failed pass cannot leave stale features."""
+    _captured.__dict__.clear()
+
+
+def projection(channels: int) -> np.ndarray:
+    """The (channels, REID_DIM) Gaussian random projection, cached per channel count."""
+    if channels not in _projections:
+        rng = np.random.default_rng(PROJECTION_SEED)
+        _projections[channels] = (rng.standard_normal((channels, REID_DIM)) / np.sqrt(REID_DIM)).astype(np.float32)
+    return _projections[channels]
+
+
+def box_embeddings(boxes_xyxy: np.ndarray, image_hw: tuple, tta_imgsz: int = None) -> np.ndarray:
+    """
+    Embeddings of boxes (original image pixels) from the features of the forward pass
+    that just ran in this thread. tta_imgsz: the base size, when that pass was a TTA batch.
+
+    Returns:
+        (n, REID_DIM) float32, L2-normalized rows.
+    """
+    features, input_hw = _captured.features, _captured.input_hw
+    clear()
+    h0, w0 = image_hw
+    if tta_imgsz:
+        # TTA runs all variants as one batch; use the unflipped variant at scale 1.0,
+        # which sits unpadded in the top-left corner of the canvas
+        variant = tta_logic.TTA_SCALES.index(1.0) * len(tta_logic.TTA_FLIPS) + tta_logic.TTA_FLIPS.index(False)
+        features = features[variant:variant + 1]
+        ratio, pad_x, pad_y = tta_imgsz / max(h0, w0), 0.0, 0.0
+    else:
+        # ultralytics' letterbox: scaled to fit, padding split evenly on both sides
+        ratio = min(input_hw[0] / h0, input_hw[1] / w0)
+        pad_x = (input_hw[1] - round(w0 * ratio)) / 2
+        pad_y = (input_hw[0] - round(h0 * ratio)) / 2
+
+    boxes = torch.as_tensor(np.asarray(boxes_xyxy, dtype=np.float32).reshape(-1, 4)) * ratio
+    boxes += torch.tensor([pad_x, pad_y, pad_x, pad_y])
+    scale = features.shape[-1] / input_hw[1]
+    # The activations are non-negative, so every raw pooled vector points the same way
+    # (cosines of 0.95+ between unrelated regions). Subtracting the per-channel mean over
+    # the image (padding excluded) leaves what sets a region apart from the rest of the frame.
+    x0, y0 = int(pad_x * scale), int(pad_y * scale)
+    x1 = max(x0 + 1, math.ceil((pad_x + w0 * ratio) * scale))
+    y1 = max(y0 + 1, math.ceil((pad_y + h0 * ratio) * scale))
+    with torch.no_grad():
+        features = features.float()
+        features = features - features[..., y0:y1, x0:x1].mean(dim=(2, 3), keepdim=True)
+        pooled = torchvision.ops.roi_align(
+            features, [boxes.to(features.device)], output_size=1, spatial_scale=scale, aligned=True,
+        )
+    embeddings = pooled.flatten(1).cpu().numpy() @ projection(pooled.shape[1])
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings
+
+
+def pair_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of corresponding rows of two (n, 4) xyxy arrays."""
+    inter_w = (np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])).clip(0)
+    inter_h = (np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])).clip(0)
+    inter = inter_w * inter_h
+    union = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+class RecentItems:
+    """
+    The items one station saw recently, in fixed-size arrays. A slot whose item was
+    last seen more than the window ago is free; new items take the stalest slots.
+    """
+
+    def __init__(self, capacity: int = REID_MAX_ITEMS, dim: int = REID_DIM):
+        self.embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self.boxes = np.zeros((capacity, 4), dtype=np.float32)
+        self.class_ids = np.full(capacity, -1, dtype=np.intp)
+        self.last_seen = np.full(capacity, -np.inf)
+
+    def match(self, class_ids: np.ndarray, boxes_xyxy: np.ndarray, embeddings: np.ndarray, now: float,
+              window_s: float, min_similarity: float, min_iou: float) -> np.ndarray:
+        """
+        Matches one frame's detections against the recent items and updates the index.
+
+        Only items of the same class whose last box overlaps the detection by at least
+        min_iou are compared. Each recent item is matched at most once per frame, by its
+        most similar detection, so two alike items side by side both count.
+
+        Returns:
+            (n,) bool, True where the detection is a repeat of a recent item.
+        """
+        boxes_xyxy = np.asarray(boxes_xyxy, dtype=np.float32).reshape(-1, 4)
+        repeats = np.zeros(len(class_ids), dtype=bool)
+        active = np.flatnonzero(self.last_seen >= now - window_s)
+        if len(active) and len(class_ids):
+            # One small matrix product, then only the few pairs that look alike are checked
+            similarity = embeddings @ self.embeddings[active].T
+            rows, cols = np.nonzero(similarity >= min_similarity)
+            items = active[cols]
+            keep = self.class_ids[items] == class_ids[rows]
+            if min_iou > 0:
+                keep &= pair_iou(boxes_xyxy[rows], self.boxes[items]) >= min_iou
+            rows, items, scores = rows[keep], items[keep], similarity[rows[keep], cols[keep]]
+            # Greedy one-to-one assignment, most similar pairs first
+            taken = set()
+            for k in np.argsort(-scores, kind="stable").tolist():
+                row, slot = int(rows[k]), int(items[k])
+                if repeats[row] or slot in taken:
+                    continue
+                repeats[row] = True
+                taken.add(slot)
+                # Follow the item's appearance and position as it moves
+                self.embeddings[slot] = embeddings[row]
+                self.boxes[slot] = boxes_xyxy[row]
+                self.last_seen[slot] = now
+
+        new = np.flatnonzero(~repeats)[:len(self.last_seen)]
+        if len(new):
+            slots = np.argpartition(self.last_seen, len(new) - 1)[:len(new)]
+            self.embeddings[slots] = embeddings[new]
+            self.boxes[slots] = boxes_xyxy[new]
+            self.class_ids[slots] = class_ids[new]
+            self.last_seen[slots] = now
+        return repeats
+
+    def newest(self) -> float:
+        return float(self.last_seen.max())
+
+
+class RepeatFilter:
+    """Per-station RecentItems, created on a station's first frame and dropped once stale."""
+
+    def __init__(self, window_s: float = REID_WINDOW_S, min_similarity: float = REID_MIN_SIMILARITY,
+                 min_iou: float = REID_MIN_IOU, capacity: int = REID_MAX_ITEMS):
+        self.window_s = window_s
+        self.min_similarity = min_similarity
+        self.min_iou = min_iou
+        self.capacity = capacity
+        self._stations = {}
+        self._lock = threading.Lock()
+
+    def match(self, station: str, class_ids: np.ndarray, boxes_xyxy: np.ndarray, embeddings: np.ndarray,
+              now: float = None) -> np.ndarray:
+        """(n,) bool, True where a detection repeats an item the station saw within the window."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            stale = [name for name, items in self._stations.items() if items.newest() < now - self.window_s]
+            for name in stale:
+                del self._stations[name]
+            if station not in self._stations:
+                self._stations[station] = RecentItems(self.capacity, embeddings.shape[1])
+            return self._stations[station].match(
+                np.asarray(class_ids, dtype=np.intp), boxes_xyxy, embeddings, now,
+                self.window_s, self.min_similarity, self.min_iou,
+            )
@@ -0,0 +1,109 @@
+"""
+Response encodings for /detect/, chosen by the request's Accept header.
+
+    application/json (default)                 One object per detection, as before.
+    application/vnd.recycling.columnar+json    Parallel arrays (class ids, boxes, weights)
+                                               and the class-name table once per response.
+    application/x-msgpack                      The columnar layout in MessagePack, with the
+                                               arrays as packed little-endian binary.
+
+With re-identification on (see reid.py), the columnar layouts also carry "new_weight_g"
+and a "repeat" flag per detection.
+
+All JSON is encoded with orjson, which is several times faster than the stdlib encoder
+FastAPI falls back to. Use `python benchmark.py --serialization` to compare encoders.
+"""
+import numpy as np
+import orjson
+import msgpack
+
+from class_metadata import ClassMetadata
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.recycling.columnar+json"
+MSGPACK = "application/x-msgpack"
+SUPPORTED = (JSON, COLUMNAR_JSON, MSGPACK)
+
+# Layout tag in the columnar payloads, bumped if the fields or dtypes ever change
+COLUMNAR_VERSION = 1
+
+
+def negotiate(accept: str):
+    """
+    Picks a media type from an Accept header, honoring q-values.
+
+    Returns JSON for a missing header or */*, and None if nothing acceptable is supported.
+    """
+    if not accept:
+        return JSON
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type, q = fields[0].lower(), 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            candidates.append((-q, position, media_type))
+    for _, _, media_type in sorted(candidates):
+        if media_type in SUPPORTED:
+            return media_type
+        if media_type in ("*/*", "application/*"):
+            return JSON
+    return None
+
+
+def repeat_fields(arrays: dict, encode_flags) -> dict:
+    """The re-identification fields, when the result has them."""
+    if "repeat" not in arrays:
+        return {}
+    return {"new_weight_g": arrays["new_weight_g"], "repeat": encode_flags(arrays["repeat"])}
+
+
+def columnar_json(arrays: dict, metadata: ClassMetadata) -> bytes:
+    """Columnar JSON from predict_arrays' output; unknown weights are null."""
+    return orjson.dumps({
+        "format": COLUMNAR_VERSION,
+        "count": len(arrays["class_ids"]),
+        "total_weight_g": arrays["total_weight_g"],
+        "total_weight_kg": arrays["total_weight_g"] / 1000,
+        "names": metadata.names,
+        "class_ids": arrays["class_ids"].astype(np.int32),
+        "boxes_xyxy": arrays["boxes_xyxy"],
+        "weights_g": arrays["weights_g"],
+        **repeat_fields(arrays, lambda flags: flags),
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def columnar_msgpack(arrays: dict, metadata: ClassMetadata) -> bytes:
+    """
+    Columnar MessagePack from predict_arrays' output. The arrays are raw bytes:
+    class_ids '<u2' (n,), boxes_xyxy '<i4' (n, 4) row-major, weights_g '<f4' (n,) with NaN
+    for unknown weights, and repeat 'u1' (n,) 0/1 when present;
+    e.g. np.frombuffer(payload["boxes_xyxy"], "<i4").reshape(-1, 4).
+    """
+    return msgpack.packb({
+        "format": COLUMNAR_VERSION,
+        "count": len(arrays["class_ids"]),
+        "total_weight_g": arrays["total_weight_g"],
+        "names": metadata.names,
+        "class_ids": arrays["class_ids"].astype("<u2").tobytes(),
+        "boxes_xyxy": arrays["boxes_xyxy"].astype("<i4").tobytes(),
+        "weights_g": arrays["weights_g"].astype("<f4").tobytes(),
+        **repeat_fields(arrays, lambda flags: flags.astype("u1").tobytes()),
+    })
+
+
+def encode(media_type: str, result: dict, metadata: ClassMetadata) -> bytes:
+    """
+    Encodes a detection result: the JSON response dict for JSON, or predict_arrays'
+    output for the columnar media types.
+    """
+    if media_type == MSGPACK:
+        return columnar_msgpack(result, metadata)
+    if media_type == COLUMNAR_JSON:
+        return columnar_json(result, metadata)
+    return orjson.dumps(result)
@@ -0,0 +1,117 @@
+"""
+CPU threading and core pinning for API worker processes.
+
+Without limits, every uvicorn worker starts torch and OpenCV thread pools sized to the
+whole machine, so N workers oversubscribe the cores N times over. Each worker calls
+apply() at startup to size its pools to its share of the cores and, optionally, pin
+itself to a disjoint block of cores.
+
+Settings come from runtime_config.yaml (written by tune_runtime.py), and environment
+variables override them:
+
+    WEB_CONCURRENCY        uvicorn worker processes (uvicorn's own --workers default)
+    TORCH_THREADS          torch intra-op threads per worker (default: cores // workers)
+    TORCH_INTEROP_THREADS  torch inter-op threads per worker (default: 1)
+    CV2_THREADS            OpenCV threads per worker (default: 1; decoding is per request)
+    CPU_PINNING            'on' pins each worker to its own TORCH_THREADS cores (Linux only)
+"""
+import os
+import tempfile
+import yaml
+import cv2
+import torch
+
+RUNTIME_CONFIG_PATH = os.environ.get("RUNTIME_CONFIG_PATH", "runtime_config.yaml")
+# Workers claim pinning slots by locking files here; a crashed worker's slot frees itself
+CPU_SLOT_DIR = os.environ.get("CPU_SLOT_DIR", os.path.join(tempfile.gettempdir(), "recycling_api_cpu_slots"))
+
+# Keys of runtime_config.yaml and the environment variables that override them
+SETTINGS_ENV = {
+    "workers": "WEB_CONCURRENCY",
+    "torch_threads": "TORCH_THREADS",
+    "torch_interop_threads": "TORCH_INTEROP_THREADS",
+    "cv2_threads": "CV2_THREADS",
+    "cpu_pinning": "CPU_PINNING",
+}
+
+_slot_lock = None  # Held open for the life of the worker
+
+
+def available_cores() -> list:
+    """Cores this process may run on (respects container CPU sets), in order."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def load_settings(path: str = RUNTIME_CONFIG_PATH) -> dict:
+    """Defaults, then runtime_config.yaml, then environment variables."""
+    settings = {}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            settings = {k: v for k, v in (yaml.safe_load(f) or {}).items() if k in SETTINGS_ENV}
+    for key, env in SETTINGS_ENV.items():
+        if os.environ.get(env):
+            settings[key] = os.environ[env]
+
+    cores = len(available_cores())
+    workers = max(1, int(settings.get("workers", 1)))
+    pinning = settings.get("cpu_pinning", False)
+    return {
+        "workers": workers,
+        "torch_threads": max(1, int(settings.get("torch_threads", cores // workers))),
+        "torch_interop_threads": max(1, int(settings.get("torch_interop_threads", 1))),
+        "cv2_threads": max(0, int(settings.get("cv2_threads", 1))),
+        "cpu_pinning": pinning if isinstance(pinning, bool) else str(pinning).lower() in ("1", "on", "true"),
+    }
+
+
+def claim_slot(workers: int):
+    """
+    Claims the lowest free worker slot (0..workers-1) by locking a slot file.
+    Returns the slot index, or None if slots cannot be claimed on this platform.
+    """
+    global _slot_lock
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    os.makedirs(CPU_SLOT_DIR, exist_ok=True)
+    # uvicorn restarts crashed workers, so briefly there can be more processes than slots
+    for slot in range(workers * 2):
+        f = open(os.path.join(CPU_SLOT_DIR, f"slot_{slot}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_lock = f
+        return slot % workers
+    return None
+
+
+def apply(settings: dict = None) -> dict:
+    """
+    Sizes this process's torch and OpenCV thread pools and pins it to its cores if enabled.
+    Must run before the model's first inference (torch fixes the inter-op pool on first use).
+    """
+    settings = dict(settings or load_settings())
+    torch.set_num_threads(settings["torch_threads"])
+    try:
+        torch.set_num_interop_threads(settings["torch_interop_threads"])
+    except RuntimeError:
+        # Already fixed in this process (e.g. apply() called twice); keep the existing pool
+        settings["torch_interop_threads"] = torch.get_num_interop_threads()
+    cv2.setNumThreads(settings["cv2_threads"])
+
+    settings["cores"] = None
+    if settings["cpu_pinning"] and hasattr(os, "sched_setaffinity"):
+        slot = claim_slot(settings["workers"])
+        if slot is not None:
+            cores = available_cores()
+            count = settings["torch_threads"]
+            start = (slot * count) % len(cores)
+            pinned = [cores[(start + i) % len(cores)] for i in range(min(count, len(cores)))]
+            os.sched_setaffinity(0, pinned)
+            settings["cores"] = pinned
+    return settings
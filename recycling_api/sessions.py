@@ -0,0 +1,190 @@
+"""
+Running per-class and per-family totals for sorting-station sessions (e.g. one shift).
+
+Each session keeps two fixed-size arrays indexed by class id (item counts and grams),
+so adding a frame costs O(1) per detection no matter how long the session runs.
+Family totals are derived from the class arrays when a session is read. Sessions that
+changed since the last snapshot are written to SESSIONS_DIR as JSON, and open sessions
+are restored from there when the API restarts.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+import numpy as np
+
+from class_metadata import ClassMetadata
+
+
+class Session:
+    """Aggregates for one session. Mutated only through SessionStore, under its lock."""
+
+    def __init__(self, session_id: str, num_classes: int, station: str = None):
+        self.session_id = session_id
+        self.station = station
+        self.created = time.time()
+        self.updated = self.created
+        self.frames = 0
+        self.counts = np.zeros(num_classes, dtype=np.int64)
+        self.weight_g = np.zeros(num_classes, dtype=np.float64)
+        self.dirty = True
+
+    def to_dict(self, names: list) -> dict:
+        """Snapshot format; class arrays are stored by name so a reordered class list is caught."""
+        return {
+            "session_id": self.session_id,
+            "station": self.station,
+            "created": self.created,
+            "updated": self.updated,
+            "frames": self.frames,
+            "names": names,
+            "counts": self.counts.tolist(),
+            "weight_g": self.weight_g.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Session":
+        session = cls(data["session_id"], len(data["names"]), data.get("station"))
+        session.created = data["created"]
+        session.updated = data["updated"]
+        session.frames = data["frames"]
+        session.counts[:] = data["counts"]
+        session.weight_g[:] = data["weight_g"]
+        session.dirty = False
+        return session
+
+
+class SessionStore:
+    """
+    In-memory session aggregates with periodic snapshots to local disk.
+
+    Args:
+        metadata: Class metadata of the loaded model (names and id-indexed lookup arrays).
+        directory: Where session snapshots are written.
+    """
+
+    def __init__(self, metadata: ClassMetadata, directory: str):
+        self.metadata = metadata
+        self.directory = directory
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()  # Orders snapshot writes against the final write on close
+        # Weights with NaN (no weight defined) count as 0 g, like the per-image total
+        self._weight_g = np.nan_to_num(metadata.weight_g).astype(np.float64)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def open(self, station: str = None) -> Session:
+        session = Session(uuid.uuid4().hex, len(self.metadata), station)
+        with self._lock:
+            self.sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id: str) -> Session:
+        """Raises KeyError if the session does not exist or was closed."""
+        return self.sessions[session_id]
+
+    def add_frame(self, session_id: str, class_ids: np.ndarray) -> Session:
+        """Adds one frame's detections (class ids) to the session's totals."""
+        with self._lock:
+            session = self.sessions[session_id]
+            np.add.at(session.counts, class_ids, 1)
+            np.add.at(session.weight_g, class_ids, self._weight_g[class_ids])
+            session.frames += 1
+            session.updated = time.time()
+            session.dirty = True
+        return session
+
+    def close(self, session_id: str) -> dict:
+        """Removes the session from memory and returns its final summary; its snapshot is kept, marked closed."""
+        with self._lock:
+            session = self.sessions.pop(session_id)
+            data = session.to_dict(self.metadata.names)
+        data["closed"] = time.time()
+        with self._io_lock:
+            self._write(session_id, data)
+        return self.summary(session)
+
+    def summary(self, session: Session) -> dict:
+        """Totals by class (non-zero classes only) and by material family."""
+        with self._lock:
+            counts, weight_g = session.counts.copy(), session.weight_g.copy()
+            frames, updated = session.frames, session.updated
+
+        by_family = self.metadata.family_totals(counts, weight_g)
+        by_class = {
+            self.metadata.names[i]: {"count": int(counts[i]), "weight_g": float(weight_g[i])}
+            for i in np.flatnonzero(counts)
+        }
+        return {
+            "session_id": session.session_id,
+            "station": session.station,
+            "created": session.created,
+            "updated": updated,
+            "frames": frames,
+            "total_count": int(counts.sum()),
+            "total_weight_g": float(weight_g.sum()),
+            "total_weight_kg": float(weight_g.sum()) / 1000,
+            "by_family": by_family,
+            "by_class": by_class,
+        }
+
+    def _write(self, session_id: str, data: dict):
+        """Atomic write: a crash mid-snapshot leaves the previous snapshot intact."""
+        path = self._path(session_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def snapshot(self) -> int:
+        """Writes every session that changed since the last snapshot; returns how many were written."""
+        with self._lock:
+            pending = [(s.session_id, s.to_dict(self.metadata.names)) for s in self.sessions.values() if s.dirty]
+            for session_id, _ in pending:
+                self.sessions[session_id].dirty = False
+        for i, (session_id, data) in enumerate(pending):
+            try:
+                with self._io_lock:
+                    # A session closed meanwhile already has its final snapshot
+                    if session_id in self.sessions:
+                        self._write(session_id, data)
+            except OSError:
+                # Retry the unwritten sessions at the next snapshot
+                with self._lock:
+                    for unwritten_id, _ in pending[i:]:
+                        if unwritten_id in self.sessions:
+                            self.sessions[unwritten_id].dirty = True
+                raise
+        return len(pending)
+
+    def restore(self) -> int:
+        """Loads the open (not closed) sessions from the snapshot directory."""
+        restored = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("closed"):
+                continue
+            if data["names"] != self.metadata.names:
+                print(f"**Warning: Session {data['session_id']} was recorded with other classes; not restored.**")
+                continue
+            self.sessions[data["session_id"]] = Session.from_dict(data)
+            restored += 1
+        return restored
+
+
+async def snapshot_periodically(store: SessionStore, interval_s: float):
+    """Background task: snapshots changed sessions every interval_s seconds, off the event loop."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            await asyncio.to_thread(store.snapshot)
+        except OSError as e:
+            print(f"Session snapshot failed: {e}")
@@ -0,0 +1,59 @@
+"""Repeat-item matching (reid.py): the same item is counted once, distinct items each once."""
+import numpy as np
+import torch
+
+import reid
+
+
+def unit(rows):
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_centered_embeddings_tell_unrelated_regions_apart():
+    # Non-negative activations with a strong shared component, like post-SiLU backbone
+    # features: raw pooling would put any two regions at a cosine near 1
+    rng = np.random.default_rng(0)
+    features = 5.0 + rng.random((1, 256, 20, 20), dtype=np.float32)
+    reid._captured.features = torch.from_numpy(features)
+    reid._captured.input_hw = (640, 640)
+    left, right = reid.box_embeddings(np.array([[0, 0, 160, 640], [480, 0, 640, 640]]), (640, 640))
+    assert float(left @ right) < reid.REID_MIN_SIMILARITY
+
+
+def test_same_item_recaptured_is_a_repeat():
+    repeats = reid.RepeatFilter(window_s=10)
+    embedding = unit(np.random.default_rng(1).standard_normal((1, reid.REID_DIM)))
+    assert not repeats.match("line1", [3], [[100, 100, 200, 200]], embedding, now=0.0).any()
+    assert repeats.match("line1", [3], [[105, 102, 205, 203]], embedding, now=0.5).all()
+
+
+def test_two_different_items_of_the_same_class_both_count():
+    repeats = reid.RepeatFilter(window_s=10)
+    rng = np.random.default_rng(2)
+    first, second = unit(rng.standard_normal((2, reid.REID_DIM)))
+    box = [[100, 100, 200, 200]]
+    assert not repeats.match("line1", [3], box, first[None], now=0.0).any()
+    # A different item where the first one was
+    assert not repeats.match("line1", [3], box, second[None], now=0.5).any()
+    # A look-alike elsewhere in the frame
+    assert not repeats.match("line1", [3], [[400, 100, 500, 200]], first[None], now=1.0).any()
+
+
+def test_alike_items_side_by_side_are_matched_one_to_one():
+    repeats = reid.RepeatFilter(window_s=10, min_iou=0)
+    embedding = unit(np.ones((1, reid.REID_DIM)))
+    boxes = [[0, 0, 100, 100], [120, 0, 220, 100]]
+    assert not repeats.match("line1", [3, 3], boxes, np.repeat(embedding, 2, 0), now=0.0).any()
+    assert repeats.match("line1", [3, 3], boxes, np.repeat(embedding, 2, 0), now=0.5).all()
+    assert not repeats.match("line1", [3, 3, 3], boxes + [[240, 0, 340, 100]],
+                             np.repeat(embedding, 3, 0), now=1.0).all()
+
+
+def test_items_expire_after_the_window():
+    repeats = reid.RepeatFilter(window_s=10)
+    embedding = unit(np.ones((1, reid.REID_DIM)))
+    box = [[100, 100, 200, 200]]
+    repeats.match("line1", [3], box, embedding, now=0.0)
+    assert not repeats.match("line1", [3], box, embedding, now=11.0).any()
+    assert not repeats.match("line2", [3], box, embedding, now=11.5).any()  # Stations are separate
@@ -0,0 +1,51 @@
+"""Upload size limits (uploads.py): oversized bodies get 413 while they are received."""
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+import main
+import uploads
+
+BOUNDARY = "limit-test"
+
+
+def multipart_chunks(total_bytes: int, chunk_bytes: int = 1024 * 1024):
+    """A multipart body with one JPEG-looking file part of total_bytes, as a generator (sent chunked)."""
+    yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"a.jpg\"\r\n"
+           f"Content-Type: image/jpeg\r\n\r\n").encode() + b"\xff\xd8\xff"
+    sent = 3
+    while sent < total_bytes:
+        n = min(chunk_bytes, total_bytes - sent)
+        yield bytes(n)
+        sent += n
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def post_chunked(client, total_bytes, chunk_bytes=1024 * 1024):
+    return client.post(
+        "/detect/",
+        content=multipart_chunks(total_bytes, chunk_bytes),
+        headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"},
+    )
+
+
+def test_oversized_chunked_upload_is_rejected_while_received():
+    calls = []
+    app = FastAPI()
+    app.add_middleware(uploads.RequestSizeLimit, max_bytes=10_000)
+
+    @app.post("/detect/")
+    async def detect(image: UploadFile = File(...)):
+        calls.append(image.filename)
+        return {"ok": True}
+
+    client = TestClient(app)
+    response = post_chunked(client, 50_000, chunk_bytes=1000)
+    assert response.status_code == 413
+    assert calls == []  # The endpoint never saw the upload
+    assert post_chunked(client, 5_000, chunk_bytes=1000).status_code == 200
+
+
+def test_api_rejects_oversized_chunked_upload():
+    # No Content-Length: only the counted body can trip the limit
+    response = post_chunked(TestClient(main.app), uploads.MAX_REQUEST_BYTES + 1024 * 1024)
+    assert response.status_code == 413
@@ -0,0 +1,159 @@
+"""
+Test-time augmentation: an opt-in, slower and more accurate inference mode for audits.
+
+The image is resized to several scales, each with and without a horizontal flip, and
+all variants go through the network as one batch (padded to a common canvas). Each
+variant is NMS-ed on its own, its boxes are mapped back to the original image, and the
+variants are merged with weighted box fusion (WBF): overlapping same-class boxes are
+averaged, weighted by confidence, and boxes that only some variants found lose score.
+"""
+import math
+import numpy as np
+import cv2
+import torch
+import torchvision
+from ultralytics import YOLO
+
+IMG_SIZE = 640                   # Base size (scale 1.0) when the model does not record its own
+TTA_SCALES = (0.83, 1.0, 1.25)   # Upscaling helps small items such as cutlery
+TTA_FLIPS = (False, True)        # Horizontal flip
+STRIDE = 32                      # Largest model stride; canvas sides must be multiples of it
+PAD_VALUE = 114                  # Same gray as ultralytics' letterbox
+MAX_NMS_CANDIDATES = 30000       # Same pre-NMS cap as ultralytics
+WBF_IOU = 0.55                   # Boxes from different variants overlapping this much are fused
+
+_networks = {}
+
+
+def network(model: YOLO):
+    """The model's torch module on the inference device, cached per model."""
+    if id(model) not in _networks:
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        _networks[id(model)] = model.model.to(device).eval()
+    return _networks[id(model)]
+
+
+def model_imgsz(model: YOLO) -> int:
+    """The size the model was trained at (long side), which plain predict also uses by default."""
+    imgsz = model.overrides.get("imgsz") or getattr(model.model, "args", {}).get("imgsz") or IMG_SIZE
+    return int(max(imgsz)) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+
+def build_batch(image: np.ndarray, imgsz: int = IMG_SIZE):
+    """
+    Resizes and flips the image into every variant, padded (bottom/right) to one canvas.
+
+    Returns:
+        (uint8 batch (V, 3, C, C) in RGB, [(ratio, flipped, resized width)] per variant)
+    """
+    h0, w0 = image.shape[:2]
+    canvas = int(math.ceil(imgsz * max(TTA_SCALES) / STRIDE) * STRIDE)
+    batch = np.full((len(TTA_SCALES) * len(TTA_FLIPS), canvas, canvas, 3), PAD_VALUE, dtype=np.uint8)
+    variants = []
+    for scale in TTA_SCALES:
+        r = imgsz * scale / max(h0, w0)
+        w, h = min(int(round(w0 * r)), canvas), min(int(round(h0 * r)), canvas)
+        resized = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
+        for flipped in TTA_FLIPS:
+            batch[len(variants), :h, :w] = resized[:, ::-1] if flipped else resized
+            variants.append((r, flipped, w))
+    return np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2)), variants  # BGR HWC -> RGB CHW
+
+
+def variant_nms(prediction: torch.Tensor, conf: float, iou: float, max_det: int, class_ids):
+    """Per-class NMS on one variant's raw head output (4 + nc, anchors), as in ultralytics."""
+    class_scores = prediction[4:]
+    scores, cls = class_scores.max(dim=0)
+    keep = scores >= conf
+    if class_ids is not None:
+        keep &= torch.isin(cls, torch.as_tensor(class_ids, device=cls.device))
+    xywh, scores, cls = prediction[:4, keep].T, scores[keep], cls[keep]
+    if len(scores) > MAX_NMS_CANDIDATES:
+        top = scores.topk(MAX_NMS_CANDIDATES).indices
+        xywh, scores, cls = xywh[top], scores[top], cls[top]
+    boxes = torch.cat([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], dim=1)
+    kept = torchvision.ops.batched_nms(boxes, scores, cls, iou)[:max_det]
+    return boxes[kept].cpu().numpy(), scores[kept].cpu().numpy(), cls[kept].cpu().numpy()
+
+
+def weighted_box_fusion(boxes, scores, cls, num_variants: int, iou_thr: float = WBF_IOU):
+    """
+    Fuses same-class boxes from all variants. A fused box is the score-weighted mean of its
+    members; its score is their mean score, scaled down if fewer than all variants found it.
+    """
+    fused_boxes, fused_scores, fused_cls = [], [], []
+    for c in np.unique(cls):
+        members = np.flatnonzero(cls == c)
+        members = members[np.argsort(-scores[members], kind="stable")]
+        sums = np.zeros((len(members), 4))    # Score-weighted coordinate sums per cluster
+        totals = np.zeros(len(members))       # Score sums
+        counts = np.zeros(len(members), dtype=np.int64)
+        current = np.zeros((len(members), 4))  # Current fused box per cluster
+        clusters = 0
+        for i in members:
+            box, score = boxes[i], scores[i]
+            if clusters:
+                # IoU against every cluster's current fused box
+                cb = current[:clusters]
+                inter_w = (np.minimum(cb[:, 2], box[2]) - np.maximum(cb[:, 0], box[0])).clip(0)
+                inter_h = (np.minimum(cb[:, 3], box[3]) - np.maximum(cb[:, 1], box[1])).clip(0)
+                inter = inter_w * inter_h
+                union = ((cb[:, 2] - cb[:, 0]) * (cb[:, 3] - cb[:, 1])
+                         + (box[2] - box[0]) * (box[3] - box[1]) - inter)
+                overlap = inter / np.maximum(union, 1e-9)
+                best = int(overlap.argmax())
+            if clusters and overlap[best] >= iou_thr:
+                k = best
+            else:
+                k = clusters
+                clusters += 1
+            sums[k] += box * score
+            totals[k] += score
+            counts[k] += 1
+            current[k] = sums[k] / totals[k]
+        fused_boxes.append(current[:clusters])
+        fused_scores.append(totals[:clusters] / counts[:clusters]
+                            * np.minimum(counts[:clusters], num_variants) / num_variants)
+        fused_cls.append(np.full(clusters, c))
+    if not fused_boxes:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.intp)
+    return (np.concatenate(fused_boxes).astype(np.float32), np.concatenate(fused_scores).astype(np.float32),
+            np.concatenate(fused_cls).astype(np.intp))
+
+
+def predict_tta(model: YOLO, image: np.ndarray, conf: float, iou: float, max_det: int, class_ids=None,
+                imgsz: int = None):
+    """
+    Runs every variant in one batched forward pass and fuses the results. The scales are
+    relative to imgsz, by default the model's own size (model_imgsz).
+
+    Returns:
+        (xyxy float32 (n, 4) in original pixels, scores (n,), class ids (n,)), best score first.
+    """
+    net = network(model)
+    device = next(net.parameters()).device
+    batch, variants = build_batch(image, imgsz or model_imgsz(model))
+    x = torch.from_numpy(batch).to(device).float() / 255.0
+    with torch.no_grad():
+        preds = net(x)
+    if isinstance(preds, (list, tuple)):
+        preds = preds[0]
+
+    h0, w0 = image.shape[:2]
+    all_boxes, all_scores, all_cls = [], [], []
+    for prediction, (r, flipped, w) in zip(preds.float(), variants):
+        boxes, scores, cls = variant_nms(prediction, conf, iou, max_det, class_ids)
+        if flipped:
+            boxes[:, [0, 2]] = w - boxes[:, [2, 0]]
+        boxes /= r
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w0)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h0)
+        all_boxes.append(boxes)
+        all_scores.append(scores)
+        all_cls.append(cls)
+
+    boxes, scores, cls = weighted_box_fusion(
+        np.concatenate(all_boxes), np.concatenate(all_scores), np.concatenate(all_cls), len(variants)
+    )
+    order = np.argsort(-scores, kind="stable")[:max_det]
+    return boxes[order], scores[order], cls[order]
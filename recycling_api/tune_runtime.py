@@ -0,0 +1,196 @@
+"""
+Finds the best split of this machine's cores between uvicorn workers and per-worker
+torch threads, and writes it to runtime_config.yaml (read by runtime_config.py).
+
+Every candidate starts a real server (uvicorn, on a free local port) and is measured with
+the benchmark.py load generator at two points: one request at a time (latency) and
+2 x workers concurrent requests (saturated throughput).
+
+    python tune_runtime.py --corpus ./bench_images
+    python tune_runtime.py --corpus ./bench_images --objective latency
+    python tune_runtime.py --corpus ./bench_images --max-p99-ms 500
+
+Needs httpx and psutil, like benchmark.py.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import httpx
+import yaml
+
+import benchmark
+import runtime_config
+
+RESULTS_PATH = os.path.join(benchmark.RESULTS_DIR, "runtime_tuning.json")
+DEFAULT_DURATION_S = 15
+LOG_TAIL_BYTES = 4096         # Only the end of a failed server's log is read for its error
+STARTUP_TIMEOUT_S = 300
+
+
+def candidate_configs(cores: int, pinning: list) -> list:
+    """Worker counts of 1, 2, 4, ... up to the core count, each with cores // workers threads."""
+    worker_counts = []
+    workers = 1
+    while workers <= cores:
+        worker_counts.append(workers)
+        workers *= 2
+    if worker_counts[-1] != cores:
+        worker_counts.append(cores)
+    configs = []
+    for workers in worker_counts:
+        for pin in pinning:
+            if pin and workers == 1:
+                continue  # One worker owns every core anyway
+            configs.append({
+                "workers": workers,
+                "torch_threads": max(1, cores // workers),
+                "torch_interop_threads": 1,
+                "cv2_threads": 1,
+                "cpu_pinning": pin,
+            })
+    return configs
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(config: dict, port: int, model_path: str, log):
+    """Starts a candidate server. Its stderr goes to the file `log`: a pipe nobody reads would fill up and block it."""
+    env = dict(os.environ)
+    env["MODEL_PATH"] = os.path.abspath(model_path)
+    for key, name in runtime_config.SETTINGS_ENV.items():
+        env[name] = "on" if config[key] is True else "off" if config[key] is False else str(config[key])
+    # Candidates must not pick up a previously tuned file
+    env["RUNTIME_CONFIG_PATH"] = ""
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(config["workers"]), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=log,
+    )
+
+
+def last_line(log) -> str:
+    """The last non-empty line the server wrote to its log, or None."""
+    log.seek(max(0, log.seek(0, os.SEEK_END) - LOG_TAIL_BYTES))
+    lines = log.read().decode(errors="replace").strip().splitlines()
+    return lines[-1] if lines else None
+
+
+def wait_until_ready(url: str, process) -> bool:
+    deadline = time.time() + STARTUP_TIMEOUT_S
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if httpx.get(url + "/", timeout=2).json().get("model_loaded"):
+                return True
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(1)
+    return False
+
+
+def measure(config: dict, corpus: list, args) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryFile() as log:
+        process = start_server(config, port, args.model, log)
+        try:
+            if not wait_until_ready(url, process):
+                if process.poll() is None:
+                    return {"error": "timeout"}
+                return {"error": last_line(log) or "server failed to start"}
+            # Warm every worker (first inferences are slow) before measuring
+            warmup = argparse.Namespace(url=url, server_pid=process.pid, rates=None, families=None, accept=args.accept,
+                                        concurrency=[config["workers"] * 2], duration=max(2.0, args.duration / 5))
+            asyncio.run(benchmark.run_over_http(corpus, warmup))
+
+            run_args = argparse.Namespace(**{**vars(warmup), "concurrency": [1, config["workers"] * 2],
+                                             "duration": args.duration})
+            single, saturated = asyncio.run(benchmark.run_over_http(corpus, run_args))
+            return {"single": single, "saturated": saturated}
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def choose(results: list, objective: str, max_p99_ms: float):
+    ok = [r for r in results if "error" not in r and r["saturated"]["error_rate"] == 0]
+    if objective == "latency":
+        return min(ok, key=lambda r: r["single"]["latency_ms"]["p50"], default=None)
+    if max_p99_ms:
+        ok = [r for r in ok if r["saturated"]["latency_ms"]["p99"] <= max_p99_ms]
+    return max(ok, key=lambda r: r["saturated"]["throughput_rps"], default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune workers and thread counts for this machine.")
+    parser.add_argument("--corpus", required=True, help="Directory of request images.")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "best.pt"), help="Path to 'best.pt'.")
+    parser.add_argument("--objective", choices=["throughput", "latency"], default="throughput",
+                        help="Maximize saturated req/s, or minimize single-request p50.")
+    parser.add_argument("--max-p99-ms", type=float, help="With --objective throughput: p99 bound under load.")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_S, help="Seconds per measurement.")
+    parser.add_argument("--accept", help="Response format to request (see benchmark.py --accept).")
+    parser.add_argument("--no-pinning", action="store_true", help="Only try unpinned workers.")
+    parser.add_argument("--output", default=runtime_config.RUNTIME_CONFIG_PATH)
+    args = parser.parse_args()
+
+    corpus = benchmark.load_corpus(args.corpus)
+    cores = len(runtime_config.available_cores())
+    configs = candidate_configs(cores, [False] if args.no_pinning else [False, True])
+    print(f"{cores} cores, {len(configs)} candidates, {len(corpus)} images\n")
+    print(f"{'workers':>7} {'threads':>7} {'pinned':>6} {'p50 @1':>9} {'req/s @sat':>11} {'p99 @sat':>9}")
+
+    results = []
+    for config in configs:
+        stats = measure(config, corpus, args)
+        results.append({**config, **stats})
+        prefix = f"{config['workers']:>7} {config['torch_threads']:>7} {str(config['cpu_pinning']):>6}"
+        if "error" in stats:
+            print(f"{prefix}  failed: {stats['error']}")
+        else:
+            print(f"{prefix} {stats['single']['latency_ms']['p50']:>9.1f} "
+                  f"{stats['saturated']['throughput_rps']:>11.2f} {stats['saturated']['latency_ms']['p99']:>9.1f}")
+
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    with open(RESULTS_PATH, "w", encoding="utf-8") as f:
+        json.dump({"commit": benchmark.git_commit(), "cores": cores, "results": results}, f, indent=2)
+    print(f"\nSaved all measurements to: {RESULTS_PATH}")
+
+    best = choose(results, args.objective, args.max_p99_ms)
+    if best is None:
+        print("Error: No configuration met the requirements.")
+        return
+    config = {key: best[key] for key in runtime_config.SETTINGS_ENV}
+    config.update({
+        "objective": args.objective,
+        "measured_single_p50_ms": round(best["single"]["latency_ms"]["p50"], 1),
+        "measured_saturated_rps": round(best["saturated"]["throughput_rps"], 2),
+        "measured_saturated_p99_ms": round(best["saturated"]["latency_ms"]["p99"], 1),
+    })
+    with open(args.output, "w", encoding="utf-8") as f:
+        yaml.dump(config, f, sort_keys=False, default_flow_style=False)
+
+    print("\n--- Best configuration ---")
+    for key, value in config.items():
+        print(f"{key}: {value}")
+    print(f"\nSaved to {args.output}. uvicorn's worker count comes from the command line or")
+    print(f"WEB_CONCURRENCY, so start the server with: --workers {config['workers']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Bounded-memory handling of uploaded images.
+
+Uploads are read in chunks into a reusable bytearray from a small pool, so each request
+holds at most one copy of the image (plus the decoded pixels), never more than
+MAX_UPLOAD_BYTES. Content that does not start with a known image signature is rejected
+after the first chunk, and cv2 decodes straight from the pooled buffer.
+
+The multipart parser spools file parts to a temporary file before the endpoint runs, with
+no size cap of its own, so RequestSizeLimit bounds the request body while it is received:
+by its Content-Length when there is one, and by counting the bytes of chunked bodies.
+
+Work on a pooled buffer in a worker thread goes through run_to_completion: a thread cannot
+be stopped, so a cancelled request waits for it before its buffer goes back to the pool,
+where the next upload would overwrite it under the thread.
+"""
+import os
+import asyncio
+import threading
+from contextlib import contextmanager
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+# Requests may carry a little multipart framing and form fields on top of the image
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+INITIAL_BUFFER_BYTES = 2 * 1024 * 1024
+POOL_SIZE = 4                              # Buffers kept for reuse (about the expected concurrency)
+MAX_POOLED_BUFFER_BYTES = 8 * 1024 * 1024  # Larger buffers are dropped after use instead of pooled
+
+# Formats cv2 can decode and the datasets use (same set as IMG_EXTENSIONS in the scripts)
+IMAGE_SIGNATURES = (
+    (0, b"\xff\xd8\xff"),          # JPEG
+    (0, b"\x89PNG\r\n\x1a\n"),     # PNG
+    (0, b"BM"),                    # BMP
+    (8, b"WEBP"),                  # WEBP ("RIFF" + size + "WEBP")
+)
+SIGNATURE_BYTES = 12
+
+
+def looks_like_image(head) -> bool:
+    """True if the first bytes match a supported image signature."""
+    return any(head[offset:offset + len(magic)] == magic for offset, magic in IMAGE_SIGNATURES)
+
+
+class RequestTooLarge(Exception):
+    """Raised from the body stream once a request passes the size limit."""
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware rejecting request bodies over max_bytes with 413 while they arrive.
+
+    A Content-Length over the limit is rejected before anything is read. Otherwise the
+    body chunks are counted as the app receives them; past the limit the stream raises,
+    whatever the app would answer to the cut-off body is dropped, and a 413 is sent.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            await self.reject(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    too_large = True
+                    raise RequestTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if too_large:
+                return  # e.g. FastAPI's 400 for the body it could not parse
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not too_large:
+                raise
+        if too_large and not response_started:
+            await self.reject(scope, receive, send)
+
+    async def reject(self, scope, receive, send):
+        response = JSONResponse(status_code=413, content={"detail": f"Request exceeds the {self.max_bytes} byte limit."})
+        await response(scope, receive, send)
+
+
+class BufferPool:
+    """A few reusable upload buffers, so steady-state requests allocate nothing."""
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self._free = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def buffer(self):
+        with self._lock:
+            buffer = self._free.pop() if self._free else bytearray(INITIAL_BUFFER_BYTES)
+        try:
+            yield buffer
+        finally:
+            if len(buffer) <= MAX_POOLED_BUFFER_BYTES:
+                with self._lock:
+                    if len(self._free) < self.size:
+                        self._free.append(buffer)
+
+
+async def run_to_completion(func, *args):
+    """
+    run_in_threadpool(func, *args), except that when the caller is cancelled the
+    cancellation is held back until the thread has finished.
+    """
+    task = asyncio.ensure_future(run_in_threadpool(func, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        while not task.done():
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                pass
+        raise
+
+
+async def read_upload(upload: UploadFile, buffer: bytearray, max_bytes: int = MAX_UPLOAD_BYTES) -> int:
+    """
+    Reads the upload into `buffer` (grown if needed) and returns the number of bytes read.
+
+    Raises:
+        HTTPException: 413 if the upload exceeds max_bytes, 415 if it is not an image.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Image exceeds the {max_bytes} byte upload limit.")
+    # With a known size, one allocation fits the whole upload (+1 so EOF is seen without growing)
+    expected = min(upload.size + 1, max_bytes) if upload.size is not None else 0
+    if len(buffer) < expected:
+        buffer.extend(bytes(expected - len(buffer)))
+
+    size = 0
+    checked = False
+    while True:
+        if size == len(buffer):
+            if size >= max_bytes:
+                # Full at the limit; one more byte means the upload is too large
+                if await upload.read(1):
+                    raise HTTPException(status_code=413, detail=f"Image exceeds the {max_bytes} byte upload limit.")
+                break
+            buffer.extend(bytes(min(max(len(buffer), CHUNK_SIZE), max_bytes - len(buffer))))
+        with memoryview(buffer)[size:size + CHUNK_SIZE] as chunk:
+            read = await run_to_completion(upload.file.readinto, chunk)
+        if not read:
+            break
+        size += read
+        if not checked and size >= SIGNATURE_BYTES:
+            if not looks_like_image(buffer[:SIGNATURE_BYTES]):
+                raise HTTPException(status_code=415, detail="Upload is not a JPEG, PNG, BMP or WEBP image.")
+            checked = True
+
+    if not checked and not looks_like_image(buffer[:size]):
+        raise HTTPException(status_code=415, detail="Upload is not a JPEG, PNG, BMP or WEBP image.")
+    return size
@@ -0,0 +1,131 @@
+import os
+import random
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import yaml
+import cv2
+
+# -------------------------------
+# Configuration
+# -------------------------------
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+PREFETCH = 8                 # Images decoded ahead of the one being shown
+NUM_THREADS = 4              # cv2 releases the GIL while decoding
+# -------------------------------
+
+# image is a decoded BGR array; labels is a float32 (n, 5) array of YOLO rows
+# (class, x_center, y_center, w, h), or None if the label file does not exist
+Sample = namedtuple('Sample', ['name', 'image_path', 'label_path', 'image', 'labels'])
+
+
+def load_split(data_yaml_path, split):
+    """
+    The images folder, labels folder and class names of one split listed in data.yaml.
+    Relative split paths are resolved against data.yaml's 'path' entry or its folder.
+    """
+    with open(data_yaml_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    if not isinstance(config.get(split), str):
+        available = [k for k in ('train', 'val', 'test') if isinstance(config.get(k), str)]
+        raise ValueError(f"Split '{split}' not found in {data_yaml_path}. Available: {', '.join(available)}")
+
+    base = os.path.dirname(os.path.abspath(data_yaml_path))
+    if config.get('path'):
+        base = os.path.join(base, config['path'])
+    # split.py writes Windows separators; normalize so the file works on any OS
+    images_dir = os.path.normpath(os.path.join(base, config[split].replace('\\', '/')))
+    # YOLO convention: labels sit in a 'labels' folder next to 'images'
+    head, tail = os.path.split(images_dir)
+    labels_dir = os.path.join(head, 'labels') if tail == 'images' else images_dir
+    names = config.get('names', [])
+    if isinstance(names, dict):
+        names = [names[i] for i in sorted(names)]
+    return images_dir, labels_dir, list(names)
+
+
+def read_yolo_labels(label_path):
+    """YOLO rows as a float32 (n, 5) array; None if the file does not exist. Malformed rows are skipped."""
+    if not os.path.exists(label_path):
+        return None
+    rows = []
+    with open(label_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 5:
+                try:
+                    rows.append([float(p) for p in parts[:5]])
+                except ValueError:
+                    continue
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+
+class PrefetchingSampler:
+    """
+    Random samples from an images/labels folder pair, without replacement, read ahead.
+
+    The folder is listed once. Iterating yields Samples in a shuffled order; while the
+    caller looks at one, the next PREFETCH images and labels are being read and decoded
+    by background threads, so an interactive review never waits on disk or decoding.
+
+    Args:
+        images_dir: Folder with the images.
+        labels_dir: Folder with one YOLO .txt per image (same base name).
+        require_labels: Skip images without a label file (their pixels are never decoded).
+        seed: Fixes the order, to resume or share a review.
+    """
+
+    def __init__(self, images_dir, labels_dir, require_labels=False, seed=None,
+                 prefetch=PREFETCH, workers=NUM_THREADS):
+        self.images_dir = images_dir
+        self.labels_dir = labels_dir
+        self.require_labels = require_labels
+        self.prefetch = prefetch
+        self.names = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(IMG_EXTENSIONS))
+        if not self.names:
+            raise ValueError(f"No images found in {images_dir}")
+        random.Random(seed).shuffle(self.names)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = deque()
+        self._next = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _load(self, name):
+        label_path = os.path.join(self.labels_dir, os.path.splitext(name)[0] + '.txt')
+        image_path = os.path.join(self.images_dir, name)
+        labels = read_yolo_labels(label_path)
+        if labels is None and self.require_labels:
+            return Sample(name, image_path, label_path, None, None)
+        return Sample(name, image_path, label_path, cv2.imread(image_path), labels)
+
+    def _fill(self):
+        while self._next < len(self.names) and len(self._pending) < self.prefetch:
+            self._pending.append(self._executor.submit(self._load, self.names[self._next]))
+            self._next += 1
+
+    def __iter__(self):
+        while True:
+            self._fill()
+            if not self._pending:
+                return
+            sample = self._pending.popleft().result()
+            self._fill()  # Keep the queue full while the caller works on this sample
+            if sample.labels is None and self.require_labels:
+                print(f"Warning: Label not found for {sample.name}, skipping...")
+                continue
+            if sample.image is None:
+                print(f"Warning: Could not read image {sample.image_path}")
+                continue
+            yield sample
+
+    def close(self):
+        """Stops the background threads; loads still queued are dropped."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,368 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import argparse
+import numpy as np
+import cv2
+from multiprocessing import Pool
+
+# -------------------------------
+# Configuration
+# -------------------------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(SCRIPT_DIR, 'recycling_api')
+DATA_YAML_PATH = os.path.join(SCRIPT_DIR, 'data.yaml')
+
+TOP_K = 500                  # Images to export for labeling
+POOL_FACTOR = 4              # The diverse pick is made among the K * POOL_FACTOR most uncertain images
+MAX_BOXES = 50               # Per image, most confident first; bounds the pairwise overlap checks
+CONFLICT_IOU = 0.6           # Same region, different classes: the model cannot decide what it is
+CONFLICT_CAP = 3             # Conflicting pairs beyond this do not raise the score further
+SCORE_WEIGHTS = {'entropy': 1.0, 'conflict': 1.0, 'margin': 1.0}
+DIVERSITY = 0.5              # 0 = plain top-K by uncertainty; higher trades score for variety
+PRELABEL_CONF = 0.25         # Detections below this are left out of the exported pre-labels
+GRID = 4                     # Box-center occupancy grid (GRID x GRID) in the diversity signature
+# -------------------------------
+
+sys.path.insert(0, API_DIR)
+from class_metadata import load_data_yaml_names  # noqa: E402
+
+
+# -------------------------------
+# Reading stored detections
+# -------------------------------
+def build_records(paths, sizes, counts, cls, conf, xyxy):
+    """
+    Records as (image path, width, height, cls, conf, xyxy), boxes most confident first.
+    Boxes arrive as flat lists for all images; the per-record arrays are views into one
+    set of arrays, which is much cheaper than building small arrays per image.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    image = np.repeat(np.arange(len(paths)), counts)
+    conf = np.asarray(conf, dtype=np.float32)
+    order = np.lexsort((-conf, image))
+    cls = np.asarray(cls, dtype=np.int64)[order]
+    conf = conf[order]
+    xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)[order]
+    ends = np.cumsum(counts).tolist()
+    starts = [0] + ends[:-1]
+    return [(path, width, height, cls[start:end], conf[start:end], xyxy[start:end])
+            for path, (width, height), start, end in zip(paths, sizes, starts, ends)]
+
+
+def read_bulk_shard(path):
+    """Records of one bulk_score.py shard."""
+    paths, sizes, counts, cls, conf, xyxy = [], [], [], [], [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if 'error' in record:
+                continue
+            paths.append(record['path'])
+            sizes.append((record['width'], record['height']))
+            counts.append(len(record['detections']))
+            for d in record['detections']:
+                cls.append(d['class_id'])
+                conf.append(d['conf'])
+                xyxy.append(d['box_xyxy'])
+    return build_records(paths, sizes, counts, cls, conf, xyxy)
+
+
+def read_coco_predictions(path, images_dir, nc):
+    """
+    Records of an ultralytics predictions.json (COCO format, xywh boxes), grouped per image.
+
+    ultralytics writes category_id 1-based for datasets other than COCO (class_map is
+    1..nc), so ids are shifted back to YOLO class ids; ids outside 1..nc are an error.
+    Entries without file_name are matched to an image in images_dir by their image_id stem.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        predictions = json.load(f)
+    by_stem = None
+    by_image = {}
+    skipped = 0
+    for p in predictions:
+        file_name = p.get('file_name')
+        if not file_name:
+            if by_stem is None:
+                by_stem = {os.path.splitext(name)[0]: name for name in sorted(os.listdir(images_dir))}
+            file_name = by_stem.get(str(p['image_id']))
+            if file_name is None:
+                skipped += 1
+                continue
+        by_image.setdefault(file_name, []).append(p)
+    if skipped:
+        print(f"Warning: {skipped} predictions name an image that is not in {images_dir}; skipped.")
+
+    paths, sizes, counts, cls, conf, xyxy = [], [], [], [], [], []
+    for file_name, preds in by_image.items():
+        paths.append(os.path.join(images_dir, file_name))
+        sizes.append((None, None))  # Not stored; export reads them from the image itself
+        counts.append(len(preds))
+        for p in preds:
+            class_id = int(p['category_id']) - 1
+            if not 0 <= class_id < nc:
+                raise ValueError(f"category_id {p['category_id']} in {path} is outside 1..{nc}; "
+                                 f"was the file written for a different data.yaml?")
+            x, y, w, h = p['bbox']
+            cls.append(class_id)
+            conf.append(p['score'])
+            xyxy.append((x, y, x + w, y + h))
+    return build_records(paths, sizes, counts, cls, conf, xyxy)
+
+
+# -------------------------------
+# Uncertainty
+# -------------------------------
+def pair_iou(a, b):
+    """IoU of corresponding rows of two (n, 4) xyxy arrays."""
+    inter_w = (np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])).clip(0)
+    inter_h = (np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])).clip(0)
+    inter = inter_w * inter_h
+    union = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def uncertainty_scores(records):
+    """
+    Per-image uncertainty components, all in [0, 1]:
+      entropy   highest binary entropy of a box's confidence (0.5 is the least certain)
+      conflict  overlapping boxes with different classes (e.g. 65 vs 60 on one region)
+      margin    1 - the smallest confidence gap within such a pair
+
+    All images' boxes are flattened into one set of arrays. Boxes are grouped by image and
+    sorted by confidence, so comparing every box with the box k positions later (for
+    k = 1 .. MAX_BOXES - 1) visits every within-image pair with a few vectorized passes.
+    """
+    n = len(records)
+    counts = np.array([min(len(r[3]), MAX_BOXES) for r in records], dtype=np.int64)
+    image = np.repeat(np.arange(n), counts)
+    cls = np.concatenate([r[3][:MAX_BOXES] for r in records] or [np.zeros(0, np.int64)])
+    conf = np.concatenate([r[4][:MAX_BOXES] for r in records] or [np.zeros(0, np.float32)])
+    boxes = np.concatenate([r[5][:MAX_BOXES] for r in records] or [np.zeros((0, 4), np.float32)])
+
+    p = conf.astype(np.float64).clip(1e-6, 1 - 1e-6)
+    box_entropy = -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+    entropy = np.zeros(n)
+    np.maximum.at(entropy, image, box_entropy)
+
+    conflict = np.zeros(n)
+    margin = np.zeros(n)
+    for k in range(1, int(counts.max(initial=0))):
+        a = np.arange(len(image) - k)
+        b = a + k
+        keep = (image[a] == image[b]) & (cls[a] != cls[b])
+        a, b = a[keep], b[keep]
+        hit = pair_iou(boxes[a], boxes[b]) >= CONFLICT_IOU
+        a, b = a[hit], b[hit]
+        np.add.at(conflict, image[a], 1)
+        np.maximum.at(margin, image[a], 1 - np.abs(conf[a] - conf[b]))
+    conflict = np.minimum(conflict, CONFLICT_CAP) / CONFLICT_CAP
+
+    score = (SCORE_WEIGHTS['entropy'] * entropy + SCORE_WEIGHTS['conflict'] * conflict
+             + SCORE_WEIGHTS['margin'] * margin)
+    return score, entropy, conflict, margin
+
+
+def signature(record, nc):
+    """
+    Embedding-free description of what an image contains: a confidence-weighted class
+    histogram plus a GRID x GRID map of where boxes are, L2-normalized.
+    """
+    _, width, height, cls, conf, xyxy = record
+    vector = np.zeros(nc + GRID * GRID, dtype=np.float32)
+    if len(cls):
+        np.add.at(vector, cls.clip(0, nc - 1), conf)
+        # Without a stored size, the extent of the boxes stands in for the image size
+        w = width or max(float(xyxy[:, 2].max()), 1.0)
+        h = height or max(float(xyxy[:, 3].max()), 1.0)
+        gx = ((xyxy[:, 0] + xyxy[:, 2]) / 2 / w * GRID).astype(np.int64).clip(0, GRID - 1)
+        gy = ((xyxy[:, 1] + xyxy[:, 3]) / 2 / h * GRID).astype(np.int64).clip(0, GRID - 1)
+        np.add.at(vector, nc + gy * GRID + gx, conf)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def top_candidates(records, pool_size, nc):
+    """The pool_size most uncertain records, with their scores and signatures."""
+    if not records:
+        return []
+    score, entropy, conflict, margin = uncertainty_scores(records)
+    top = np.argsort(-score, kind='stable')[:pool_size]
+    return [{
+        'record': records[i],
+        'score': float(score[i]),
+        'entropy': float(entropy[i]),
+        'conflict': float(conflict[i]),
+        'margin': float(margin[i]),
+        'signature': signature(records[i], nc),
+    } for i in top if score[i] > 0]
+
+
+def score_shard(task):
+    """Worker: reads one bulk_score.py shard and keeps only its best candidates."""
+    path, pool_size, nc = task
+    records = read_bulk_shard(path)
+    return len(records), top_candidates(records, pool_size, nc)
+
+
+# -------------------------------
+# Diverse selection and export
+# -------------------------------
+def select_diverse(candidates, k, diversity):
+    """
+    Greedy maximal marginal relevance: each pick maximizes its (normalized) uncertainty
+    minus `diversity` times its highest cosine similarity to anything already picked,
+    so a burst of near-identical frames yields one or two picks instead of K.
+    """
+    if not candidates:
+        return []
+    scores = np.array([c['score'] for c in candidates])
+    scores = scores / scores.max()
+    signatures = np.stack([c['signature'] for c in candidates])
+    max_similarity = np.zeros(len(candidates))
+    available = np.ones(len(candidates), dtype=bool)
+    chosen = []
+    for _ in range(min(k, len(candidates))):
+        gain = np.where(available, scores - diversity * max_similarity, -np.inf)
+        i = int(gain.argmax())
+        chosen.append(candidates[i])
+        available[i] = False
+        max_similarity = np.maximum(max_similarity, signatures @ signatures[i])
+    return chosen
+
+
+def export_name(source_path):
+    """Unique, stable file name: short hash of the source path + its base name (as in the datasets)."""
+    digest = hashlib.sha1(source_path.encode('utf-8')).hexdigest()[:8]
+    return f"{digest}-{os.path.basename(source_path)}"
+
+
+def export_selection(selected, names, output_dir):
+    """
+    Writes the images/ + labels/ + classes.txt layout split.py reads as a material folder.
+    Labels are the model's own confident detections, as pre-labels for the annotators to correct.
+    """
+    images_dir = os.path.join(output_dir, 'images')
+    labels_dir = os.path.join(output_dir, 'labels')
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'classes.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(names))
+
+    exported = []
+    for c in selected:
+        source_path, width, height, cls, conf, xyxy = c['record']
+        if width is None or height is None:
+            image = cv2.imread(source_path)
+            if image is None:
+                print(f"  - Warning: Could not read image {source_path}")
+                continue
+            height, width = image.shape[:2]
+        name = export_name(source_path)
+        try:
+            shutil.copy2(source_path, os.path.join(images_dir, name))
+        except OSError as e:
+            print(f"  - Error copying image {source_path}: {e}")
+            continue
+
+        lines = []
+        keep = conf >= PRELABEL_CONF
+        boxes = xyxy[keep].clip(0, [width, height, width, height])
+        for c_id, (x1, y1, x2, y2) in zip(cls[keep].tolist(), boxes.tolist()):
+            lines.append(f"{c_id} {(x1 + x2) / 2 / width:.6f} {(y1 + y2) / 2 / height:.6f} "
+                         f"{(x2 - x1) / width:.6f} {(y2 - y1) / height:.6f}")
+        with open(os.path.join(labels_dir, os.path.splitext(name)[0] + '.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        exported.append({
+            'file': name,
+            'source': source_path,
+            'score': round(c['score'], 4),
+            'entropy': round(c['entropy'], 4),
+            'conflict': round(c['conflict'], 4),
+            'margin': round(c['margin'], 4),
+        })
+    return exported
+
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Pick uncertain, varied production images for labeling.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--results', help='bulk_score.py output dir (shard_*.jsonl).')
+    source.add_argument('--predictions', help="An ultralytics predictions.json (needs --images-dir).")
+    parser.add_argument('--images-dir', help='Folder of the images named in --predictions.')
+    parser.add_argument('--output', required=True, help='Folder to export images/, labels/ and classes.txt to.')
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    parser.add_argument('--diversity', type=float, default=DIVERSITY)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    names = load_data_yaml_names(DATA_YAML_PATH)
+    if not names:
+        print(f"Error: No class names in {DATA_YAML_PATH}")
+        return
+    nc = len(names)
+    pool_size = args.top_k * POOL_FACTOR
+
+    if args.results:
+        shards = sorted(glob.glob(os.path.join(args.results, 'shard_*.jsonl')))
+        if not shards:
+            print(f"Error: No shard_*.jsonl files in {args.results}")
+            return
+        print(f"Scoring {len(shards)} shards with {args.workers} workers...")
+        num_images = 0
+        candidates = []
+        with Pool(processes=args.workers) as pool:
+            for count, shard_candidates in pool.imap_unordered(
+                    score_shard, [(path, pool_size, nc) for path in shards]):
+                num_images += count
+                candidates.extend(shard_candidates)
+    else:
+        if not args.images_dir:
+            print("Error: --predictions needs --images-dir.")
+            return
+        try:
+            records = read_coco_predictions(args.predictions, args.images_dir, nc)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        num_images = len(records)
+        candidates = top_candidates(records, pool_size, nc)
+
+    # Images exported by an earlier run are already queued for labeling
+    already = os.path.join(args.output, 'images')
+    if os.path.isdir(already):
+        done = set(os.listdir(already))
+        candidates = [c for c in candidates if export_name(c['record'][0]) not in done]
+
+    # Same order on every run, whatever order the workers finished in
+    candidates.sort(key=lambda c: (-c['score'], c['record'][0]))
+    candidates = candidates[:pool_size]
+    print(f"Scored {num_images} images; {len(candidates)} uncertain candidates in the pool.")
+
+    selected = select_diverse(candidates, args.top_k, args.diversity)
+    exported = export_selection(selected, names, args.output)
+
+    selection_path = os.path.join(args.output, 'selection.json')
+    previous = []
+    if os.path.exists(selection_path):
+        with open(selection_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    with open(selection_path, 'w', encoding='utf-8') as f:
+        json.dump(previous + exported, f, indent=1)
+
+    if exported:
+        scores = np.array([e['score'] for e in exported])
+        print(f"\nExported {len(exported)} images (score {scores.min():.2f} - {scores.max():.2f}) to: {args.output}")
+    print(f"Selection details saved to: {selection_path}")
+    print("Correct the pre-labels, then add the folder to split.py's base folder as a material.")
+
+
+if __name__ == '__main__':
+    main()
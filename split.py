@@ -1,7 +1,9 @@
 import os
+import json
 import shutil
 import random
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.model_selection import train_test_split
 
 # --- Configuration ---
@@ -10,6 +12,15 @@ TRAIN_RATIO = 0.75
 VAL_RATIO = 0.15
 TEST_RATIO = 0.10
 RANDOM_SEED = 42 # For reproducible splits
+# Near-duplicate clusters from dedup_index.py; each cluster is kept within one split (optional)
+CLUSTERS_PATH = 'dedup_clusters.json'
+# Class ids are pinned to the first of these that exists, so models trained on earlier
+# merges stay compatible; classes not seen before are appended in sorted order
+PIN_CLASSES_FROM = ('class_index.json', 'data.yaml')
+CLASS_INDEX_PATH = 'class_index.json'        # Mapping artifact written by every merge
+# Optional {old or variant name: canonical name} for renamed classes across classes.txt files
+CLASS_ALIASES_PATH = 'class_aliases.yaml'
+NUM_THREADS = min(32, (os.cpu_count() or 4) * 2)  # Copying and remapping is I/O bound
 
 # Check if ratios sum to 1.0
 if round(TRAIN_RATIO + VAL_RATIO + TEST_RATIO, 5) != 1.0:
@@ -18,9 +29,10 @@ if round(TRAIN_RATIO + VAL_RATIO + TEST_RATIO, 5) != 1.0:
 # ---------------------
 
 def get_subdirectories(folder):
-    """Helper function to get a list of immediate subdirectories."""
+    """Helper function to get a sorted list of immediate subdirectories."""
     try:
-        return [f.path for f in os.scandir(folder) if f.is_dir()]
+        # Sorted, so the merge does not depend on the file system's listing order
+        return sorted(f.path for f in os.scandir(folder) if f.is_dir())
     except FileNotFoundError:
         print(f"Error: Base directory not found: {folder}")
         return []
@@ -36,108 +48,209 @@ def create_output_structure(base_dir):
         os.makedirs(paths[f'{split}_labels'], exist_ok=True)
     return paths
 
-def build_global_classes(material_folders):
-    """Reads all classes.txt files and builds a single global list."""
-    global_classes = []
-    for material_folder in material_folders:
-        classes_file_path = os.path.join(material_folder, "classes.txt")
-        if os.path.exists(classes_file_path):
-            try:
-                with open(classes_file_path, 'r', encoding='utf-8') as f:
-                    local_classes = [line.strip() for line in f if line.strip()]
-                    for cls_name in local_classes:
-                        if cls_name not in global_classes:
-                            global_classes.append(cls_name)
-            except Exception as e:
-                print(f"Error reading {classes_file_path}: {e}")
-    return global_classes
+def class_key(name):
+    """Spelling-insensitive key, so 'AL_foil', 'al foil' and 'al-foil' are one class."""
+    return '_'.join(name.strip().lower().replace('-', ' ').split())
 
-def get_local_to_global_map(material_folder, global_classes_list):
-    """Builds a {local_index: global_index} map for a single material."""
-    index_mapping = {}
-    local_classes_path = os.path.join(material_folder, "classes.txt")
-    if not os.path.exists(local_classes_path):
+def read_local_classes(material_folder):
+    """The material's classes.txt as a list of names, or None if missing or unreadable."""
+    classes_file_path = os.path.join(material_folder, "classes.txt")
+    if not os.path.exists(classes_file_path):
         return None
-        
     try:
-        with open(local_classes_path, 'r', encoding='utf-8') as f:
-            local_classes = [line.strip() for line in f if line.strip()]
-        
-        for local_index, class_name in enumerate(local_classes):
-            try:
-                global_index = global_classes_list.index(class_name)
-                index_mapping[local_index] = global_index
-            except ValueError:
-                print(f"  - Warning: Class '{class_name}' from {material_folder} not in global list.")
-        return index_mapping
+        with open(classes_file_path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
     except Exception as e:
-        print(f"  - Error reading {local_classes_path}: {e}")
+        print(f"Error reading {classes_file_path}: {e}")
         return None
 
-def process_files_split(file_basenames, material_folder, index_mapping, dest_images_dir, dest_labels_dir):
-    """Copies images and re-mapped labels for a given split (train, val, or test)."""
-    source_images_dir = os.path.join(material_folder, "images")
-    source_labels_dir = os.path.join(material_folder, "labels")
-    
-    image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
-    files_processed = 0
-    
-    for base_name in file_basenames:
-        # 1. Copy Image
-        image_copied = False
-        for ext in image_extensions:
-            image_filename = base_name + ext
-            source_image_path = os.path.join(source_images_dir, image_filename)
-            if os.path.exists(source_image_path):
-                dest_image_path = os.path.join(dest_images_dir, image_filename)
-                try:
-                    shutil.copy2(source_image_path, dest_image_path)
-                    image_copied = True
-                    break
-                except Exception as e:
-                    print(f"  - Error copying image {source_image_path}: {e}")
-        
-        if not image_copied:
-            print(f"  - Warning: Could not find image file for {base_name}")
+def load_pinned_classes(paths):
+    """Class names (in id order) from the first existing class_index.json or data.yaml."""
+    for path in paths:
+        if os.path.exists(path):
+            try:
+                # JSON is valid YAML, so one loader reads both files
+                with open(path, 'r', encoding='utf-8') as f:
+                    names = (yaml.safe_load(f) or {}).get('names')
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            if isinstance(names, dict):  # data.yaml may list names as {id: name}
+                names = [names[i] for i in sorted(names)]
+            if names:
+                return [str(name) for name in names], path
+    return [], None
+
+def load_class_aliases(aliases_path):
+    """{class key of an old or variant name: canonical name} from class_aliases.yaml."""
+    if not os.path.exists(aliases_path):
+        return {}
+    with open(aliases_path, 'r', encoding='utf-8') as f:
+        aliases = yaml.safe_load(f) or {}
+    return {class_key(str(old)): str(new) for old, new in aliases.items()}
+
+def canonical_name(name, aliases):
+    """Follows aliases (renames may chain) to the name the class is merged under."""
+    seen = set()
+    while class_key(name) in aliases and class_key(name) not in seen:
+        seen.add(class_key(name))
+        name = aliases[class_key(name)]
+    return name
+
+def build_global_classes(local_classes_by_material, pinned_classes, aliases):
+    """
+    Builds the global class list and a {class key: global index} lookup.
+    Pinned classes keep their ids (even if no material uses them any more, so ids never
+    shift); every other class is appended in sorted order, independent of folder order.
+    """
+    global_classes = list(pinned_classes)
+    class_index = {}
+    for global_index, cls_name in enumerate(global_classes):
+        class_index.setdefault(class_key(cls_name), global_index)
+
+    new_classes = {}
+    for local_classes in local_classes_by_material.values():
+        for cls_name in local_classes:
+            cls_name = canonical_name(cls_name, aliases)
+            key = class_key(cls_name)
+            if key not in class_index:
+                # Spelling variants of one new class: the same spelling wins on every machine
+                new_classes[key] = min(new_classes.get(key, cls_name), cls_name)
+    for key, cls_name in sorted(new_classes.items(), key=lambda item: item[1]):
+        class_index[key] = len(global_classes)
+        global_classes.append(cls_name)
+    return global_classes, class_index
+
+def get_local_to_global_map(local_classes, global_classes, class_index, aliases):
+    """Builds a {local_index: global_index} map for a single material, reporting renames."""
+    index_mapping = {}
+    for local_index, class_name in enumerate(local_classes):
+        global_index = class_index.get(class_key(canonical_name(class_name, aliases)))
+        if global_index is None:
+            print(f"  - Warning: Class '{class_name}' not in global list.")
             continue
+        if global_classes[global_index] != class_name:
+            print(f"  - Merging class '{class_name}' into '{global_classes[global_index]}'")
+        index_mapping[local_index] = global_index
+    return index_mapping
 
-        # 2. Find, Remap, and Copy Label
-        label_filename = base_name + ".txt"
-        source_label_path = os.path.join(source_labels_dir, label_filename)
-        dest_label_path = os.path.join(dest_labels_dir, label_filename)
+def load_duplicate_clusters(clusters_path):
+    """
+    Reads dedup_index.py's clusters as {(material folder name, image basename): cluster id}.
+    Returns an empty dict when the file does not exist.
+    """
+    if not os.path.exists(clusters_path):
+        return {}
+    with open(clusters_path, 'r', encoding='utf-8') as f:
+        clusters = json.load(f)['clusters']
+    cluster_of = {}
+    for cluster_id, members in enumerate(clusters):
+        for rel_path in members:
+            parts = rel_path.split('/')
+            # Paths are relative to the base folder: <material>/images/<file>
+            if len(parts) == 3 and parts[1] == 'images':
+                cluster_of[(parts[0], os.path.splitext(parts[2])[0])] = cluster_id
+    return cluster_of
 
-        if os.path.exists(source_label_path):
-            new_label_content = []
-            try:
-                with open(source_label_path, 'r', encoding='utf-8') as f_in:
-                    for line in f_in:
-                        parts = line.strip().split()
-                        if not parts: continue
-                        
-                        local_index = int(parts[0])
-                        if local_index in index_mapping:
-                            global_index = index_mapping[local_index]
-                            new_line = f"{global_index} {' '.join(parts[1:])}"
-                            new_label_content.append(new_line)
-                        else:
-                            print(f"  - Warning: Invalid class index {local_index} in {source_label_path}")
-                
-                with open(dest_label_path, 'w', encoding='utf-8') as f_out:
-                    f_out.write("\n".join(new_label_content))
-                files_processed += 1
-                
-            except Exception as e:
-                print(f"  - Error processing label {source_label_path}: {e}")
+def split_units(units, forced):
+    """
+    Splits units (basenames, or whole duplicate clusters) into train/val/test by the ratios.
+    Units in `forced` already have a split (their cluster was placed by another material).
+    """
+    splits = {'train': [], 'val': [], 'test': []}
+    free_units = []
+    for unit in units:
+        if unit in forced:
+            splits[forced[unit]].append(unit)
         else:
-            # Create an empty label file for unlabeled (negative) images
-            try:
-                with open(dest_label_path, 'w') as f_out:
-                    pass # Create empty file
-                files_processed += 1
-            except Exception as e:
-                print(f"  - Error creating empty label for {dest_label_path}: {e}")
+            free_units.append(unit)
+    if len(free_units) < 3:
+        splits['train'].extend(free_units)
+        return splits
+
+    # First split: 75% train, 25% (val + test)
+    train_units, remaining_units = train_test_split(
+        free_units,
+        train_size=TRAIN_RATIO,
+        random_state=RANDOM_SEED
+    )
+    
+    # Calculate ratio for second split
+    # We need to split the 'remaining' (25%) into val (15%) and test (10%)
+    # The ratio of val within the remaining set is: VAL_RATIO / (VAL_RATIO + TEST_RATIO)
+    # e.g., 0.15 / (0.15 + 0.10) = 0.15 / 0.25 = 0.6
+    val_of_remaining_ratio = VAL_RATIO / (VAL_RATIO + TEST_RATIO)
+    
+    # Second split
+    val_units, test_units = train_test_split(
+        remaining_units,
+        train_size=val_of_remaining_ratio, 
+        random_state=RANDOM_SEED # Use same seed
+    )
+    splits['train'].extend(train_units)
+    splits['val'].extend(val_units)
+    splits['test'].extend(test_units)
+    return splits
 
-    return files_processed
+def process_one_file(image_filename, material_folder, index_mapping, dest_images_dir, dest_labels_dir):
+    """Copies one image and its re-mapped label. Returns True on success."""
+    base_name = os.path.splitext(image_filename)[0]
+    source_image_path = os.path.join(material_folder, "images", image_filename)
+
+    # 1. Copy Image
+    try:
+        shutil.copy2(source_image_path, os.path.join(dest_images_dir, image_filename))
+    except Exception as e:
+        print(f"  - Error copying image {source_image_path}: {e}")
+        return False
+
+    # 2. Find, Remap, and Copy Label
+    label_filename = base_name + ".txt"
+    source_label_path = os.path.join(material_folder, "labels", label_filename)
+    dest_label_path = os.path.join(dest_labels_dir, label_filename)
+
+    if os.path.exists(source_label_path):
+        new_label_content = []
+        try:
+            with open(source_label_path, 'r', encoding='utf-8') as f_in:
+                for line in f_in:
+                    parts = line.strip().split()
+                    if not parts: continue
+                    
+                    local_index = int(parts[0])
+                    if local_index in index_mapping:
+                        global_index = index_mapping[local_index]
+                        new_line = f"{global_index} {' '.join(parts[1:])}"
+                        new_label_content.append(new_line)
+                    else:
+                        print(f"  - Warning: Invalid class index {local_index} in {source_label_path}")
+            
+            with open(dest_label_path, 'w', encoding='utf-8') as f_out:
+                f_out.write("\n".join(new_label_content))
+            return True
+            
+        except Exception as e:
+            print(f"  - Error processing label {source_label_path}: {e}")
+            return False
+    else:
+        # Create an empty label file for unlabeled (negative) images
+        try:
+            with open(dest_label_path, 'w') as f_out:
+                pass # Create empty file
+            return True
+        except Exception as e:
+            print(f"  - Error creating empty label for {dest_label_path}: {e}")
+            return False
+
+def process_files_split(image_filenames, material_folder, index_mapping, dest_images_dir, dest_labels_dir, executor):
+    """Copies images and re-mapped labels for a given split (train, val, or test), in parallel."""
+    results = executor.map(
+        lambda image_filename: process_one_file(
+            image_filename, material_folder, index_mapping, dest_images_dir, dest_labels_dir
+        ),
+        image_filenames
+    )
+    return sum(results)
 
 def main():
     # --- CONFIGURE YOUR PATHS HERE ---
@@ -159,20 +272,44 @@ def main():
 
     # 1. Build Global Class List
     print("Building global class list...")
-    global_classes = build_global_classes(material_folders)
-    if not global_classes:
+    local_classes_by_material = {}
+    for material_folder in material_folders:
+        local_classes = read_local_classes(material_folder)
+        if local_classes is not None:
+            local_classes_by_material[material_folder] = local_classes
+    if not local_classes_by_material:
         print("Error: No classes.txt files found. Exiting.")
         return
+    pinned_classes, pinned_from = load_pinned_classes(PIN_CLASSES_FROM)
+    aliases = load_class_aliases(CLASS_ALIASES_PATH)
+    global_classes, class_index = build_global_classes(local_classes_by_material, pinned_classes, aliases)
+    if pinned_from:
+        print(f"Kept the ids of {len(pinned_classes)} classes from {pinned_from}; "
+              f"{len(global_classes) - len(pinned_classes)} new classes appended.")
+        used_keys = {class_key(canonical_name(cls_name, aliases))
+                     for local_classes in local_classes_by_material.values() for cls_name in local_classes}
+        unused = [cls_name for cls_name in pinned_classes if class_key(cls_name) not in used_keys]
+        if unused:
+            print(f"Warning: {len(unused)} pinned classes are in no classes.txt (ids kept): {', '.join(unused[:10])}")
     print(f"Found {len(global_classes)} unique classes total.\n")
 
     # 2. Create output folder structure
     dest_paths = create_output_structure(output_split_dir)
+
+    cluster_of = load_duplicate_clusters(CLUSTERS_PATH)
+    cluster_splits = {}  # Split chosen for each cluster, shared across materials
+    if cluster_of:
+        print(f"Keeping {len(set(cluster_of.values()))} near-duplicate clusters within one split each.\n")
+    else:
+        print(f"No {CLUSTERS_PATH} found; run dedup_index.py to keep near-duplicates out of val/test.\n")
     
     total_train_files = 0
     total_val_files = 0
     total_test_files = 0
     
     image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+    material_maps = {}  # Per-material class mapping, saved with the merge
+    executor = ThreadPoolExecutor(max_workers=NUM_THREADS)
 
     # 3. Iterate through each material, split, copy, and remap
     for material_folder in material_folders:
@@ -180,10 +317,15 @@ def main():
         print(f"--- Processing: {material_name} ---")
 
         # A. Get the index mapping
-        index_mapping = get_local_to_global_map(material_folder, global_classes)
-        if index_mapping is None:
+        if material_folder not in local_classes_by_material:
             print("  - Skipping (no classes.txt or error).")
             continue
+        local_classes = local_classes_by_material[material_folder]
+        index_mapping = get_local_to_global_map(local_classes, global_classes, class_index, aliases)
+        material_maps[material_name] = {
+            'classes': local_classes,
+            'to_global': [index_mapping.get(i) for i in range(len(local_classes))],
+        }
             
         # B. Get list of all images
         images_dir = os.path.join(material_folder, "images")
@@ -191,11 +333,13 @@ def main():
             print("  - Skipping (no 'images' folder).")
             continue
             
-        all_image_basenames = []
-        for f in os.listdir(images_dir):
+        # Sorted, so the seeded split is the same on every machine
+        image_files = {}
+        for f in sorted(os.listdir(images_dir)):
             file_name, file_ext = os.path.splitext(f)
             if file_ext.lower() in image_extensions:
-                all_image_basenames.append(file_name)
+                image_files.setdefault(file_name, f)
+        all_image_basenames = list(image_files)
         
         if not all_image_basenames:
             print("  - Skipping (no images found).")
@@ -203,29 +347,24 @@ def main():
             
         print(f"  - Found {len(all_image_basenames)} images.")
 
-        # --- *** EDITED: Updated split logic to use all 3 ratios *** ---
-        # C. Perform the 75/15/10 split
-        
-        # First split: 75% train, 25% (val + test)
-        train_files, remaining_files = train_test_split(
-            all_image_basenames,
-            train_size=TRAIN_RATIO,
-            random_state=RANDOM_SEED
+        # C. Perform the 75/15/10 split over units: a duplicate cluster moves as one unit,
+        # so the same picture under two names cannot land in both train and val
+        units = {}
+        for base_name in all_image_basenames:
+            cluster_id = cluster_of.get((material_name, base_name))
+            units.setdefault(('cluster', cluster_id) if cluster_id is not None else base_name, []).append(base_name)
+        # Without clusters the units are exactly the basenames
+        unit_splits = split_units(list(units), cluster_splits)
+        for split_name, split_units_list in unit_splits.items():
+            for unit in split_units_list:
+                if isinstance(unit, tuple):
+                    cluster_splits[unit] = split_name
+        train_files, val_files, test_files = (
+            [image_files[name] for unit in unit_splits[split_name] for name in units[unit]]
+            for split_name in ('train', 'val', 'test')
         )
-        
-        # Calculate ratio for second split
-        # We need to split the 'remaining' (25%) into val (15%) and test (10%)
-        # The ratio of val within the remaining set is: VAL_RATIO / (VAL_RATIO + TEST_RATIO)
-        # e.g., 0.15 / (0.15 + 0.10) = 0.15 / 0.25 = 0.6
-        val_of_remaining_ratio = VAL_RATIO / (VAL_RATIO + TEST_RATIO)
-        
-        # Second split
-        val_files, test_files = train_test_split(
-            remaining_files,
-            train_size=val_of_remaining_ratio, 
-            random_state=RANDOM_SEED # Use same seed
-        )
-        # --- *** END OF EDIT *** ---
+        if len(units) < len(all_image_basenames):
+            print(f"  - {len(all_image_basenames) - len(units)} near-duplicates grouped with their cluster.")
         
         print(f"  - Splitting: {len(train_files)} train / {len(val_files)} val / {len(test_files)} test")
 
@@ -233,22 +372,23 @@ def main():
         # Process TRAIN
         train_count = process_files_split(
             train_files, material_folder, index_mapping, 
-            dest_paths['train_images'], dest_paths['train_labels']
+            dest_paths['train_images'], dest_paths['train_labels'], executor
         )
         # Process VAL
         val_count = process_files_split(
             val_files, material_folder, index_mapping, 
-            dest_paths['val_images'], dest_paths['val_labels']
+            dest_paths['val_images'], dest_paths['val_labels'], executor
         )
         # Process TEST
         test_count = process_files_split(
             test_files, material_folder, index_mapping, 
-            dest_paths['test_images'], dest_paths['test_labels']
+            dest_paths['test_images'], dest_paths['test_labels'], executor
         )
         
         total_train_files += train_count
         total_val_files += val_count
         total_test_files += test_count
+    executor.shutdown()
 
     # 4. Create the final data.yaml file
     yaml_path = os.path.join(output_split_dir, "data.yaml")
@@ -272,6 +412,21 @@ def main():
     except Exception as e:
         print(f"\nError creating data.yaml: {e}")
 
+    # Mapping artifact: the class ids of this merge and how every material maps onto them.
+    # The copy at CLASS_INDEX_PATH pins the ids for the next merge.
+    class_index_content = {
+        'names': global_classes,
+        'pinned_from': pinned_from,
+        'materials': material_maps,
+    }
+    for index_path in (os.path.join(output_split_dir, os.path.basename(CLASS_INDEX_PATH)), CLASS_INDEX_PATH):
+        try:
+            with open(index_path, 'w', encoding='utf-8') as f:
+                json.dump(class_index_content, f, indent=1)
+            print(f"Saved class mapping to {index_path}")
+        except Exception as e:
+            print(f"Error writing {index_path}: {e}")
+
     # 5. Final Report
     print("\n--- Split Complete! ---")
     print(f"Total training images/labels: {total_train_files}")
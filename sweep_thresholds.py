@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+import yaml
+import cv2
+
+# -------------------------------
+# Configuration
+# -------------------------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(SCRIPT_DIR, 'recycling_api')
+DATA_YAML_PATH = os.path.join(SCRIPT_DIR, 'data.yaml')
+CACHE_DIR = os.path.join(SCRIPT_DIR, '.sweep_cache')
+OUTPUT_PATH = os.path.join(API_DIR, 'class_thresholds.json')
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+IMG_SIZE = 640
+BATCH_SIZE = 16
+MIN_CONF = 0.01              # Raw candidates below this score are not cached
+MAX_CANDIDATES = 1000        # Per image, highest scores first (ultralytics caps at 30000 before NMS)
+MATCH_IOU = 0.5              # IoU for a prediction to count as a true positive
+
+CONF_GRID = np.round(np.arange(0.05, 0.96, 0.05), 2)
+IOU_GRID = np.array([0.45, 0.5, 0.55, 0.6, 0.65, 0.7])
+MAX_DET_GRID = np.array([50, 100, 300])
+# -------------------------------
+
+sys.path.insert(0, API_DIR)
+from class_metadata import load_class_metadata  # noqa: E402
+
+
+def list_images(images_dir):
+    return sorted(f for f in os.listdir(images_dir) if f.lower().endswith(IMG_EXTENSIONS))
+
+
+def letterbox(image, imgsz):
+    """
+    Resizes and pads an image to imgsz x imgsz the same way ultralytics' LetterBox does.
+
+    Returns:
+        (padded image, ratio, (left, top) padding)
+    """
+    h0, w0 = image.shape[:2]
+    r = min(imgsz / h0, imgsz / w0)
+    new_w, new_h = int(round(w0 * r)), int(round(h0 * r))
+    dw, dh = (imgsz - new_w) / 2, (imgsz - new_h) / 2
+    if (new_w, new_h) != (w0, h0):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return image, r, (left, top)
+
+
+# -------------------------------
+# Step 1: cache raw (pre-NMS) outputs once per image
+# -------------------------------
+def cache_path_for(model_path, images_dir, imgsz, cache_dir):
+    st = os.stat(model_path)
+    key = f"{os.path.abspath(model_path)}|{st.st_size}|{int(st.st_mtime)}|{os.path.abspath(images_dir)}|{imgsz}|{MIN_CONF}"
+    return os.path.join(cache_dir, hashlib.md5(key.encode('utf-8')).hexdigest()[:16] + '.npz')
+
+
+def raw_candidates(prediction, ratio, pad, image_shape):
+    """
+    Turns one image's raw head output (4 + nc, anchors) into score-sorted candidates
+    in original image pixels, keeping the best class per anchor like ultralytics' NMS.
+    """
+    boxes_xywh, class_scores = prediction[:4].T, prediction[4:].T
+    cls = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(cls)), cls]
+
+    keep = np.where(scores >= MIN_CONF)[0]
+    keep = keep[np.argsort(-scores[keep], kind='stable')][:MAX_CANDIDATES]
+    xywh = boxes_xywh[keep]
+    boxes = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+    h0, w0 = image_shape
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w0)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h0)
+    return boxes.astype(np.float32), cls[keep].astype(np.int16), scores[keep].astype(np.float32)
+
+
+def build_raw_cache(model_path, images_dir, imgsz, cache_path):
+    """Runs the detector once over every image and stores the raw candidates in one .npz."""
+    import torch
+    from ultralytics import YOLO
+
+    yolo = YOLO(model_path)
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    net = yolo.model.to(device).eval()
+    names = [yolo.names[i] for i in range(len(yolo.names))]
+
+    image_files = list_images(images_dir)
+    print(f"Caching raw predictions for {len(image_files)} images (one forward pass each)...")
+
+    all_boxes, all_cls, all_scores, all_image_index, sizes = [], [], [], [], []
+    for start in range(0, len(image_files), BATCH_SIZE):
+        batch, metas = [], []
+        for name in image_files[start:start + BATCH_SIZE]:
+            image = cv2.imread(os.path.join(images_dir, name))
+            if image is None:
+                print(f"Warning: Could not read image {name}")
+                image = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+            padded, ratio, pad = letterbox(image, imgsz)
+            batch.append(padded[..., ::-1].transpose(2, 0, 1))  # BGR HWC -> RGB CHW
+            metas.append((ratio, pad, image.shape[:2]))
+
+        x = torch.from_numpy(np.ascontiguousarray(np.stack(batch))).to(device).float() / 255.0
+        with torch.no_grad():
+            preds = net(x)
+        if isinstance(preds, (list, tuple)):
+            preds = preds[0]
+        preds = preds.float().cpu().numpy()
+
+        for offset, (prediction, (ratio, pad, shape)) in enumerate(zip(preds, metas)):
+            boxes, cls, scores = raw_candidates(prediction, ratio, pad, shape)
+            all_boxes.append(boxes)
+            all_cls.append(cls)
+            all_scores.append(scores)
+            all_image_index.append(np.full(len(cls), start + offset, dtype=np.int32))
+            sizes.append(shape)
+        print(f"  - {min(start + BATCH_SIZE, len(image_files))}/{len(image_files)}")
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    np.savez_compressed(
+        cache_path,
+        boxes=np.concatenate(all_boxes), cls=np.concatenate(all_cls), scores=np.concatenate(all_scores),
+        image_index=np.concatenate(all_image_index), sizes=np.array(sizes, dtype=np.int32).reshape(-1, 2),
+        image_files=np.array(image_files), names=np.array(names),
+    )
+    print(f"Saved raw prediction cache to: {cache_path}")
+
+
+def load_ground_truth(labels_dir, image_files, sizes):
+    """YOLO labels de-normalized to pixel xyxy, as (image_index, cls, boxes) arrays."""
+    gt_image, gt_cls, gt_boxes = [], [], []
+    for index, (image_file, (h0, w0)) in enumerate(zip(image_files, sizes)):
+        label_path = os.path.join(labels_dir, os.path.splitext(image_file)[0] + '.txt')
+        if not os.path.exists(label_path):
+            continue
+        with open(label_path, 'r') as f:
+            for line in f:
+                values = line.strip().split()
+                if len(values) < 5:
+                    continue
+                cls_id, xc, yc, w, h = int(values[0]), *(float(v) for v in values[1:5])
+                gt_image.append(index)
+                gt_cls.append(cls_id)
+                gt_boxes.append([(xc - w / 2) * w0, (yc - h / 2) * h0, (xc + w / 2) * w0, (yc + h / 2) * h0])
+    return (np.array(gt_image, dtype=np.int32), np.array(gt_cls, dtype=np.int32),
+            np.array(gt_boxes, dtype=np.float32).reshape(-1, 4))
+
+
+# -------------------------------
+# Step 2: vectorized NMS + matching over the whole grid
+# -------------------------------
+def box_iou(boxes_a, boxes_b):
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def greedy_nms_all(boxes, cls, iou_grid):
+    """
+    Class-aware greedy NMS for every IoU threshold at once on score-sorted candidates.
+
+    Greedy NMS only looks at higher-scoring boxes when deciding on a box, so the result
+    for any confidence threshold is a prefix of this result: one pass covers the conf grid.
+
+    Returns:
+        keep mask of shape (len(iou_grid), n)
+    """
+    n = len(cls)
+    keep = np.ones((len(iou_grid), n), dtype=bool)
+    if n == 0:
+        return keep
+    iou = box_iou(boxes, boxes)
+    iou[cls[:, None] != cls[None, :]] = 0
+    suppress = iou[None, :, :] > iou_grid[:, None, None]
+    for i in range(n - 1):
+        if not keep[:, i].any():
+            continue
+        keep[:, i + 1:] &= ~(keep[:, i:i + 1] & suppress[:, i, i + 1:])
+    return keep
+
+
+def match_true_positives(boxes, cls, gt_boxes, gt_cls):
+    """Greedy score-ordered matching; like NMS, it is prefix-stable across conf thresholds."""
+    tp = np.zeros(len(cls), dtype=bool)
+    if len(cls) == 0 or len(gt_cls) == 0:
+        return tp
+    iou = box_iou(boxes, gt_boxes)
+    iou[cls[:, None] != gt_cls[None, :]] = 0
+    matched = np.zeros(len(gt_cls), dtype=bool)
+    for i in range(len(cls)):
+        candidates = np.where(~matched & (iou[i] >= MATCH_IOU))[0]
+        if len(candidates):
+            matched[candidates[np.argmax(iou[i, candidates])]] = True
+            tp[i] = True
+    return tp
+
+
+def run_sweep(cache, ground_truth, num_classes, weights):
+    """
+    Evaluates every (iou, max_det, conf) operating point.
+
+    Returns:
+        dict of arrays shaped (n_iou, n_max_det, n_classes, n_conf): tp, pred, weight_error,
+        plus n_gt per class.
+    """
+    boxes, cls, scores, image_index = cache['boxes'], cache['cls'].astype(np.int32), cache['scores'], cache['image_index']
+    gt_image, gt_cls, gt_boxes = ground_truth
+    n_images = len(cache['image_files'])
+    n_iou, n_md, n_conf = len(IOU_GRID), len(MAX_DET_GRID), len(CONF_GRID)
+
+    n_gt = np.bincount(gt_cls, minlength=num_classes)
+    gt_per_image = np.zeros((n_images, num_classes), dtype=np.int32)
+    np.add.at(gt_per_image, (gt_image, gt_cls), 1)
+
+    # Candidates are stored grouped by image and score-sorted within each image
+    bounds = np.searchsorted(image_index, np.arange(n_images + 1))
+    gt_bounds = np.searchsorted(gt_image, np.arange(n_images + 1))
+    keep_all = np.zeros((n_iou, len(cls)), dtype=bool)
+    tp_all = np.zeros((n_iou, len(cls)), dtype=bool)
+    rank_all = np.zeros((n_iou, len(cls)), dtype=np.int32)
+    for image in range(n_images):
+        lo, hi = bounds[image], bounds[image + 1]
+        if lo == hi:
+            continue
+        g_lo, g_hi = gt_bounds[image], gt_bounds[image + 1]
+        keep = greedy_nms_all(boxes[lo:hi], cls[lo:hi], IOU_GRID)
+        keep_all[:, lo:hi] = keep
+        rank_all[:, lo:hi] = np.cumsum(keep, axis=1) - 1
+        for k in range(n_iou):
+            kept = np.where(keep[k])[0]
+            tp_all[k, lo + kept] = match_true_positives(
+                boxes[lo:hi][kept], cls[lo:hi][kept], gt_boxes[g_lo:g_hi], gt_cls[g_lo:g_hi])
+
+    # Index of the highest conf threshold each candidate passes (-1 = passes none)
+    conf_bin = np.searchsorted(CONF_GRID, scores, side='right') - 1
+
+    tp = np.zeros((n_iou, n_md, num_classes, n_conf), dtype=np.int64)
+    pred = np.zeros_like(tp)
+    weight_error = np.zeros((n_iou, n_md, num_classes, n_conf), dtype=np.float64)
+    for k in range(n_iou):
+        for m, max_det in enumerate(MAX_DET_GRID):
+            sel = keep_all[k] & (rank_all[k] < max_det) & (conf_bin >= 0)
+            np.add.at(pred[k, m], (cls[sel], conf_bin[sel]), 1)
+            np.add.at(tp[k, m], (cls[sel], conf_bin[sel]), tp_all[k, sel])
+
+            counts = np.zeros((n_images, num_classes, n_conf), dtype=np.int32)
+            np.add.at(counts, (image_index[sel], cls[sel], conf_bin[sel]), 1)
+            # Reverse cumulative sum: detections with score >= CONF_GRID[j]
+            counts = np.flip(np.cumsum(np.flip(counts, axis=2), axis=2), axis=2)
+            weight_error[k, m] = (np.abs(counts - gt_per_image[:, :, None]).sum(axis=0)
+                                  * weights[:, None])
+
+    tp = np.flip(np.cumsum(np.flip(tp, axis=3), axis=3), axis=3)
+    pred = np.flip(np.cumsum(np.flip(pred, axis=3), axis=3), axis=3)
+    return {'tp': tp, 'pred': pred, 'weight_error': weight_error, 'n_gt': n_gt}
+
+
+def choose_operating_point(sweep, objective):
+    """
+    Picks the (iou, max_det) that is best on average over classes, then the best
+    confidence threshold per class at that point.
+    """
+    n_gt = sweep['n_gt']
+    has_gt = n_gt > 0
+    f1 = 2 * sweep['tp'] / np.maximum(sweep['pred'] + n_gt[None, None, :, None], 1)
+
+    if objective == 'f1':
+        per_class_best = f1.max(axis=3)[:, :, has_gt].mean(axis=2)
+        k, m = np.unravel_index(np.argmax(per_class_best), per_class_best.shape)
+        class_conf_index = f1[k, m].argmax(axis=1)
+    else:
+        per_class_best = sweep['weight_error'].min(axis=3)[:, :, has_gt].sum(axis=2)
+        k, m = np.unravel_index(np.argmin(per_class_best), per_class_best.shape)
+        class_conf_index = sweep['weight_error'][k, m].argmin(axis=1)
+
+    # Micro F1 across all classes decides the fallback threshold for classes without labels
+    micro_f1 = 2 * sweep['tp'][k, m].sum(axis=0) / np.maximum(sweep['pred'][k, m].sum(axis=0) + n_gt.sum(), 1)
+    default_index = int(np.argmax(micro_f1))
+    class_conf_index = np.where(has_gt, class_conf_index, default_index)
+    return k, m, class_conf_index, default_index, f1
+
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Sweep conf/iou/max_det over cached raw predictions.')
+    parser.add_argument('--model', required=True, help="Path to the trained 'best.pt'.")
+    parser.add_argument('--images', required=True, help='Validation images dir.')
+    parser.add_argument('--labels', help="Validation labels dir (default: sibling 'labels').")
+    parser.add_argument('--data', default=DATA_YAML_PATH, help='data.yaml with the class names.')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE)
+    parser.add_argument('--objective', choices=['f1', 'weight'], default='f1',
+                        help="Maximize per-class F1 or minimize per-class weight error.")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--output', default=OUTPUT_PATH, help='Per-class thresholds JSON for the API.')
+    args = parser.parse_args()
+
+    labels_dir = args.labels or os.path.join(os.path.dirname(os.path.abspath(args.images)), 'labels')
+    cache_path = cache_path_for(args.model, args.images, args.imgsz, args.cache_dir)
+    if os.path.exists(cache_path):
+        print(f"Using cached raw predictions: {cache_path}")
+    else:
+        build_raw_cache(args.model, args.images, args.imgsz, cache_path)
+    cache = dict(np.load(cache_path))
+
+    with open(args.data, 'r', encoding='utf-8') as f:
+        class_names = yaml.safe_load(f)['names']
+    if list(cache['names']) != list(class_names):
+        print("Warning: Model class names differ from data.yaml; using the model's names.")
+        class_names = [str(n) for n in cache['names']]
+    num_classes = len(class_names)
+    weights = np.nan_to_num(load_class_metadata(class_names).weight_g).astype(np.float64)
+
+    ground_truth = load_ground_truth(labels_dir, cache['image_files'], cache['sizes'])
+    print(f"Loaded {len(ground_truth[1])} ground-truth boxes from {labels_dir}")
+    print(f"Sweeping {len(CONF_GRID)} conf x {len(IOU_GRID)} iou x {len(MAX_DET_GRID)} max_det "
+          f"over {len(cache['scores'])} cached candidates...")
+
+    sweep = run_sweep(cache, ground_truth, num_classes, weights)
+    k, m, class_conf_index, default_index, f1 = choose_operating_point(sweep, args.objective)
+
+    iou, max_det = float(IOU_GRID[k]), int(MAX_DET_GRID[m])
+    print("=" * 60)
+    print(f"BEST OPERATING POINT ({args.objective}): iou={iou} max_det={max_det} "
+          f"default conf={CONF_GRID[default_index]}")
+    print("=" * 60)
+    print(f"{'Class':<24} {'Conf':>6} {'F1':>6} {'Weight err (g)':>16}")
+    class_conf = {}
+    for cls_id, name in enumerate(class_names):
+        j = class_conf_index[cls_id]
+        class_conf[name] = float(CONF_GRID[j])
+        if sweep['n_gt'][cls_id]:
+            print(f"{name:<24} {CONF_GRID[j]:>6.2f} {f1[k, m, cls_id, j]:>6.3f} "
+                  f"{sweep['weight_error'][k, m, cls_id, j]:>16.0f}")
+
+    output = {
+        'objective': args.objective,
+        'iou': iou,
+        'max_det': max_det,
+        'default_conf': float(CONF_GRID[default_index]),
+        'class_conf': class_conf,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    print(f"\nSaved per-class thresholds to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
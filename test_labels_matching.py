@@ -1,6 +1,6 @@
 import os
+import sys
 import cv2
-import random
 import numpy as np
 
 # -------------------------------
@@ -8,77 +8,27 @@ import numpy as np
 # -------------------------------
 IMAGE_DIR = r'G:\split\imgs'     # Folder with images
 LABEL_DIR = r'G:\split\labels'     # Folder with .txt label files (YOLO format)
-IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+# Or check a split of a dataset instead: set DATA_YAML to its data.yaml (e.g. split.py's output)
+DATA_YAML = None
+SPLIT = 'train'
 
-# Class names (update with your actual classes)
-CLASS_NAMES =  [
-    # cardboard
-    'cardboard_bags', 'cardboard_boxes', 'cardboard_cups', 'cardboard_holders',
-
-    # glass
-    'glass_bottle_medium', 'glass_bottle_small', 'glass_cup', 'glass_jar', 'glass_jug',
-
-    # metal
-    'AL_foil', 'chair_iron', 'door_handle_iron', 'fan_iron', 'kettle_AL',
-    'large_can_AL', 'large_cooking_pan_AL', 'large_fork_AL', 'large_knife_AL',
-    'large_spoon_AL', 'medium_fork_AL', 'medium_spoon_AL', 'refrigerator_iron',
-    'small_can_AL', 'small_cooking_pan_AL', 'small_fork_AL', 'small_knife_AL',
-    'small_spoon_AL', 'stove_iron', 'table_iron', 'tap_iron', 'washer_machine_iron',
-
-    # paper
-    'Cartoon_paper', 'Tissue_Paper', 'newspapers', 'paper',
-
-    # plastic
-    'plastic_bags', 'plastic_bottles_large', 'plastic_bottles_medium', 'plastic_bottles_small',
-    'plastic_boxes', 'plastic_chairs', 'plastic_cups', 'plastic_utensils',
-
-    # textile
-    'child_chemise', 'child_dress', 'child_jacket', 'child_pullover',
-    'child_short', 'child_skirt', 'child_t_shirt', 'child_trouser',
-    'men_chemise', 'men_jacket', 'men_pullover', 'men_short',
-    'men_t_shirt', 'men_trouser', 'women_blouse', 'women_chemise',
-    'women_gloves', 'women_jacket', 'women_pullover', 'women_scarves',
-    'women_skirt', 'women_socks', 'women_summer_dress',
-    'women_trousers', 'women_winter_dress',
-
-    # wood
-    'King&Queen bed', 'Tall chair', 'closet', 'dining table',
-    'full bed', 'seat', 'side table'
-]
+# Class names, in class-id order (shared with the API in recycling_api/class_metadata.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recycling_api'))
+from class_metadata import AVERAGE_WEIGHTS_G, load_data_yaml_names  # noqa: E402
+CLASS_NAMES = load_data_yaml_names() or list(AVERAGE_WEIGHTS_G)  # Same order as data.yaml
+from sample_loader import PrefetchingSampler, load_split  # noqa: E402
 # -------------------------------
 
-def get_random_image_and_label(img_dir, label_dir):
-    img_files = [f for f in os.listdir(img_dir) if f.lower().endswith(IMG_EXTENSIONS)]
-    if not img_files:
-        raise ValueError("No images found in the image directory.")
-    
-    random_img = random.choice(img_files)
-    img_path = os.path.join(img_dir, random_img)
-    
-    # Corresponding label file (same name, .txt)
-    label_path = os.path.join(label_dir, os.path.splitext(random_img)[0] + '.txt')
-    
-    if not os.path.exists(label_path):
-        print(f"Warning: Label not found for {random_img}, skipping...")
-        return get_random_image_and_label(img_dir, label_dir)  # Recurse until valid pair
-    
-    return img_path, label_path, random_img
-
-def draw_yolo_boxes(image, label_path, class_names):
+def draw_yolo_boxes(image, labels, class_names):
+    """Draws YOLO rows (class, x_center, y_center, w, h; normalized) onto the image."""
     img_height, img_width = image.shape[:2]
     
-    with open(label_path, 'r') as f:
-        lines = f.readlines()
-    
-    for line in lines:
-        values = line.strip().split()
-        if len(values) < 5:
-            continue
+    for values in labels.tolist():
         class_id = int(values[0])
-        x_center = float(values[1]) * img_width
-        y_center = float(values[2]) * img_height
-        w = float(values[3]) * img_width
-        h = float(values[4]) * img_height
+        x_center = values[1] * img_width
+        y_center = values[2] * img_height
+        w = values[3] * img_width
+        h = values[4] * img_height
         
         # Convert to corner coordinates
         x1 = int(x_center - w / 2)
@@ -99,23 +49,26 @@ def draw_yolo_boxes(image, label_path, class_names):
 # Main Execution
 # -------------------------------
 def main():
-    img_path, label_path, img_name = get_random_image_and_label(IMAGE_DIR, LABEL_DIR)
-    
-    print(f"Selected Image: {img_name}")
-    print(f"Label File: {os.path.basename(label_path)}")
-    
-    # Load image
-    image = cv2.imread(img_path)
-    if image is None:
-        raise ValueError(f"Failed to load image: {img_path}")
-    
-    # Draw boxes
-    image_with_boxes = draw_yolo_boxes(image.copy(), label_path, CLASS_NAMES)
+    image_dir, label_dir, class_names = IMAGE_DIR, LABEL_DIR, CLASS_NAMES
+    if DATA_YAML:
+        image_dir, label_dir, class_names = load_split(DATA_YAML, SPLIT)
     
-    # Show image
-    cv2.imshow('Random Image with Bounding Boxes', image_with_boxes)
-    print("Press any key on the image window to exit...")
-    cv2.waitKey(0)
+    # Random images that have a label file, each at most once; the next ones are
+    # decoded in the background while one is on screen
+    with PrefetchingSampler(image_dir, label_dir, require_labels=True) as sampler:
+        print("Press any key on the image window for the next image, 'q' or ESC to exit...")
+        for sample in sampler:
+            print(f"Selected Image: {sample.name}")
+            print(f"Label File: {os.path.basename(sample.label_path)}")
+            
+            # Draw boxes
+            image_with_boxes = draw_yolo_boxes(sample.image.copy(), sample.labels, class_names)
+            
+            # Show image
+            cv2.imshow('Random Image with Bounding Boxes', image_with_boxes)
+            key = cv2.waitKey(0)
+            if key == ord('q') or key == 27:
+                break
     cv2.destroyAllWindows()
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 import os
 import torch
+import yaml
 from ultralytics import YOLO
 
 
@@ -21,6 +22,44 @@ else:
     IMG_SIZE = 416                
     print("CPU Mode")
 
+WORKERS = 8
+AMP = True
+TUNED_CACHE = None
+TUNED_DATA = None
+
+# Measured settings from profile_training.py override the defaults above on the machine they were measured on
+TRAIN_CONFIG_PATH = 'train_config.yaml'
+if os.path.exists(TRAIN_CONFIG_PATH):
+    with open(TRAIN_CONFIG_PATH, 'r', encoding='utf-8') as f:
+        tuned = yaml.safe_load(f) or {}
+    if str(tuned.get('device')) == str(DEVICE):
+        BATCH_SIZE = tuned.get('batch', BATCH_SIZE)
+        WORKERS = tuned.get('workers', WORKERS)
+        IMG_SIZE = tuned.get('imgsz', IMG_SIZE)
+        AMP = tuned.get('amp', AMP)
+        TUNED_CACHE = tuned.get('cache')
+        TUNED_DATA = tuned.get('data')
+        print(f"Using profiled settings from {TRAIN_CONFIG_PATH}")
+
+# Pre-resized cache from build_image_cache.py for this imgsz
+CACHED_YAML_PATH = f'splitted_{IMG_SIZE}/data.yaml'
+if TUNED_CACHE is not None:
+    # Train on exactly what was profiled: the recorded dataset, or (older train_config.yaml
+    # files) the profiler's rule, where only 'disk' trials use the pre-resized cache
+    YAML_PATH = TUNED_DATA or (CACHED_YAML_PATH if TUNED_CACHE == 'disk' else YAML_PATH)
+    CACHE = False if TUNED_CACHE == 'none' else TUNED_CACHE
+elif os.path.exists(CACHED_YAML_PATH):
+    # Not profiled: prefer the pre-resized cache when it exists
+    YAML_PATH = CACHED_YAML_PATH
+    CACHE = 'disk'                # load the pre-decoded .npy arrays
+else:
+    CACHE = False
+
+
+def keep_workers(trainer):
+    """ultralytics forces workers=0 on CPU; keep the configured (profiled) value instead."""
+    trainer.args.workers = WORKERS
+
 # Verify YAML
 if not os.path.exists(YAML_PATH):
     raise FileNotFoundError(f"YAML missing: {os.path.abspath(YAML_PATH)}")
@@ -29,10 +68,11 @@ if not os.path.exists(YAML_PATH):
 if __name__ == '__main__':
     print(f"\n🚀 Training: {MODEL_SIZE} on {DEVICE}")
     print(f"📁 Dataset: {YAML_PATH} | Epochs: {EPOCHS}")
-    print(f"⚙️  Batch: {BATCH_SIZE} | ImgSz: {IMG_SIZE}")
+    print(f"⚙️  Batch: {BATCH_SIZE} | ImgSz: {IMG_SIZE} | Cache: {CACHE} | Workers: {WORKERS} | AMP: {AMP}")
 
     #  Load Model
     model = YOLO(MODEL_SIZE)
+    model.add_callback('on_pretrain_routine_start', keep_workers)
 
     # TRAIN
     results = model.train(
@@ -40,6 +80,9 @@ if __name__ == '__main__':
         epochs=EPOCHS,
         imgsz=IMG_SIZE,
         batch=BATCH_SIZE,
+        cache=CACHE,
+        workers=WORKERS,
+        amp=AMP,
         device=DEVICE,
         project=PROJECT_NAME,
         name='train',